@@ -9,10 +9,92 @@ ROOT = Path(__file__).resolve().parents[1]
 class Config:
     # データベース
     DB_PATH = os.environ.get("SAKE_DB_PATH", str(ROOT / "var" / "sake.db"))
+    # 接続ごとに1回だけ設定するPRAGMA (mmapサイズ(バイト) / ページキャッシュ(KiB) / ロック待ち(ミリ秒))
+    DB_MMAP_SIZE = int(os.environ.get("DB_MMAP_SIZE", str(256 * 1024 * 1024)))
+    DB_CACHE_SIZE_KB = int(os.environ.get("DB_CACHE_SIZE_KB", str(64 * 1024)))
+    DB_BUSY_TIMEOUT_MS = int(os.environ.get("DB_BUSY_TIMEOUT_MS", "5000"))
     
     # レコメンド/検索設定
     USE_EMBEDDING = int(os.environ.get("USE_EMBEDDING", "0"))
     EMBED_PROVIDER = os.environ.get("EMBED_PROVIDER", "openai") # openai | sbert
     GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY", "")
+    EMBED_MODEL = os.environ.get("EMBED_MODEL", "models/gemini-embedding-001")
+    # sake_vectors.embedding の保存形式 (float32 | float16)
+    EMBED_STORAGE_DTYPE = os.environ.get("EMBED_STORAGE_DTYPE", "float32")
+
+    # Embedding事前計算 (scripts/compute_embeddings.py)
+    # 1リクエストあたりの件数 / 1秒あたりのリクエスト数 / 同時リクエスト数 / リトライ回数
+    EMBED_BATCH_SIZE = int(os.environ.get("EMBED_BATCH_SIZE", "32"))
+    EMBED_RATE_LIMIT = float(os.environ.get("EMBED_RATE_LIMIT", "1.0"))
+    EMBED_CONCURRENCY = int(os.environ.get("EMBED_CONCURRENCY", "4"))
+    EMBED_MAX_RETRIES = int(os.environ.get("EMBED_MAX_RETRIES", "5"))
+
+    # クエリEmbeddingキャッシュ (LRU件数上限 / TTL秒 / ディスク層のSQLiteパス、空なら無効)
+    QUERY_EMBED_CACHE_SIZE = int(os.environ.get("QUERY_EMBED_CACHE_SIZE", "1024"))
+    QUERY_EMBED_CACHE_TTL_SEC = float(os.environ.get("QUERY_EMBED_CACHE_TTL_SEC", "86400"))
+    QUERY_EMBED_CACHE_DB = os.environ.get("QUERY_EMBED_CACHE_DB", "")
+    # ディスク層に保持する件数の上限 (古いものから削除する)
+    QUERY_EMBED_CACHE_DB_MAX_ROWS = int(os.environ.get("QUERY_EMBED_CACHE_DB_MAX_ROWS", "100000"))
+
+    # 非同期版 /recommend のクエリEmbedding呼び出し
+    # タイムアウト(秒)を過ぎたら dict モードにフォールバックする
+    EMBED_TIMEOUT_SEC = float(os.environ.get("EMBED_TIMEOUT_SEC", "2.0"))
+    EMBED_MAX_CONCURRENCY = int(os.environ.get("EMBED_MAX_CONCURRENCY", "16"))
+
+    # POST /recommend のレスポンスキャッシュ
+    # 件数上限 (0で無効) / 保存するレスポンスの合計バイト数の上限 / Cache-Control の max-age(秒)
+    RECOMMEND_CACHE_SIZE = int(os.environ.get("RECOMMEND_CACHE_SIZE", "1024"))
+    RECOMMEND_CACHE_MAX_BYTES = int(os.environ.get("RECOMMEND_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+    RECOMMEND_CACHE_MAX_AGE_SEC = int(os.environ.get("RECOMMEND_CACHE_MAX_AGE_SEC", "60"))
+
+    # POST /recommend/batch: 1回に受け付ける件数 / クエリEmbeddingのバッチ取得のタイムアウト(秒)
+    RECOMMEND_BATCH_MAX = int(os.environ.get("RECOMMEND_BATCH_MAX", "1000"))
+    RECOMMEND_BATCH_EMBED_TIMEOUT_SEC = float(os.environ.get("RECOMMEND_BATCH_EMBED_TIMEOUT_SEC", "10.0"))
+
+    # /search (USE_EMBEDDING=1 の場合): keyword | semantic | hybrid
+    SEARCH_MODE = os.environ.get("SEARCH_MODE", "hybrid")
+    # /search 全体のレイテンシ予算(秒)。クエリEmbeddingが間に合わなければキーワード検索の結果だけを返す
+    SEARCH_LATENCY_BUDGET_SEC = float(os.environ.get("SEARCH_LATENCY_BUDGET_SEC", "0.5"))
+    # hybrid で融合する各リストの件数 / Reciprocal Rank Fusion の定数k
+    SEARCH_CANDIDATES = int(os.environ.get("SEARCH_CANDIDATES", "50"))
+    SEARCH_RRF_K = int(os.environ.get("SEARCH_RRF_K", "60"))
+
+    # インメモリカタログ: sake_vectors の更新確認間隔(秒)
+    CATALOG_REFRESH_SEC = float(os.environ.get("CATALOG_REFRESH_SEC", "5"))
+    # NumPyによるバッチスコアリングを使う (0: 従来のループ)
+    USE_VECTORIZED_SCORING = int(os.environ.get("USE_VECTORIZED_SCORING", "0"))
+    # 多段ランキング (候補生成 -> 候補だけを厳密にリランク) を使う
+    # 候補生成で残す件数 (味ベクトルのL2距離の上位。ANNインデックスがある場合は ANN_NPROBE で決まる)
+    USE_STAGED_RANKING = int(os.environ.get("USE_STAGED_RANKING", "0"))
+    RETRIEVE_CANDIDATES = int(os.environ.get("RETRIEVE_CANDIDATES", "300"))
+    # 多様性(RecommendationRequest.diversity)を考慮して選ぶ候補プールの件数 (スコア上位)
+    DIVERSITY_POOL = int(os.environ.get("DIVERSITY_POOL", "50"))
+    # さけのわフレーバーチャート(f1~f6)のスコアを合成する / 合成の重み (0~1)
+    USE_FLAVOR_SCORING = int(os.environ.get("USE_FLAVOR_SCORING", "0"))
+    FLAVOR_WEIGHT = float(os.environ.get("FLAVOR_WEIGHT", "0.3"))
+    # さけのわランキングによる人気度をスコアに加える / 加える重み
+    USE_POPULARITY_PRIOR = int(os.environ.get("USE_POPULARITY_PRIOR", "0"))
+    POPULARITY_WEIGHT = float(os.environ.get("POPULARITY_WEIGHT", "0.05"))
+    # 人気度の計算に使う直近の月数 / 重みが半分になる月数
+    POPULARITY_MONTHS = int(os.environ.get("POPULARITY_MONTHS", "12"))
+    POPULARITY_HALF_LIFE_MONTHS = float(os.environ.get("POPULARITY_HALF_LIFE_MONTHS", "3"))
+
+    # Embeddingモードの近似最近傍(IVF)インデックス
+    USE_ANN = int(os.environ.get("USE_ANN", "0"))
+    ANN_INDEX_PATH = os.environ.get("ANN_INDEX_PATH", str(ROOT / "var" / "ann_ivf.npz"))
+    # パーティション数 (0: sqrt(銘柄数) で自動)
+    ANN_NLIST = int(os.environ.get("ANN_NLIST", "0"))
+    # 検索時に探索するパーティション数 (大きいほど高recall・低速)
+    ANN_NPROBE = int(os.environ.get("ANN_NPROBE", "8"))
+
+    # さけのわデータAPI (scripts/loader_sakenowa.py)
+    # 接続先 (空なら本番) / 並行取得数 / 条件付きリクエスト用のレスポンスキャッシュ (空なら無効)
+    SAKENOWA_BASE_URL = os.environ.get("SAKENOWA_BASE_URL", "")
+    SAKENOWA_FETCH_CONCURRENCY = int(os.environ.get("SAKENOWA_FETCH_CONCURRENCY", "4"))
+    SAKENOWA_CACHE_DIR = os.environ.get("SAKENOWA_CACHE_DIR", str(ROOT / "var" / "sakenowa_cache"))
+
+    # 類似銘柄(アイテム間の近傍)の計算で一度に処理する起点の銘柄数
+    # メモリ使用量は NEIGHBORS_BLOCK_SIZE x 銘柄数 に比例する (銘柄数 x 銘柄数 の行列は作らない)
+    NEIGHBORS_BLOCK_SIZE = int(os.environ.get("NEIGHBORS_BLOCK_SIZE", "128"))
 
 settings = Config()
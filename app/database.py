@@ -1,6 +1,10 @@
 import json
-from typing import List, Optional, Dict, Any
-from .db.core import get_conn
+import sqlite3
+import threading
+from typing import List, Optional, Dict, Any, Tuple
+from .db.core import get_conn, get_read_conn
+from .db.codec import decode_embedding
+from .reco.vector_source import is_embedding_stale, is_taste_stale, source_hash as source_hash_of
 from .models import SakeListItem, SakeDetail, TasteProfile
 from .config import settings
 
@@ -15,14 +19,14 @@ def _map_fruity(val: float) -> str:
 
 # 全銘柄数を取得
 def get_total_sakes() -> int:
-    with get_conn() as conn:
+    with get_read_conn() as conn:
         cursor = conn.execute("SELECT COUNT(*) FROM sake_master")
         return cursor.fetchone()[0]
 
 # 銘柄一覧を取得
 def get_sakes(page: int, limit: int) -> List[SakeListItem]:
     offset = (page - 1) * limit
-    with get_conn() as conn:
+    with get_read_conn() as conn:
         cursor = conn.execute(
             "SELECT sake_id, name, brewery, prefecture FROM sake_master LIMIT ? OFFSET ?",
             (limit, offset)
@@ -32,7 +36,7 @@ def get_sakes(page: int, limit: int) -> List[SakeListItem]:
 
 # IDを指定して銘柄詳細を取得
 def get_sake_by_id(sake_id: int) -> Optional[SakeDetail]:
-    with get_conn() as conn:
+    with get_read_conn() as conn:
         # 銘柄マスタ取得
         cursor = conn.execute(
             "SELECT * FROM sake_master WHERE sake_id = ?",
@@ -62,58 +66,267 @@ def get_sake_by_id(sake_id: int) -> Optional[SakeDetail]:
         
         return SakeDetail(**sake_dict)
 
-def search_sakes(query: str, limit: int) -> List[SakeListItem]:
-    if settings.USE_EMBEDDING == 1:
-        # 将来の埋め込み検索用モック
-        print(f"DEBUG: Using Embedding Search with {settings.EMBED_PROVIDER}")
-        # 目前は空リストを返す、またはキーワード検索にフォールバック
-        return []
-    
-    with get_conn() as conn:
-        # 銘柄名または蔵元名で検索
-        sql = """
-            SELECT sake_id, name, brewery, prefecture 
-            FROM sake_master 
-            WHERE name LIKE ? OR brewery LIKE ? OR prefecture LIKE ?
-            ORDER BY prefecture ASC, brewery ASC, sake_id ASC
-            LIMIT ?
-        """
-        q = f"%{query}%"
-        cursor = conn.execute(sql, (q, q, q, limit))
-        rows = cursor.fetchall()
+# trigram トークナイザは3文字未満のクエリを引けない
+FTS_MIN_QUERY_LEN = 3
+
+# bm25 の列ごとの重み (name, brewery, prefecture, aliases, texts)
+FTS_BM25_WEIGHTS = (10.0, 5.0, 2.0, 8.0, 1.0)
+
+def _has_search_fts(conn) -> bool:
+    row = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sake_search_fts'"
+    ).fetchone()
+    return row is not None
+
+def _fts_phrase(query: str) -> str:
+    # クエリ全体を1つのフレーズとして扱う (trigramなので部分一致になる)
+    return '"' + query.replace('"', '""') + '"'
+
+def search_sakes(query: str, limit: int, in_texts: bool = False) -> List[SakeListItem]:
+    """
+    銘柄名/蔵元/都道府県/別名で部分一致検索する (in_texts=True ならレビュー/説明文も対象)
+    FTS5インデックスがあれば bm25 順、なければ(または3文字未満なら) LIKE で検索する
+    ヒットする銘柄はどちらでも同じだが、並び順は異なる
+    (FTS5: bm25 の関連度順 / LIKE: 都道府県, 蔵元, sake_id 順。limit で切る場合は返る銘柄も変わりうる)
+    """
+    with get_read_conn() as conn:
+        if len(query) >= FTS_MIN_QUERY_LEN and _has_search_fts(conn):
+            rows = _search_fts(conn, query, limit, in_texts)
+        else:
+            rows = _search_like(conn, query, limit, in_texts)
         return [SakeListItem(**dict(row)) for row in rows]
 
+def _search_fts(conn, query: str, limit: int, in_texts: bool):
+    columns = "" if in_texts else "{name brewery prefecture aliases} : "
+    weights = ", ".join(str(w) for w in FTS_BM25_WEIGHTS)
+    sql = f"""
+        SELECT m.sake_id, m.name, m.brewery, m.prefecture
+        FROM sake_search_fts f
+        JOIN sake_master m ON m.sake_id = f.rowid
+        WHERE sake_search_fts MATCH ?
+        ORDER BY bm25(sake_search_fts, {weights}) ASC, m.sake_id ASC
+        LIMIT ?
+    """
+    return conn.execute(sql, (columns + _fts_phrase(query), limit)).fetchall()
+
+def _like_pattern(query: str) -> str:
+    # % と _ はワイルドカードにせず文字として探す (FTS5 のフレーズ検索と同じ結果にする)
+    escaped = query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+def _search_like(conn, query: str, limit: int, in_texts: bool):
+    # 銘柄名または蔵元名で検索 (全件走査)
+    texts = "OR EXISTS (SELECT 1 FROM sake_texts t WHERE t.sake_id = m.sake_id AND t.text LIKE :q ESCAPE '\\')" if in_texts else ""
+    sql = f"""
+        SELECT m.sake_id, m.name, m.brewery, m.prefecture
+        FROM sake_master m
+        WHERE m.name LIKE :q ESCAPE '\\' OR m.brewery LIKE :q ESCAPE '\\' OR m.prefecture LIKE :q ESCAPE '\\'
+           OR EXISTS (SELECT 1 FROM sake_aliases a WHERE a.sake_id = m.sake_id AND a.alias LIKE :q ESCAPE '\\')
+           {texts}
+        ORDER BY m.prefecture ASC, m.brewery ASC, m.sake_id ASC
+        LIMIT :limit
+    """
+    return conn.execute(sql, {"q": _like_pattern(query), "limit": limit}).fetchall()
+
+def get_sake_neighbors(sake_id: int, method: str, catalog_version: str) -> List[Tuple[int, float, float]]:
+    """
+    事前計算済みの類似銘柄を順位順に返す (指定したカタログのバージョンで計算したもののみ)
+    主キー (sake_id, method, rank) の範囲読み取りなので銘柄数によらず軽量
+    Returns: (neighbor_id, score, distance) のリスト、なければ空
+    """
+    with get_read_conn() as conn:
+        try:
+            rows = conn.execute("""
+                SELECT neighbor_id, score, distance
+                FROM sake_neighbors
+                WHERE sake_id = ? AND method = ? AND catalog_version = ?
+                ORDER BY rank ASC
+            """, (sake_id, method, catalog_version)).fetchall()
+        except sqlite3.OperationalError:
+            # sake_neighbors が未作成のDB
+            return []
+        return [(row["neighbor_id"], row["score"], row["distance"]) for row in rows]
+
+def get_changed_sake_ids(since_run_id: Optional[int] = None) -> Tuple[Optional[int], List[int]]:
+    """
+    取り込み(ingest_runs)で内容が変わった sake_id を返す (ingest_changes)
+    since_run_id 以降の成功した取り込みが対象。None なら最新の成功した取り込みのみ
+    Returns: (対象の最初の run_id, sake_id のリスト(昇順))
+    """
+    with get_read_conn() as conn:
+        try:
+            if since_run_id is None:
+                row = conn.execute("SELECT MAX(run_id) FROM ingest_runs WHERE status = 'success'").fetchone()
+                since_run_id = row[0]
+                if since_run_id is None:
+                    return None, []
+            rows = conn.execute("""
+                SELECT DISTINCT c.sake_id
+                FROM ingest_changes c
+                JOIN ingest_runs r ON r.run_id = c.run_id
+                WHERE c.run_id >= ? AND r.status = 'success'
+                ORDER BY c.sake_id
+            """, (since_run_id,)).fetchall()
+        except sqlite3.OperationalError:
+            # ingest_changes が未作成のDB
+            return since_run_id, []
+        return since_run_id, [row[0] for row in rows]
+
+def get_vector_sources(sake_ids: Optional[List[int]] = None) -> List[Dict[str, Any]]:
+    """
+    全銘柄(sake_ids を指定した場合はその銘柄のみ)について、ベクトル計算の入力と保存済みベクトルのハッシュ/バージョンを取得する
+    current_hash: 現在の入力(銘柄名/蔵元/都道府県/sake_texts)のハッシュ
+    """
+    # sake_ids はJSON配列として1つのパラメータで渡す
+    ids_filter, params = "", ()
+    if sake_ids is not None:
+        ids_filter, params = "WHERE {col} IN (SELECT value FROM json_each(?))", (json.dumps(list(sake_ids)),)
+    with get_read_conn() as conn:
+        # 差分計算用カラムがない古いDBでは NULL (= 要再計算) として扱う
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(sake_vectors)")}
+        source_hash = "v.source_hash" if "source_hash" in columns else "NULL"
+        embedding_hash = "v.embedding_source_hash" if "embedding_source_hash" in columns else "NULL"
+        sql = f"""
+            SELECT
+                m.sake_id, m.name, m.brewery, m.prefecture,
+                v.sake_id IS NOT NULL as has_vector,
+                v.version,
+                {source_hash} as source_hash,
+                {embedding_hash} as embedding_source_hash
+            FROM sake_master m
+            LEFT JOIN sake_vectors v ON m.sake_id = v.sake_id
+            {ids_filter.format(col="m.sake_id")}
+            ORDER BY m.sake_id
+        """
+        rows = [dict(row) for row in conn.execute(sql, params).fetchall()]
+
+        # テキストは text_id 順に並べてハッシュを安定させる
+        texts: Dict[int, List[str]] = {}
+        texts_sql = f"SELECT sake_id, text FROM sake_texts {ids_filter.format(col='sake_id')} ORDER BY sake_id, text_id"
+        for row in conn.execute(texts_sql, params):
+            texts.setdefault(row["sake_id"], []).append(row["text"])
+
+    for d in rows:
+        d["has_vector"] = bool(d["has_vector"])
+        d["texts"] = texts.get(d["sake_id"], [])
+        d["current_hash"] = source_hash_of(d["name"], d["brewery"], d["prefecture"], d["texts"])
+    return rows
+
+# get_vector_status の再計算待ち件数のキャッシュ (キー: DB, Embeddingモデル, vector_status_version)
+_pending_cache_lock = threading.Lock()
+_pending_cache: Dict[str, Any] = {"key": None, "counts": None}
+
+def _vector_status_version(conn: sqlite3.Connection) -> Optional[int]:
+    # トリガーで保守している変更カウンタ (無い古いDBでは None = 毎回数える)
+    if not _has_table(conn, "vector_status_version", "version"):
+        return None
+    row = conn.execute("SELECT version FROM vector_status_version WHERE id = 1").fetchone()
+    return row[0] if row else None
+
 def get_vector_status() -> Dict[str, Any]:
-    with get_conn() as conn:
-        # 全銘柄数
+    """
+    ベクトル計算の状況を取得する
+    再計算待ちの件数は全銘柄の入力をハッシュし直して数えるため、
+    銘柄/テキスト/ベクトルが変わっていなければ (vector_status_version が同じなら) 前回の件数を返す
+    """
+    with get_read_conn() as conn:
+        # 件数を数える前にカウンタを読む (数えている間に変わった場合は次回数え直す)
+        version = _vector_status_version(conn)
+
         total_sakes = conn.execute("SELECT COUNT(*) FROM sake_master").fetchone()[0]
-        
+
         # 計算済みベクトル数
         total_vectors = conn.execute("SELECT COUNT(*) FROM sake_vectors").fetchone()[0]
         
         # 最新計算日時
         last_computed = conn.execute("SELECT MAX(computed_at) FROM sake_vectors").fetchone()[0]
-        
-        return {
-            "total_sakes": total_sakes,
-            "total_vectors": total_vectors,
-            "pending_count": max(0, total_sakes - total_vectors),
-            "last_computed_at": last_computed
-        }
+
+    key = (settings.DB_PATH, settings.EMBED_MODEL, version)
+    with _pending_cache_lock:
+        counts = _pending_cache["counts"] if version is not None and _pending_cache["key"] == key else None
+    if counts is None:
+        # 未計算に加え、入力テキストやバージョン(モデル)が変わった銘柄も再計算待ちとして数える
+        sources = get_vector_sources()
+        counts = (
+            sum(1 for d in sources if is_taste_stale(d)),
+            sum(1 for d in sources if is_embedding_stale(d, settings.EMBED_MODEL)),
+        )
+        with _pending_cache_lock:
+            _pending_cache["key"] = key
+            _pending_cache["counts"] = counts
+    return {
+        "total_sakes": total_sakes,
+        "total_vectors": total_vectors,
+        "pending_count": counts[0],
+        "pending_embedding_count": counts[1],
+        "last_computed_at": last_computed
+    }
+
+def get_vector_fingerprint() -> Tuple[Any, ...]:
+    """
+    カタログの更新検知用フィンガープリントを取得する
+    ((sake_vectors の件数, 最新computed_at, versionの最小/最大), さけのわ取り込みの変更カウンタ)
+    先頭要素は sake_vectors だけから作る (近傍(sake_neighbors)の鮮度判定用。Catalog.neighbor_version)
+    sake_vectors は idx_sake_vectors_fingerprint のカバリングインデックス、カウンタは1行のテーブルなので軽量
+    (フレーバーチャート/ランキングの中身は走査しない。取り込みで行が変わったときだけカウンタが増える)
+    """
+    sql = """
+        SELECT COUNT(*), MAX(computed_at), MIN(version), MAX(version)
+        FROM sake_vectors
+    """
+    with get_read_conn() as conn:
+        vectors = tuple(conn.execute(sql).fetchone())
+        data_version = None
+        if _has_table(conn, "catalog_data_version", "version"):
+            row = conn.execute("SELECT version FROM catalog_data_version WHERE id = 1").fetchone()
+            data_version = row[0] if row else None
+        return (vectors, data_version)
+
+def _has_table(conn: sqlite3.Connection, table: str, column: str) -> bool:
+    """
+    テーブルが存在し、指定したカラムを持つか
+    (後から追加したテーブルや、旧スキーマのままの既存DBを見分けるために使う)
+    """
+    columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+    return column in columns
+
+def get_ranking_history() -> List[Tuple[int, int, int]]:
+    """
+    さけのわランキングを銘柄(sake_id)単位で取得する (人気度の計算用)
+    Returns: (sake_id, yearMonth, rank) のリスト。ランキング未取り込みなら空
+    """
+    sql = """
+        SELECT m.sake_id, r.yearMonth, r.rank
+        FROM sakenowa_rankings r
+        JOIN sake_master m ON m.external_sakenowa_id = r.brandId
+        ORDER BY r.yearMonth, r.rank
+    """
+    with get_read_conn() as conn:
+        if not _has_table(conn, "sakenowa_rankings", "yearMonth"):
+            return []
+        return [tuple(row) for row in conn.execute(sql)]
 
 def get_all_sakes_with_vectors() -> List[Dict[str, Any]]:
     """
     レコメンデーション用に全銘柄とベクトルを取得する
     JOIN sake_master and sake_vectors
+    さけのわのフレーバーチャートがあれば flavor に [f1, ..., f6] を入れる (無い銘柄は None)
     """
-    sql = """
-        SELECT 
-            m.sake_id, m.name, m.brewery, m.prefecture,
-            v.taste_vector, v.embedding
-        FROM sake_master m
-        JOIN sake_vectors v ON m.sake_id = v.sake_id
-    """
-    with get_conn() as conn:
+    with get_read_conn() as conn:
+        if _has_table(conn, "sakenowa_flavor_charts", "brandId"):
+            flavor_cols = "fc.f1, fc.f2, fc.f3, fc.f4, fc.f5, fc.f6"
+            flavor_join = "LEFT JOIN sakenowa_flavor_charts fc ON fc.brandId = m.external_sakenowa_id"
+        else:
+            flavor_cols = "NULL AS f1, NULL AS f2, NULL AS f3, NULL AS f4, NULL AS f5, NULL AS f6"
+            flavor_join = ""
+        sql = f"""
+            SELECT 
+                m.sake_id, m.name, m.brewery, m.prefecture,
+                v.taste_vector, v.embedding, {flavor_cols}
+            FROM sake_master m
+            JOIN sake_vectors v ON m.sake_id = v.sake_id
+            {flavor_join}
+        """
         cursor = conn.execute(sql)
         rows = cursor.fetchall()
         
@@ -125,16 +338,15 @@ def get_all_sakes_with_vectors() -> List[Dict[str, Any]]:
             else:
                 d["vector"] = [0.0, 0.0, 0.0, 0.0]
             
-            # Embeddingの取得
-            if d.get("embedding"):
-                try:
-                    # BLOB/TEXTのどちらでもJSONデコードを試みる
-                    d["embedding"] = json.loads(d["embedding"])
-                except Exception as e:
-                    print(f"Error parsing embedding for sake_id={d['sake_id']}: {e}")
-                    d["embedding"] = None
-            else:
+            # Embeddingの取得 (バイナリ形式/旧JSON形式の両方に対応)
+            try:
+                d["embedding"] = decode_embedding(d.get("embedding"))
+            except Exception as e:
+                print(f"Error parsing embedding for sake_id={d['sake_id']}: {e}")
                 d["embedding"] = None
 
+            chart = [d.pop(f"f{i}") for i in range(1, 7)]
+            d["flavor"] = None if any(f is None for f in chart) else chart
+
             results.append(d)
         return results
@@ -0,0 +1,72 @@
+import json
+import struct
+from typing import NamedTuple, Optional, Union
+
+import numpy as np
+
+# sake_vectors.embedding のバイナリ形式
+#
+#   magic(4) | format(1) | dtype(1) | model_len(2) | dim(4) | model(utf-8) | values(little endian)
+#
+# 旧形式(JSON文字列)も decode_embedding で読めるようにしておく
+MAGIC = b"SKEV"
+FORMAT_VERSION = 1
+_HEADER = struct.Struct("<4sBBHI")
+
+_DTYPE_CODES = {"float32": 1, "float16": 2}
+_CODE_DTYPES = {code: name for name, code in _DTYPE_CODES.items()}
+
+
+class EmbeddingHeader(NamedTuple):
+    dim: int
+    dtype: str
+    model: str
+
+
+def encode_embedding(values, dtype: str = "float32", model: str = "") -> bytes:
+    """
+    Embeddingをヘッダつきのバイナリにエンコードする
+    """
+    if dtype not in _DTYPE_CODES:
+        raise ValueError(f"Unsupported embedding dtype: {dtype}")
+    arr = np.asarray(values, dtype=np.dtype(dtype).newbyteorder("<"))
+    model_bytes = model.encode("utf-8")
+    header = _HEADER.pack(MAGIC, FORMAT_VERSION, _DTYPE_CODES[dtype], len(model_bytes), arr.shape[0])
+    return header + model_bytes + arr.tobytes()
+
+
+def is_binary_embedding(raw: Union[bytes, str, None]) -> bool:
+    return isinstance(raw, (bytes, bytearray, memoryview)) and bytes(raw[:4]) == MAGIC
+
+
+def read_header(raw: Union[bytes, str, None]) -> Optional[EmbeddingHeader]:
+    """
+    バイナリ形式のヘッダを読む (旧JSON形式や空の場合は None)
+    """
+    if not is_binary_embedding(raw):
+        return None
+    magic, fmt, dtype_code, model_len, dim = _HEADER.unpack_from(raw)
+    if fmt != FORMAT_VERSION or dtype_code not in _CODE_DTYPES:
+        raise ValueError(f"Unknown embedding format: format={fmt}, dtype={dtype_code}")
+    model = bytes(raw[_HEADER.size:_HEADER.size + model_len]).decode("utf-8")
+    return EmbeddingHeader(dim=dim, dtype=_CODE_DTYPES[dtype_code], model=model)
+
+
+def decode_embedding(raw: Union[bytes, str, None]) -> Optional[np.ndarray]:
+    """
+    sake_vectors.embedding の値をデコードする
+    バイナリ形式と旧JSON形式(TEXT/BLOB)の両方に対応する
+    """
+    if raw is None or len(raw) == 0:
+        return None
+
+    header = read_header(raw)
+    if header is None:
+        # 旧形式: JSON文字列
+        if isinstance(raw, (bytes, bytearray, memoryview)):
+            raw = bytes(raw).decode("utf-8")
+        return np.asarray(json.loads(raw), dtype=np.float64)
+
+    offset = _HEADER.size + len(header.model.encode("utf-8"))
+    dtype = np.dtype(header.dtype).newbyteorder("<")
+    return np.frombuffer(raw, dtype=dtype, count=header.dim, offset=offset)
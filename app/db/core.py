@@ -1,18 +1,237 @@
 import sqlite3
+import threading
+import time
+import weakref
 from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional, Tuple
 from ..config import settings
 
-def connect() -> sqlite3.Connection:
-    conn = sqlite3.connect(settings.DB_PATH)
+def connect(read_only: bool = False) -> sqlite3.Connection:
+    """
+    接続を開き、PRAGMAを1回だけ設定する
+    read_only=True の接続は query_only にして書き込みを禁止する
+    """
+    # 読み取り用はスレッド終了後に別スレッドから閉じることがあるため check_same_thread=False
+    conn = sqlite3.connect(settings.DB_PATH, check_same_thread=False)
     conn.row_factory = sqlite3.Row
     conn.execute("PRAGMA foreign_keys = ON;") # 外部キー制約を有効化
+    conn.execute(f"PRAGMA busy_timeout = {int(settings.DB_BUSY_TIMEOUT_MS)};")
+    conn.execute(f"PRAGMA mmap_size = {int(settings.DB_MMAP_SIZE)};")
+    # 負の値はKiB単位
+    conn.execute(f"PRAGMA cache_size = {-int(settings.DB_CACHE_SIZE_KB)};")
+    # WALなら読み取りが書き込みにブロックされない (設定はDBファイルに永続化され、切り替え済みなら何もしない)
+    conn.execute("PRAGMA journal_mode = WAL;")
+    if read_only:
+        conn.execute("PRAGMA query_only = ON;")
+    else:
+        conn.execute("PRAGMA synchronous = NORMAL;")
     return conn
 
+
+class ConnectionPool:
+    """
+    プロセス内で使い回すSQLite接続のプール
+
+    - 読み取り: スレッドごとに1本の query_only 接続を持ち続ける
+    - 書き込み: 1本の接続をロックで直列化して共有する
+    DB_PATH が変わった場合は接続を作り直す。
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # スレッドID -> (スレッドへの弱参照, 接続)
+        self._readers: Dict[int, Tuple[Any, sqlite3.Connection]] = {}
+        self._writer: Optional[sqlite3.Connection] = None
+        self._writer_path: Optional[str] = None
+        self._writer_lock = threading.RLock()
+        # writer() の入れ子の深さ (_writer_lock を保持しているスレッドだけが触る)
+        self._writer_depth = 0
+        self.connects = 0
+        self.checkouts = 0
+        self.checkout_sec_total = 0.0
+        self.checkout_sec_max = 0.0
+
+    def _record_checkout(self, started: float) -> None:
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.checkouts += 1
+            self.checkout_sec_total += elapsed
+            self.checkout_sec_max = max(self.checkout_sec_max, elapsed)
+
+    def _ensure_writer(self) -> sqlite3.Connection:
+        # 呼び出し側で _writer_lock を保持していること
+        if self._writer is None or self._writer_path != settings.DB_PATH:
+            if self._writer is not None:
+                self._writer.close()
+            self._writer = connect()
+            self._writer_path = settings.DB_PATH
+            with self._lock:
+                self.connects += 1
+        return self._writer
+
+    def reader(self) -> sqlite3.Connection:
+        """
+        呼び出し元スレッド専用の読み取り接続を返す
+        """
+        started = time.perf_counter()
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.path != settings.DB_PATH:
+            if conn is not None:
+                conn.close()
+            # 書き込み接続とは独立に開く (長い書き込みの間も待たない)
+            conn = connect(read_only=True)
+            self._local.conn = conn
+            self._local.path = settings.DB_PATH
+            thread = threading.current_thread()
+            with self._lock:
+                self.connects += 1
+                self._prune()
+                self._readers[thread.ident] = (weakref.ref(thread), conn)
+        self._record_checkout(started)
+        return conn
+
+    @contextmanager
+    def writer(self) -> Iterator[sqlite3.Connection]:
+        """
+        書き込み接続を排他的に借りる。正常終了でcommit、例外ならrollbackする
+
+        同じスレッドで入れ子に借りた場合は同じ接続を返す。commit/rollback は一番外側だけで行い、
+        内側のブロックはSAVEPOINTで囲む (内側の例外は内側の変更だけを取り消して送出する)
+        """
+        started = time.perf_counter()
+        with self._writer_lock:
+            if self._writer_depth:
+                conn = self._writer
+                self._record_checkout(started)
+                yield from self._nested(conn)
+                return
+            conn = self._ensure_writer()
+            self._record_checkout(started)
+            self._writer_depth = 1
+            try:
+                yield conn
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+            finally:
+                self._writer_depth = 0
+
+    def _nested(self, conn: sqlite3.Connection) -> Iterator[sqlite3.Connection]:
+        # 呼び出し側で _writer_lock を保持していること
+        name = f"writer_{self._writer_depth}"
+        if not conn.in_transaction:
+            # トランザクション外の SAVEPOINT は RELEASE でcommitされてしまうため、先に外側のトランザクションを始める
+            conn.execute("BEGIN")
+        conn.execute(f"SAVEPOINT {name}")
+        self._writer_depth += 1
+        try:
+            yield conn
+        except BaseException:
+            conn.execute(f"ROLLBACK TO {name}")
+            conn.execute(f"RELEASE {name}")
+            raise
+        else:
+            conn.execute(f"RELEASE {name}")
+        finally:
+            self._writer_depth -= 1
+
+    def _prune(self) -> None:
+        # 終了したスレッドの読み取り接続を閉じる (呼び出し側で _lock を保持していること)
+        for ident, (ref, conn) in list(self._readers.items()):
+            thread = ref()
+            if thread is None or not thread.is_alive():
+                conn.close()
+                del self._readers[ident]
+
+    def close_all(self) -> None:
+        with self._lock:
+            for _, conn in self._readers.values():
+                conn.close()
+            self._readers.clear()
+        with self._writer_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+        self._local = threading.local()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._prune()
+            return {
+                "readers": len(self._readers),
+                "writer": self._writer is not None,
+                "connects": self.connects,
+                "checkouts": self.checkouts,
+                "checkout_ms_avg": self.checkout_sec_total / self.checkouts * 1000 if self.checkouts else 0.0,
+                "checkout_ms_max": self.checkout_sec_max * 1000,
+            }
+
+
+pool = ConnectionPool()
+
 @contextmanager
 def get_conn():
-    conn = connect()
-    try:
+    """
+    書き込み用の接続 (プロセス内で1本を共有、ブロック終了時にcommit)
+    """
+    with pool.writer() as conn:
         yield conn
+
+@contextmanager
+def get_read_conn():
+    """
+    読み取り専用の接続 (スレッドごとに使い回す、閉じない)
+    """
+    yield pool.reader()
+
+SCHEMA_PATH = Path(__file__).resolve().parent / "schema.sql"
+
+def apply_schema(conn: sqlite3.Connection) -> None:
+    """
+    schema.sql を適用する (CREATE ... IF NOT EXISTS のみなので既存DBにも安全に実行できる)
+    後から追加したテーブルを既存DBに作るために使う
+    """
+    legacy_neighbors = _rename_legacy_neighbors(conn)
+    conn.executescript(SCHEMA_PATH.read_text(encoding="utf-8"))
+    if legacy_neighbors:
+        # 旧テーブルの行を新しい主キーのテーブルに移す
+        conn.execute("""
+            INSERT OR IGNORE INTO sake_neighbors
+                (sake_id, rank, neighbor_id, score, distance, method, catalog_version, computed_at)
+            SELECT sake_id, rank, neighbor_id, score, distance, method, catalog_version, computed_at
+            FROM _sake_neighbors_legacy
+        """)
+        conn.execute("DROP TABLE _sake_neighbors_legacy")
         conn.commit()
-    finally:
-        conn.close()
+
+def _rename_legacy_neighbors(conn: sqlite3.Connection) -> bool:
+    """
+    主キーが (sake_id, rank) の旧 sake_neighbors を退避する
+    (method ごとに保持できず、別の方式で書き出すと既存の行が消えるため (sake_id, method, rank) に作り直す)
+    Returns: 退避した場合 True
+    """
+    pk = [row[1] for row in sorted(conn.execute("PRAGMA table_info(sake_neighbors)"), key=lambda r: r[5]) if row[5]]
+    if not pk or "method" in pk:
+        return False
+    print("Migrating sake_neighbors primary key to (sake_id, method, rank)")
+    conn.execute("ALTER TABLE sake_neighbors RENAME TO _sake_neighbors_legacy")
+    return True
+
+# 既存DBに後から追加したカラム (schema.sql の CREATE TABLE IF NOT EXISTS では追加されない)
+_VECTOR_COLUMNS = {
+    "source_hash": "TEXT",
+    "embedding_source_hash": "TEXT",
+}
+
+def ensure_vector_columns(conn: sqlite3.Connection) -> None:
+    """
+    sake_vectors に差分計算用のカラムがなければ追加する
+    """
+    existing = {row[1] for row in conn.execute("PRAGMA table_info(sake_vectors)")}
+    for name, col_type in _VECTOR_COLUMNS.items():
+        if name not in existing:
+            print(f"Adding '{name}' column to sake_vectors")
+            conn.execute(f"ALTER TABLE sake_vectors ADD COLUMN {name} {col_type}")
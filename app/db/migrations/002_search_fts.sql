@@ -0,0 +1,87 @@
+-- Migration: 002_search_fts
+-- /search 用の全文検索インデックス (FTS5, trigramトークナイザ)
+-- trigram なので日本語でも分かち書きせずに部分一致(3文字以上)で引ける。
+-- 1銘柄 = 1行 (rowid = sake_id)。別名とテキストは銘柄ごとに連結して持つ。
+-- 何度実行してもよい (最後にインデックスを作り直す)。
+
+CREATE VIRTUAL TABLE IF NOT EXISTS sake_search_fts USING fts5(
+  name,        -- 銘柄名
+  brewery,     -- 蔵元
+  prefecture,  -- 都道府県
+  aliases,     -- 表記ゆれ/別名 (スペース区切り)
+  texts,       -- レビュー/説明文 (スペース区切り)
+  tokenize = 'trigram'
+);
+
+-- sake_master の変更を反映する
+CREATE TRIGGER IF NOT EXISTS trg_sake_master_fts_insert AFTER INSERT ON sake_master BEGIN
+  INSERT INTO sake_search_fts (rowid, name, brewery, prefecture, aliases, texts)
+  VALUES (
+    new.sake_id, new.name, new.brewery, new.prefecture,
+    (SELECT GROUP_CONCAT(alias, ' ') FROM sake_aliases WHERE sake_id = new.sake_id),
+    (SELECT GROUP_CONCAT(text, ' ') FROM sake_texts WHERE sake_id = new.sake_id)
+  );
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_sake_master_fts_update AFTER UPDATE OF name, brewery, prefecture ON sake_master BEGIN
+  UPDATE sake_search_fts
+  SET name = new.name, brewery = new.brewery, prefecture = new.prefecture
+  WHERE rowid = new.sake_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_sake_master_fts_delete AFTER DELETE ON sake_master BEGIN
+  DELETE FROM sake_search_fts WHERE rowid = old.sake_id;
+END;
+
+-- sake_aliases の変更を反映する (該当銘柄の aliases 列を作り直す)
+CREATE TRIGGER IF NOT EXISTS trg_sake_aliases_fts_insert AFTER INSERT ON sake_aliases BEGIN
+  UPDATE sake_search_fts
+  SET aliases = (SELECT GROUP_CONCAT(alias, ' ') FROM sake_aliases WHERE sake_id = new.sake_id)
+  WHERE rowid = new.sake_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_sake_aliases_fts_update AFTER UPDATE ON sake_aliases BEGIN
+  UPDATE sake_search_fts
+  SET aliases = (SELECT GROUP_CONCAT(alias, ' ') FROM sake_aliases WHERE sake_id = old.sake_id)
+  WHERE rowid = old.sake_id;
+  UPDATE sake_search_fts
+  SET aliases = (SELECT GROUP_CONCAT(alias, ' ') FROM sake_aliases WHERE sake_id = new.sake_id)
+  WHERE rowid = new.sake_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_sake_aliases_fts_delete AFTER DELETE ON sake_aliases BEGIN
+  UPDATE sake_search_fts
+  SET aliases = (SELECT GROUP_CONCAT(alias, ' ') FROM sake_aliases WHERE sake_id = old.sake_id)
+  WHERE rowid = old.sake_id;
+END;
+
+-- sake_texts の変更を反映する (該当銘柄の texts 列を作り直す)
+CREATE TRIGGER IF NOT EXISTS trg_sake_texts_fts_insert AFTER INSERT ON sake_texts BEGIN
+  UPDATE sake_search_fts
+  SET texts = (SELECT GROUP_CONCAT(text, ' ') FROM sake_texts WHERE sake_id = new.sake_id)
+  WHERE rowid = new.sake_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_sake_texts_fts_update AFTER UPDATE ON sake_texts BEGIN
+  UPDATE sake_search_fts
+  SET texts = (SELECT GROUP_CONCAT(text, ' ') FROM sake_texts WHERE sake_id = old.sake_id)
+  WHERE rowid = old.sake_id;
+  UPDATE sake_search_fts
+  SET texts = (SELECT GROUP_CONCAT(text, ' ') FROM sake_texts WHERE sake_id = new.sake_id)
+  WHERE rowid = new.sake_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_sake_texts_fts_delete AFTER DELETE ON sake_texts BEGIN
+  UPDATE sake_search_fts
+  SET texts = (SELECT GROUP_CONCAT(text, ' ') FROM sake_texts WHERE sake_id = old.sake_id)
+  WHERE rowid = old.sake_id;
+END;
+
+-- 既存データからインデックスを作り直す
+DELETE FROM sake_search_fts;
+INSERT INTO sake_search_fts (rowid, name, brewery, prefecture, aliases, texts)
+SELECT
+  m.sake_id, m.name, m.brewery, m.prefecture,
+  (SELECT GROUP_CONCAT(alias, ' ') FROM sake_aliases a WHERE a.sake_id = m.sake_id),
+  (SELECT GROUP_CONCAT(text, ' ') FROM sake_texts t WHERE t.sake_id = m.sake_id)
+FROM sake_master m;
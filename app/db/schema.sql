@@ -40,9 +40,25 @@ CREATE TABLE IF NOT EXISTS sake_vectors (
   taste_vector TEXT NOT NULL,  -- JSON文字列で保存(例: "[0.2,-0.4,1.0,0.6]")
   computed_at TEXT NOT NULL DEFAULT (datetime('now')),  -- 計算日時
   version TEXT NOT NULL DEFAULT 'v1',  -- バージョン
+  source_hash TEXT,  -- taste_vector 計算時の入力ハッシュ(差分計算用)
+  embedding_source_hash TEXT,  -- embedding 計算時の入力+モデルのハッシュ(差分計算用)
   FOREIGN KEY (sake_id) REFERENCES sake_master(sake_id) ON DELETE CASCADE
 );
 
+-- 類似銘柄(アイテム間の近傍、事前計算結果)
+CREATE TABLE IF NOT EXISTS sake_neighbors (
+  sake_id INTEGER NOT NULL,  -- 起点の銘柄ID
+  rank INTEGER NOT NULL,  -- 順位(1始まり)
+  neighbor_id INTEGER NOT NULL,  -- 類似銘柄のID
+  score REAL NOT NULL,  -- スコア
+  distance REAL NOT NULL,  -- 距離
+  method TEXT NOT NULL,  -- 'auto'(Embedding優先) / 'taste'(味ベクトルのみ)
+  catalog_version TEXT NOT NULL,  -- 計算時のカタログのバージョン(鮮度判定用)
+  computed_at TEXT NOT NULL DEFAULT (datetime('now')),  -- 計算日時
+  PRIMARY KEY (sake_id, method, rank),  -- 方式ごとに保持する
+  FOREIGN KEY (sake_id) REFERENCES sake_master(sake_id) ON DELETE CASCADE
+) WITHOUT ROWID;
+
 -- 取り込みログ
 CREATE TABLE IF NOT EXISTS ingest_runs ( 
   run_id INTEGER PRIMARY KEY AUTOINCREMENT,  -- 取り込みID
@@ -53,7 +69,63 @@ CREATE TABLE IF NOT EXISTS ingest_runs (
   detail TEXT  -- 詳細
 );
 
+-- 取り込みで内容が変わった銘柄 (ベクトルの差分再計算の対象)
+CREATE TABLE IF NOT EXISTS ingest_changes (
+  run_id INTEGER NOT NULL,  -- 取り込みID
+  sake_id INTEGER NOT NULL,  -- 銘柄ID
+  kind TEXT NOT NULL,  -- 'insert'(新規) / 'update'(銘柄名/蔵元/都道府県) / 'tags'(さけのわタグ)
+  PRIMARY KEY (run_id, sake_id, kind),
+  FOREIGN KEY (run_id) REFERENCES ingest_runs(run_id) ON DELETE CASCADE,
+  FOREIGN KEY (sake_id) REFERENCES sake_master(sake_id) ON DELETE CASCADE
+) WITHOUT ROWID;
+
+-- さけのわ取り込みでカタログの内容(銘柄マスタ/フレーバーチャート/ランキング)が変わった回数 (カタログの更新検知用、1行のみ)
+CREATE TABLE IF NOT EXISTS catalog_data_version (
+  id INTEGER PRIMARY KEY CHECK (id = 1),
+  version INTEGER NOT NULL  -- 取り込みで行が変わったときだけ1増える
+);
+INSERT OR IGNORE INTO catalog_data_version (id, version) VALUES (1, 0);
+
+-- ベクトル計算の入力/結果の変更カウンタ (/vectors/status の再計算待ち件数のキャッシュ判定用、1行のみ)
+CREATE TABLE IF NOT EXISTS vector_status_version (
+  id INTEGER PRIMARY KEY CHECK (id = 1),
+  version INTEGER NOT NULL  -- 銘柄/テキスト/ベクトルが変わるたびに1増える
+);
+INSERT OR IGNORE INTO vector_status_version (id, version) VALUES (1, 0);
+
+CREATE TRIGGER IF NOT EXISTS trg_sake_master_status_insert AFTER INSERT ON sake_master BEGIN
+  UPDATE vector_status_version SET version = version + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_sake_master_status_update AFTER UPDATE OF name, brewery, prefecture ON sake_master BEGIN
+  UPDATE vector_status_version SET version = version + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_sake_master_status_delete AFTER DELETE ON sake_master BEGIN
+  UPDATE vector_status_version SET version = version + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_sake_texts_status_insert AFTER INSERT ON sake_texts BEGIN
+  UPDATE vector_status_version SET version = version + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_sake_texts_status_update AFTER UPDATE ON sake_texts BEGIN
+  UPDATE vector_status_version SET version = version + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_sake_texts_status_delete AFTER DELETE ON sake_texts BEGIN
+  UPDATE vector_status_version SET version = version + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_sake_vectors_status_insert AFTER INSERT ON sake_vectors BEGIN
+  UPDATE vector_status_version SET version = version + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_sake_vectors_status_update AFTER UPDATE ON sake_vectors BEGIN
+  UPDATE vector_status_version SET version = version + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_sake_vectors_status_delete AFTER DELETE ON sake_vectors BEGIN
+  UPDATE vector_status_version SET version = version + 1;
+END;
+
 -- インデックス(最低限)
 CREATE INDEX IF NOT EXISTS idx_sake_master_name ON sake_master(name);
 CREATE INDEX IF NOT EXISTS idx_sake_master_brewery ON sake_master(brewery);
-CREATE INDEX IF NOT EXISTS idx_sake_texts_sake_id ON sake_texts(sake_id);
\ No newline at end of file
+-- さけのわ取り込み時の突き合わせ用
+CREATE UNIQUE INDEX IF NOT EXISTS idx_sake_master_external_sakenowa_id ON sake_master(external_sakenowa_id) WHERE external_sakenowa_id IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_sake_texts_sake_id ON sake_texts(sake_id);
+-- カタログ更新検知用 (COUNT/MAX(computed_at)/version をインデックスのみで取得する)
+CREATE INDEX IF NOT EXISTS idx_sake_vectors_fingerprint ON sake_vectors(computed_at, version);
@@ -1,5 +1,7 @@
-from fastapi import FastAPI, HTTPException, Query
-from typing import Optional
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Header, HTTPException, Query
+from fastapi.responses import Response, StreamingResponse
+from typing import List, Optional
 from . import database as db
 from .models import (
     SakeListResponse, 
@@ -8,16 +10,39 @@ from .models import (
     SakeListItem,
     VectorStatusResponse,
     RecommendationRequest,
-    RecommendationResponse
+    RecommendationResponse,
+    RecommendationFilters,
+    SimilarSakesResponse,
+    BatchRecommendationRequest,
+    BatchRecommendationResponse
 )
-from .reco import engine
+from .db.core import pool
+from .reco import catalog, engine, neighbors, search
+from .reco.embedding import query_cache
+from .reco.response_cache import recommend_cache
+from .config import settings
 
-app = FastAPI(title="Sake Recommendation API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 起動時にカタログ/ANNインデックスを読み込んでおく
+    engine.warm_up()
+    yield
+    pool.close_all()
+
+app = FastAPI(title="Sake Recommendation API", lifespan=lifespan)
 
 @app.get("/health")
 def health():
     return {"status": "ok"}
 
+@app.get("/metrics")
+def get_metrics():
+    return {
+        "query_embedding_cache": query_cache.stats(),
+        "recommend_cache": recommend_cache.stats(),
+        "db_pool": pool.stats(),
+    }
+
 @app.get("/vectors/status", response_model=VectorStatusResponse)
 def get_vector_status():
     return db.get_vector_status()
@@ -43,14 +68,69 @@ def get_sake(sake_id: int):
         raise HTTPException(status_code=404, detail="Sake not found")
     return sake
 
+@app.get("/sakes/{sake_id}/similar", response_model=SimilarSakesResponse)
+def get_similar_sakes(
+    sake_id: int,
+    top_k: int = Query(5, ge=1, le=100),
+    prefecture: Optional[List[str]] = Query(None),
+    exclude_brewery: Optional[List[str]] = Query(None),
+    method: str = Query("auto", pattern="^(auto|taste)$")
+):
+    filters = RecommendationFilters(prefecture=prefecture, exclude_brewery=exclude_brewery)
+    result = engine.similar(sake_id, top_k=top_k, filters=filters, method=method)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Sake not found")
+    return result
+
 @app.get("/search", response_model=SakeSearchResponse)
-def search_sakes(
+async def search_sakes(
     q: str = Query(..., min_length=1),
-    limit: int = Query(20, ge=1, le=100)
+    limit: int = Query(20, ge=1, le=100),
+    in_texts: bool = Query(False, description="レビュー/説明文も検索対象にする"),
+    mode: Optional[str] = Query(None, pattern="^(keyword|semantic|hybrid)$",
+                                description="省略時は USE_EMBEDDING=1 なら SEARCH_MODE、それ以外は keyword")
 ):
-    items = db.search_sakes(q, limit)
-    return SakeSearchResponse(items=items)
+    return await search.search_async(q, limit, mode=mode, in_texts=in_texts)
 
 @app.post("/recommend", response_model=RecommendationResponse)
-def recommend_sakes(request: RecommendationRequest):
-    return engine.recommend(request)
+async def recommend_sakes(request: RecommendationRequest, if_none_match: Optional[str] = Header(None)):
+    # 結果はリクエストとカタログのバージョンだけで決まるため、ETag/Cache-Control をつけて返す
+    body, etag, hit = await engine.recommend_cached_async(request)
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "no-store" if request.debug else f"public, max-age={settings.RECOMMEND_CACHE_MAX_AGE_SEC}",
+        "X-Cache": "HIT" if hit else "MISS",
+    }
+    if if_none_match and etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+@app.post("/recommend/batch", response_model=BatchRecommendationResponse)
+async def recommend_sakes_batch(request: BatchRecommendationRequest):
+    if len(request.requests) > settings.RECOMMEND_BATCH_MAX:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many requests in batch (max {settings.RECOMMEND_BATCH_MAX})"
+        )
+    return await engine.recommend_batch_async(request.requests)
+
+@app.get("/neighbors/export")
+def export_neighbors(
+    n: int = Query(10, ge=1, le=100),
+    method: str = Query("auto", pattern="^(auto|taste)$"),
+    shard: int = Query(0, ge=0),
+    num_shards: int = Query(1, ge=1),
+    after: Optional[int] = Query(None, description="この sake_id より後から再開する (前回最後に受け取った sake_id)")
+):
+    """
+    銘柄ごとの上位n件の類似銘柄を NDJSON でストリーミングする (sake_id 昇順、1行1銘柄)
+    """
+    if shard >= num_shards:
+        raise HTTPException(status_code=400, detail="shard must be less than num_shards")
+    cat = catalog.get_catalog()
+    rows = neighbors.select_rows(cat, shard=shard, num_shards=num_shards, after=after)
+    return StreamingResponse(
+        neighbors.stream_ndjson(cat, rows, n, method, settings.NEIGHBORS_BLOCK_SIZE),
+        media_type="application/x-ndjson",
+        headers={"X-Catalog-Version": cat.neighbor_version},
+    )
@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import List, Optional, Dict, Any, Union
 
 class TasteProfile(BaseModel):
@@ -30,17 +30,28 @@ class SakeListResponse(BaseModel):
 
 class SakeSearchResponse(BaseModel):
     items: List[SakeListItem]
+    # 実際に使われた検索モード (keyword / semantic / hybrid)
+    mode: Optional[str] = None
 
 
 class RecommendationFilters(BaseModel):
     prefecture: Optional[List[str]] = None
     exclude_brewery: Optional[List[str]] = None
 
+class RecommendationDiversity(BaseModel):
+    # MMRの関連度の重み (1.0: 多様性を考慮しない、小さいほど似た銘柄を避ける)
+    mmr_lambda: float = Field(0.7, ge=0, le=1)
+    # 同じ蔵元/都道府県から選ぶ件数の上限 (1以上、None: 制限なし)
+    max_per_brewery: Optional[int] = Field(None, ge=1)
+    max_per_prefecture: Optional[int] = Field(None, ge=1)
+
 class RecommendationRequest(BaseModel):
     text: str
     top_k: Optional[int] = 5
     filters: Optional[RecommendationFilters] = None
     debug: Optional[bool] = False
+    # 指定した場合は上位候補から多様性を考慮して選ぶ (MMR)
+    diversity: Optional[RecommendationDiversity] = None
 
 class RecommendationItem(SakeListItem):
     score: float
@@ -51,6 +62,8 @@ class RecommendationItem(SakeListItem):
 
 class RecommendationQuery(BaseModel):
     taste_vector: List[float]
+    # フレーバーチャート(f1~f6)に射影したクエリ (USE_FLAVOR_SCORING=1 で合成した場合のみ)
+    flavor_vector: Optional[List[float]] = None
 
 class RecommendationResponse(BaseModel):
     input_text: str
@@ -58,10 +71,38 @@ class RecommendationResponse(BaseModel):
     mode: str = "dict"
     query: RecommendationQuery
     recommendations: List[RecommendationItem]
+    # debug=true の場合のみ (多段ランキングのステージごとの件数・所要時間など)
+    debug_info: Optional[Dict[str, Any]] = None
+
+class SimilarSakeItem(SakeListItem):
+    score: float
+    distance: float
+    taste_vector: List[float]
+
+class SimilarSakesResponse(BaseModel):
+    sake_id: int
+    top_k: int
+    method: str
+    # precomputed: sake_neighbors から / live: その場で計算
+    source: str
+    recommendations: List[SimilarSakeItem]
+
+class BatchRecommendationRequest(BaseModel):
+    # 各要素は RecommendationRequest と同じ形式 (要素ごとに検証し、不正な要素はその要素だけエラーにする)
+    requests: List[Dict[str, Any]]
+
+class BatchRecommendationResult(BaseModel):
+    index: int
+    response: Optional[RecommendationResponse] = None
+    error: Optional[str] = None
+
+class BatchRecommendationResponse(BaseModel):
+    results: List[BatchRecommendationResult]
 
 
 class VectorStatusResponse(BaseModel):
     total_sakes: int
     total_vectors: int
     pending_count: int
+    pending_embedding_count: Optional[int] = None
     last_computed_at: Optional[str] = None
@@ -0,0 +1,252 @@
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from ..config import settings
+from .scoring import top_k as top_k_positions
+
+logger = logging.getLogger(__name__)
+
+
+def _normalize(x: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(x, axis=-1, keepdims=True)
+    return np.divide(x, norms, out=np.zeros_like(x), where=norms != 0)
+
+
+class IVFIndex:
+    """
+    Embedding用の転置ファイル(IVF)近似最近傍インデックス
+
+    k-means(球面k-means)で銘柄をnlist個のパーティションに分け、
+    検索時はクエリに近いnprobe個のパーティションに属する銘柄だけを候補にする。
+    インデックスが持つのはセントロイドとパーティションごとの sake_id のみで、
+    候補の厳密なスコア計算はカタログのEmbedding行列で行う。
+    """
+
+    def __init__(self, centroids: np.ndarray, list_offsets: np.ndarray, list_sake_ids: np.ndarray,
+                 meta: Optional[Dict[str, Any]] = None):
+        # (nlist, dim) の正規化済みセントロイド
+        self.centroids = centroids
+        # パーティションiの銘柄は list_sake_ids[list_offsets[i]:list_offsets[i+1]]
+        self.list_offsets = list_offsets
+        self.list_sake_ids = list_sake_ids
+        self.meta = meta or {}
+        # カタログごとの行位置への対応表 (カタログが変わったら作り直す)
+        self._mapping_key = None
+        self._mapping: Tuple[List[np.ndarray], np.ndarray] = ([], np.empty(0, dtype=np.intp))
+        self._lock = threading.Lock()
+        # 警告済みの不一致 (同じ警告をリクエストごとに出さない)
+        self._warned = set()
+
+    @property
+    def nlist(self) -> int:
+        return self.centroids.shape[0]
+
+    @property
+    def dim(self) -> int:
+        return self.centroids.shape[1]
+
+    def __len__(self) -> int:
+        return len(self.list_sake_ids)
+
+    @classmethod
+    def build(cls, sake_ids: List[int], embeddings: np.ndarray, nlist: int = 0,
+              n_iter: int = 20, seed: int = 0, meta: Optional[Dict[str, Any]] = None) -> "IVFIndex":
+        """
+        球面k-meansでパーティションを作ってインデックスを構築する
+        nlist=0 の場合は sqrt(n) 程度に自動設定する
+        """
+        x = _normalize(np.asarray(embeddings, dtype=np.float32))
+        n = x.shape[0]
+        if n == 0:
+            raise ValueError("No embeddings to index")
+        if nlist <= 0:
+            nlist = max(1, int(round(np.sqrt(n))))
+        nlist = min(nlist, n)
+
+        rng = np.random.default_rng(seed)
+        centroids = x[rng.choice(n, size=nlist, replace=False)].copy()
+        assign = np.zeros(n, dtype=np.intp)
+        for it in range(n_iter):
+            new_assign = _assign(x, centroids)
+            changed = int((new_assign != assign).sum()) if it else n
+            assign = new_assign
+            for c in range(nlist):
+                members = x[assign == c]
+                if len(members) == 0:
+                    # 空のパーティションはランダムな点で作り直す
+                    centroids[c] = x[rng.integers(n)]
+                else:
+                    centroids[c] = members.sum(axis=0)
+            centroids = _normalize(centroids)
+            if changed == 0:
+                break
+        assign = _assign(x, centroids)
+
+        order = np.argsort(assign, kind="stable")
+        counts = np.bincount(assign, minlength=nlist)
+        list_offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        list_sake_ids = np.asarray(sake_ids, dtype=np.int64)[order]
+
+        meta = dict(meta or {})
+        meta.update({"nlist": nlist, "n": n, "dim": int(x.shape[1]), "built_at": time.strftime("%Y-%m-%d %H:%M:%S")})
+        return cls(centroids.astype(np.float32), list_offsets, list_sake_ids, meta)
+
+    def save(self, path: str) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # np.savez は拡張子 .npz を自動付与するため、ファイルオブジェクトで書き込む
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                centroids=self.centroids,
+                list_offsets=self.list_offsets,
+                list_sake_ids=self.list_sake_ids,
+                meta=np.array(json.dumps(self.meta, ensure_ascii=False)),
+            )
+
+    @classmethod
+    def load(cls, path: str) -> "IVFIndex":
+        with np.load(path, allow_pickle=False) as data:
+            return cls(
+                centroids=data["centroids"],
+                list_offsets=data["list_offsets"],
+                list_sake_ids=data["list_sake_ids"],
+                meta=json.loads(str(data["meta"])),
+            )
+
+    def _rows_for(self, cat) -> Tuple[List[np.ndarray], np.ndarray]:
+        """
+        パーティションごとのカタログ行位置と、インデックス構築後に追加された
+        (どのパーティションにも属さない)Embedding行を返す
+        """
+        key = (id(cat), cat.fingerprint)
+        if self._mapping_key == key:
+            return self._mapping
+        with self._lock:
+            if self._mapping_key == key:
+                return self._mapping
+            lists = []
+            indexed = np.zeros(len(cat), dtype=bool)
+            for i in range(self.nlist):
+                ids = self.list_sake_ids[self.list_offsets[i]:self.list_offsets[i + 1]]
+                # カタログから消えた銘柄は除外する
+                rows = np.asarray([cat.row_of[sid] for sid in ids.tolist() if sid in cat.row_of], dtype=np.intp)
+                indexed[rows] = True
+                lists.append(rows)
+            unindexed = np.flatnonzero(cat.has_embedding & ~indexed)
+            self._mapping = (lists, unindexed)
+            self._mapping_key = key
+            return self._mapping
+
+    def mismatch(self, model: Optional[str] = None, dim: Optional[int] = None) -> Optional[str]:
+        """
+        インデックスを構築したEmbeddingとモデル/次元が異なれば理由を返す (一致すれば None)
+        構築時のモデルが記録されていないインデックスはモデルを比較しない
+        """
+        built_model = self.meta.get("model")
+        if model and built_model and built_model != model:
+            return f"model {built_model!r} != {model!r}"
+        if dim is not None and dim != self.dim:
+            return f"dim {self.dim} != {dim}"
+        return None
+
+    def probe(self, cat, q_embedding, nprobe: int) -> np.ndarray:
+        """
+        クエリに近いnprobe個のパーティションに属するカタログ行位置を返す
+        インデックス未登録のEmbedding行は常に候補に含める(厳密スコアで評価される)
+        クエリやカタログのEmbeddingとモデル/次元が異なる場合は、Embeddingを持つ全行を返す (全件スキャン)
+        """
+        reason = (self.mismatch(settings.EMBED_MODEL, len(q_embedding))
+                  or self.mismatch(dim=cat.embedding_dim if cat.embeddings is not None else None))
+        if reason is not None:
+            if reason not in self._warned:
+                self._warned.add(reason)
+                logger.warning("ANN index does not match the embeddings (%s); falling back to full scan", reason)
+            return np.flatnonzero(cat.has_embedding)
+        lists, unindexed = self._rows_for(cat)
+        q = np.asarray(q_embedding, dtype=np.float32)
+        sims = self.centroids @ q
+        nprobe = max(1, min(nprobe, self.nlist))
+        probe_ids = np.argpartition(-sims, nprobe - 1)[:nprobe]
+        return np.concatenate([lists[i] for i in probe_ids] + [unindexed])
+
+
+def _assign(x: np.ndarray, centroids: np.ndarray, chunk: int = 4096) -> np.ndarray:
+    """
+    各点を最も近い(内積最大の)セントロイドに割り当てる
+    """
+    out = np.empty(x.shape[0], dtype=np.intp)
+    for start in range(0, x.shape[0], chunk):
+        out[start:start + chunk] = np.argmax(x[start:start + chunk] @ centroids.T, axis=1)
+    return out
+
+
+def recall_at_k(index: IVFIndex, cat, queries: np.ndarray, k: int, nprobe: int) -> Dict[str, float]:
+    """
+    厳密スコア(カタログ全件のコサイン類似度)の上位k件に対するANNのrecall@kを測る
+    """
+    emb_rows = np.flatnonzero(cat.has_embedding)
+    hits = 0
+    total = 0
+    candidates = 0
+    exact_sec = 0.0
+    ann_sec = 0.0
+    for q in queries:
+        t0 = time.perf_counter()
+        scores, _ = cat.scorer.cosine(q, emb_rows)
+        exact = set(emb_rows[top_k_positions(scores, k)].tolist())
+        t1 = time.perf_counter()
+        rows = index.probe(cat, q, nprobe)
+        a_scores, _ = cat.scorer.cosine(q, rows)
+        approx = set(rows[top_k_positions(a_scores, k)].tolist())
+        t2 = time.perf_counter()
+
+        hits += len(exact & approx)
+        total += len(exact)
+        candidates += len(rows)
+        exact_sec += t1 - t0
+        ann_sec += t2 - t1
+
+    n = max(1, len(queries))
+    return {
+        "nprobe": nprobe,
+        "recall": hits / total if total else 0.0,
+        "avg_candidates": candidates / n,
+        "exact_ms": exact_sec / n * 1000,
+        "ann_ms": ann_sec / n * 1000,
+    }
+
+
+# API プロセスで共有するインデックス
+_index: Optional[IVFIndex] = None
+
+
+def load_index(path: Optional[str] = None, dim: Optional[int] = None) -> Optional[IVFIndex]:
+    """
+    ディスク上のインデックスを読み込んで共有インデックスとして登録する
+    ファイルが無い場合や、現在のEmbeddingとモデル(EMBED_MODEL)/次元(dim)が異なる場合は None (全件スキャンにフォールバック)
+    """
+    global _index
+    path = path or settings.ANN_INDEX_PATH
+    if not os.path.exists(path):
+        logger.info("ANN index not found: %s", path)
+        _index = None
+        return None
+    index = IVFIndex.load(path)
+    reason = index.mismatch(settings.EMBED_MODEL, dim)
+    if reason is not None:
+        logger.warning("ANN index %s does not match the embeddings (%s); using full scan", path, reason)
+        _index = None
+        return None
+    _index = index
+    logger.info("ANN index loaded: %d sakes, nlist=%d (%s)", len(index), index.nlist, path)
+    return _index
+
+
+def get_index() -> Optional[IVFIndex]:
+    return _index
@@ -0,0 +1,272 @@
+import functools
+import hashlib
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .. import database as db
+from ..config import settings
+from . import popularity
+from .flavor import FLAVOR_DIM, normalize_charts
+from .scoring import VectorScorer
+
+# 味ベクトルの次元数 [sweet_dry, body, fruity, style]
+TASTE_DIM = 4
+
+
+class Catalog:
+    """
+    レコメンド候補のインメモリカタログ
+
+    sake_master と sake_vectors を一度だけ読み込み、
+    連続したfloat配列(行列)と、行位置が揃ったID/名前/蔵元/都道府県の列として保持する。
+    """
+
+    def __init__(
+        self,
+        sake_ids: List[int],
+        names: List[str],
+        breweries: List[Optional[str]],
+        prefectures: List[Optional[str]],
+        taste: np.ndarray,
+        embeddings: Optional[np.ndarray],
+        has_embedding: np.ndarray,
+        fingerprint: Tuple[Any, ...],
+        flavor: Optional[np.ndarray] = None,
+        has_flavor: Optional[np.ndarray] = None,
+        popularity: Optional[np.ndarray] = None,
+    ):
+        self.sake_ids = sake_ids
+        self.names = names
+        self.breweries = breweries
+        self.prefectures = prefectures
+        # (n, 4) の味ベクトル行列
+        self.taste = taste
+        # (n, dim) のEmbedding行列 (Embeddingを持たない行はゼロ埋め)
+        self.embeddings = embeddings
+        # 各行がEmbeddingを持つかどうか
+        self.has_embedding = has_embedding
+        # さけのわフレーバーチャート: 各行がチャートを持つかどうかと、(n, 6) の正規化済み行列 (持たない行はゼロ)
+        n = len(sake_ids)
+        self.has_flavor = has_flavor if has_flavor is not None else np.zeros(n, dtype=bool)
+        self.flavor_unit = normalize_charts(
+            flavor if flavor is not None else np.zeros((n, FLAVOR_DIM), dtype=np.float64), self.has_flavor)
+        # さけのわランキングから事前計算した人気度 (0~1、ランキングに載っていない行は0)
+        self.popularity = popularity if popularity is not None else np.zeros(n, dtype=np.float64)
+        self.fingerprint = fingerprint
+        self.loaded_at = time.time()
+        # sake_id -> 行位置
+        self.row_of = {sid: i for i, sid in enumerate(sake_ids)}
+        # バッチスコアリング用 (Embeddingのノルムはここで事前計算される)
+        self.scorer = VectorScorer(taste, embeddings, has_embedding)
+
+        # フィルタ用のパーティション
+        # 都道府県 -> 行位置(昇順)
+        by_prefecture: Dict[Optional[str], List[int]] = {}
+        for i, pref in enumerate(prefectures):
+            by_prefecture.setdefault(pref, []).append(i)
+        self.prefecture_rows = {pref: np.asarray(idx, dtype=np.intp) for pref, idx in by_prefecture.items()}
+        # 蔵元名(重複なし)と、各行の蔵元番号 (蔵元なしは -1)
+        self.brewery_names = sorted({b for b in breweries if b})
+        code_of = {b: c for c, b in enumerate(self.brewery_names)}
+        self.brewery_codes = np.asarray([code_of[b] if b else -1 for b in breweries], dtype=np.intp)
+        self._brewery_match_cache: Dict[str, np.ndarray] = {}
+
+    def __len__(self) -> int:
+        return len(self.sake_ids)
+
+    @functools.cached_property
+    def version(self) -> str:
+        """
+        カタログ(sake_vectors とさけのわ取り込みの状態)のバージョン文字列
+        レスポンスキャッシュの無効化に使う (近傍の鮮度判定は neighbor_version)
+        """
+        return hashlib.sha1(repr(self.fingerprint).encode("utf-8")).hexdigest()[:16]
+
+    @functools.cached_property
+    def neighbor_version(self) -> str:
+        """
+        味ベクトル/Embedding(= sake_vectors)だけのバージョン文字列
+        近傍(sake_neighbors)は味ベクトルとEmbeddingだけで決まるため、さけのわの取り込みでは古くならない
+        """
+        return hashlib.sha1(repr(self.fingerprint[:1]).encode("utf-8")).hexdigest()[:16]
+
+    @property
+    def embedding_dim(self) -> int:
+        return 0 if self.embeddings is None else self.embeddings.shape[1]
+
+    def embedding_mismatch(self, q_embedding: Optional[Sequence[float]]) -> Optional[str]:
+        """
+        クエリEmbeddingの次元がカタログのEmbeddingと異なる場合にその理由を返す
+        (クエリEmbeddingが無い、またはEmbedding計算済みの銘柄が無い場合は None)
+        """
+        if q_embedding is None or self.embeddings is None or not self.has_embedding.any():
+            return None
+        if len(q_embedding) == self.embedding_dim:
+            return None
+        return f"Query embedding dimension {len(q_embedding)} does not match catalog dimension {self.embedding_dim}"
+
+    @classmethod
+    def from_rows(cls, rows: List[Dict[str, Any]], fingerprint: Tuple[Any, ...]) -> "Catalog":
+        """
+        get_all_sakes_with_vectors() の結果からカタログを組み立てる
+        """
+        n = len(rows)
+        taste = np.zeros((n, TASTE_DIM), dtype=np.float64)
+        has_embedding = np.zeros(n, dtype=bool)
+
+        # Embedding次元は最初に見つかったものに揃える
+        dim = 0
+        for row in rows:
+            if row.get("embedding") is not None and len(row["embedding"]) > 0:
+                dim = len(row["embedding"])
+                break
+        embeddings = np.zeros((n, dim), dtype=np.float64) if dim else None
+        flavor = np.zeros((n, FLAVOR_DIM), dtype=np.float64)
+        has_flavor = np.zeros(n, dtype=bool)
+
+        for i, row in enumerate(rows):
+            taste[i] = row["vector"]
+            if row.get("flavor") is not None:
+                flavor[i] = row["flavor"]
+                has_flavor[i] = True
+            emb = row.get("embedding")
+            if embeddings is not None and emb is not None and len(emb) > 0:
+                if len(emb) != dim:
+                    print(f"Skipping embedding for sake_id={row['sake_id']} (dim {len(emb)} != {dim})")
+                    continue
+                embeddings[i] = emb
+                has_embedding[i] = True
+
+        return cls(
+            sake_ids=[row["sake_id"] for row in rows],
+            names=[row["name"] for row in rows],
+            breweries=[row["brewery"] for row in rows],
+            prefectures=[row["prefecture"] for row in rows],
+            taste=taste,
+            embeddings=embeddings,
+            has_embedding=has_embedding,
+            fingerprint=fingerprint,
+            flavor=flavor,
+            has_flavor=has_flavor,
+            popularity=np.asarray([row.get("popularity", 0.0) for row in rows], dtype=np.float64),
+        )
+
+    def _breweries_matching(self, term: str) -> np.ndarray:
+        """
+        term を部分文字列として含む蔵元の番号 (蔵元名の種類数ぶんだけ調べる)
+        """
+        codes = self._brewery_match_cache.get(term)
+        if codes is None:
+            codes = np.asarray([c for c, b in enumerate(self.brewery_names) if term in b], dtype=np.intp)
+            if len(self._brewery_match_cache) < 1024:
+                self._brewery_match_cache[term] = codes
+        return codes
+
+    def filter_rows(self, prefectures: Optional[List[str]] = None,
+                    exclude_breweries: Optional[List[str]] = None) -> np.ndarray:
+        """
+        フィルタを通過する行位置を昇順で返す
+        - prefectures: いずれかの都道府県に一致する行 (都道府県ごとのパーティションを合わせる)
+        - exclude_breweries: 蔵元名にいずれかを部分一致で含む行を除く
+        空リスト/None は絞り込まない (従来と同じ)
+        """
+        if prefectures:
+            parts = [self.prefecture_rows[p] for p in set(prefectures) if p in self.prefecture_rows]
+            rows = np.sort(np.concatenate(parts)) if parts else np.empty(0, dtype=np.intp)
+        else:
+            rows = np.arange(len(self), dtype=np.intp)
+
+        if exclude_breweries and len(rows):
+            excluded = np.concatenate([self._breweries_matching(term) for term in exclude_breweries])
+            if len(excluded):
+                rows = rows[~np.isin(self.brewery_codes[rows], excluded)]
+        return rows
+
+    def filter_subset(self, rows: np.ndarray, prefectures: Optional[List[str]] = None,
+                      exclude_breweries: Optional[List[str]] = None) -> np.ndarray:
+        """
+        与えた行位置のうちフィルタを通過するものを、順序を保って返す
+        事前計算済みの近傍リストのような少数の行を絞り込む用 (規則は filter_rows と同じ)
+        """
+        rows = np.asarray(rows, dtype=np.intp)
+        if prefectures and len(rows):
+            wanted = set(prefectures)
+            rows = rows[np.fromiter((self.prefectures[i] in wanted for i in rows.tolist()), dtype=bool, count=len(rows))]
+        if exclude_breweries and len(rows):
+            excluded = np.concatenate([self._breweries_matching(term) for term in exclude_breweries])
+            if len(excluded):
+                rows = rows[~np.isin(self.brewery_codes[rows], excluded)]
+        return rows
+
+    def row(self, i: int) -> Dict[str, Any]:
+        """
+        i行目を従来の候補dict形式で返す (理由生成・レスポンス組み立て用)
+        """
+        return {
+            "sake_id": self.sake_ids[i],
+            "name": self.names[i],
+            "brewery": self.breweries[i],
+            "prefecture": self.prefectures[i],
+            "vector": self.taste[i].tolist(),
+        }
+
+
+# プロセス全体で共有するカタログ
+_catalog: Optional[Catalog] = None
+_checked_at = 0.0
+_lock = threading.Lock()
+
+
+def load_catalog(fingerprint: Optional[Tuple[Any, ...]] = None) -> Catalog:
+    """
+    DBからカタログを読み込む
+    """
+    if fingerprint is None:
+        fingerprint = db.get_vector_fingerprint()
+    rows = db.get_all_sakes_with_vectors()
+    priors = popularity.compute_priors(
+        db.get_ranking_history(), settings.POPULARITY_HALF_LIFE_MONTHS, settings.POPULARITY_MONTHS)
+    for row in rows:
+        row["popularity"] = priors.get(row["sake_id"], 0.0)
+    return Catalog.from_rows(rows, fingerprint)
+
+
+def get_catalog() -> Catalog:
+    """
+    共有カタログを取得する
+
+    sake_vectors の件数・computed_at・version から作るフィンガープリントが
+    変わった場合のみ読み込み直す。
+    フィンガープリントの確認自体も CATALOG_REFRESH_SEC 秒に1回までに抑える。
+    """
+    global _catalog, _checked_at
+
+    now = time.monotonic()
+    catalog = _catalog
+    if catalog is not None and now - _checked_at < settings.CATALOG_REFRESH_SEC:
+        return catalog
+
+    with _lock:
+        # 他スレッドが読み込み済みならそれを使う
+        if _catalog is not None and time.monotonic() - _checked_at < settings.CATALOG_REFRESH_SEC:
+            return _catalog
+
+        fingerprint = db.get_vector_fingerprint()
+        if _catalog is None or _catalog.fingerprint != fingerprint:
+            _catalog = load_catalog(fingerprint)
+            print(f"Catalog loaded: {len(_catalog)} sakes (embedding_dim={_catalog.embedding_dim})")
+        _checked_at = time.monotonic()
+        return _catalog
+
+
+def invalidate() -> None:
+    """
+    共有カタログを破棄し、次回アクセス時に読み込み直させる
+    """
+    global _catalog, _checked_at
+    with _lock:
+        _catalog = None
+        _checked_at = 0.0
@@ -0,0 +1,64 @@
+from typing import Dict, Optional
+
+import numpy as np
+
+
+def mmr(cat, rows: np.ndarray, relevance: np.ndarray, k: int, mmr_lambda: float,
+        use_embedding: bool = False, max_per_brewery: Optional[int] = None,
+        max_per_prefecture: Optional[int] = None) -> np.ndarray:
+    """
+    Maximal Marginal Relevance で候補プールからk件を選ぶ
+    各ステップで mmr_lambda x 関連度 - (1 - mmr_lambda) x 選択済みとの最大類似度 が最大の候補を選ぶ
+
+    - rows / relevance: 候補プールの行位置とスコア (スコア降順。同点はこの順で先のものを選ぶ)
+    - 類似度は、両方がEmbeddingを持つ場合(use_embedding)はコサイン類似度、それ以外は味ベクトルの 1 / (1 + L2距離)
+      (スコアと同じ尺度)
+    - max_per_brewery / max_per_prefecture: 同じ蔵元/都道府県から選ぶ件数の上限 (蔵元/都道府県が無い行は数えない)
+      上限により候補が尽きた場合はk件未満になる
+    選択済みとの類似度を1件選ぶごとに更新するため、計算量は O(k x プール件数) (カタログ全体は見ない)
+    Returns: 選んだ候補の、プール内の位置 (選んだ順)
+    """
+    m = len(rows)
+    relevance = np.asarray(relevance, dtype=np.float64)
+    taste = cat.taste[rows]
+
+    emb_unit = None
+    emb_mask = cat.has_embedding[rows] if use_embedding and cat.embeddings is not None else None
+    if emb_mask is not None and emb_mask.any():
+        norms = cat.scorer.embedding_norms[rows][:, None]
+        emb = cat.embeddings[rows]
+        emb_unit = np.divide(emb, norms, out=np.zeros_like(emb), where=norms > 0)
+
+    available = np.ones(m, dtype=bool)
+    # 選択済みとの最大類似度 (まだ何も選んでいない間は冗長性なし)
+    redundancy = np.zeros(m, dtype=np.float64)
+    brewery_count: Dict[int, int] = {}
+    prefecture_count: Dict[str, int] = {}
+    selected = []
+    while len(selected) < k and available.any():
+        candidates = np.flatnonzero(available)
+        values = mmr_lambda * relevance[candidates] - (1.0 - mmr_lambda) * redundancy[candidates]
+        j = int(candidates[np.argmax(values)])
+        selected.append(j)
+        available[j] = False
+
+        # 上限に達した蔵元/都道府県の候補を外す
+        row = int(rows[j])
+        code = int(cat.brewery_codes[row])
+        if max_per_brewery is not None and code >= 0:
+            brewery_count[code] = brewery_count.get(code, 0) + 1
+            if brewery_count[code] >= max_per_brewery:
+                available &= cat.brewery_codes[rows] != code
+        pref = cat.prefectures[row]
+        if max_per_prefecture is not None and pref:
+            prefecture_count[pref] = prefecture_count.get(pref, 0) + 1
+            if prefecture_count[pref] >= max_per_prefecture:
+                available &= np.fromiter((cat.prefectures[i] != pref for i in rows.tolist()), dtype=bool, count=m)
+
+        # 選んだ候補との類似度で冗長性を更新する
+        sims = 1.0 / (1.0 + np.sqrt(np.einsum("ij,ij->i", taste - taste[j], taste - taste[j])))
+        if emb_unit is not None and emb_mask[j]:
+            sims = np.where(emb_mask, emb_unit @ emb_unit[j], sims)
+        redundancy = sims if len(selected) == 1 else np.maximum(redundancy, sims)
+
+    return np.asarray(selected, dtype=np.intp)
@@ -0,0 +1,218 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from ..db.codec import decode_embedding, encode_embedding
+
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_query(text: str) -> str:
+    """
+    キャッシュキー用にクエリ文を正規化する (NFKC + 空白の正規化)
+    """
+    return _SPACES.sub(" ", unicodedata.normalize("NFKC", text)).strip()
+
+
+class QueryEmbeddingCache:
+    """
+    クエリEmbeddingのキャッシュ
+
+    正規化したテキスト + モデル + task_type をキーに、
+    メモリ上のLRU(件数上限/TTLつき)と、任意でSQLiteのディスク層に保持する。
+    ディスク層があれば再起動後もキャッシュが残る。
+    - 値はどちらの層も float32 に丸めたものを持つ (再起動の前後で同じベクトルを返す)
+    - ディスク層は期限切れの行を削除し、件数を max_disk_rows までに抑える (PRUNE_EVERY 回の書き込みごと)
+    - ディスクの読み書きはメモリ層のロックの外で行う (メモリ層のヒットがディスクI/Oを待たない)
+    """
+
+    # ディスク層の掃除(期限切れ・件数上限)を行う書き込み回数の間隔
+    PRUNE_EVERY = 100
+
+    def __init__(self, max_size: int = 1024, ttl_sec: float = 86400.0, db_path: str = "",
+                 max_disk_rows: int = 100000):
+        self.max_size = max_size
+        self.ttl_sec = ttl_sec
+        self.db_path = db_path
+        self.max_disk_rows = max_disk_rows
+        self._items: "OrderedDict[str, Tuple[float, List[float]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        # ディスク層(SQLite接続)用のロック
+        self._disk_lock = threading.Lock()
+        self._puts_since_prune = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_pruned = 0
+        self._disk: Optional[sqlite3.Connection] = None
+        if db_path:
+            self._open_disk(db_path)
+
+    @property
+    def has_disk(self) -> bool:
+        return self._disk is not None
+
+    def _open_disk(self, path: str) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = sqlite3.connect(path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode = WAL;")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS query_embeddings (
+                cache_key TEXT PRIMARY KEY,
+                embedding BLOB NOT NULL,
+                created_at REAL NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_query_embeddings_created_at ON query_embeddings(created_at)")
+        conn.commit()
+        self._disk = conn
+        self._prune_disk(time.time())
+
+    @staticmethod
+    def make_key(text: str, model: str, task_type: str) -> str:
+        raw = f"{model}\x1f{task_type}\x1f{normalize_query(text)}"
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _as_stored(embedding) -> List[float]:
+        """
+        キャッシュに持つ値 (ディスク層の保存形式と同じ float32 に丸める)
+        """
+        return np.asarray(embedding, dtype=np.float32).astype(np.float64).tolist()
+
+    def get(self, text: str, model: str, task_type: str) -> Optional[List[float]]:
+        key = self.make_key(text, model, task_type)
+        now = time.time()
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None:
+                if now - item[0] < self.ttl_sec:
+                    self._items.move_to_end(key)
+                    self.hits += 1
+                    return item[1]
+                # 期限切れ
+                del self._items[key]
+
+        found = self._get_disk(key, now)
+        with self._lock:
+            if found is not None:
+                embedding, created_at = found
+                self.disk_hits += 1
+                self._put_memory(key, embedding, created_at)
+                return embedding
+            self.misses += 1
+            return None
+
+    def put(self, text: str, model: str, task_type: str, embedding: List[float]) -> List[float]:
+        """
+        Embeddingを保存し、キャッシュに持つ値(float32に丸めたもの)を返す
+        呼び出し側はこの戻り値を使う (キャッシュのヒット時と同じ値になる)
+        """
+        key = self.make_key(text, model, task_type)
+        now = time.time()
+        embedding = self._as_stored(embedding)
+        with self._lock:
+            self._put_memory(key, embedding, now)
+        if self._disk is not None:
+            self._put_disk(key, embedding, model, now)
+        return embedding
+
+    def _put_memory(self, key: str, embedding: List[float], created_at: float) -> None:
+        self._items[key] = (created_at, embedding)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+            self.evictions += 1
+
+    def _get_disk(self, key: str, now: float) -> Optional[Tuple[List[float], float]]:
+        if self._disk is None:
+            return None
+        try:
+            with self._disk_lock:
+                row = self._disk.execute(
+                    "SELECT embedding, created_at FROM query_embeddings WHERE cache_key = ?", (key,)
+                ).fetchone()
+        except sqlite3.Error as e:
+            print(f"Error reading query embedding cache: {e}")
+            return None
+        if row is None or now - row[1] >= self.ttl_sec:
+            return None
+        return decode_embedding(row[0]).astype(np.float64).tolist(), row[1]
+
+    def _put_disk(self, key: str, embedding: List[float], model: str, now: float) -> None:
+        try:
+            with self._disk_lock:
+                self._disk.execute(
+                    "INSERT OR REPLACE INTO query_embeddings (cache_key, embedding, created_at) VALUES (?, ?, ?)",
+                    (key, encode_embedding(embedding, dtype="float32", model=model), now),
+                )
+                self._disk.commit()
+                self._puts_since_prune += 1
+                prune = self._puts_since_prune >= self.PRUNE_EVERY
+        except sqlite3.Error as e:
+            print(f"Error writing query embedding cache: {e}")
+            return
+        if prune:
+            self._prune_disk(now)
+
+    def _prune_disk(self, now: float) -> None:
+        """
+        ディスク層から期限切れの行と、max_disk_rows を超えた古い行を削除する
+        """
+        try:
+            with self._disk_lock:
+                self._puts_since_prune = 0
+                deleted = self._disk.execute(
+                    "DELETE FROM query_embeddings WHERE created_at <= ?", (now - self.ttl_sec,)
+                ).rowcount
+                deleted += self._disk.execute("""
+                    DELETE FROM query_embeddings WHERE cache_key IN (
+                        SELECT cache_key FROM query_embeddings ORDER BY created_at DESC LIMIT -1 OFFSET ?
+                    )
+                """, (self.max_disk_rows,)).rowcount
+                self._disk.commit()
+        except sqlite3.Error as e:
+            print(f"Error pruning query embedding cache: {e}")
+            return
+        with self._lock:
+            self.disk_pruned += deleted
+
+    def disk_rows(self) -> int:
+        if self._disk is None:
+            return 0
+        with self._disk_lock:
+            return self._disk.execute("SELECT COUNT(*) FROM query_embeddings").fetchone()[0]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+        if self._disk is not None:
+            with self._disk_lock:
+                self._disk.execute("DELETE FROM query_embeddings")
+                self._disk.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "size": len(self._items),
+                "max_size": self.max_size,
+                "ttl_sec": self.ttl_sec,
+                "disk": bool(self._disk),
+                "max_disk_rows": self.max_disk_rows,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "disk_pruned": self.disk_pruned,
+                "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            }
@@ -1,8 +1,19 @@
 
+import asyncio
 import google.generativeai as genai
-from typing import List
+from typing import List, Optional, Tuple
 import time
+from starlette.concurrency import run_in_threadpool
 from ..config import settings
+from .embed_cache import QueryEmbeddingCache
+
+# クエリEmbeddingのキャッシュ (プロセス全体で共有)
+query_cache = QueryEmbeddingCache(
+    max_size=settings.QUERY_EMBED_CACHE_SIZE,
+    ttl_sec=settings.QUERY_EMBED_CACHE_TTL_SEC,
+    db_path=settings.QUERY_EMBED_CACHE_DB,
+    max_disk_rows=settings.QUERY_EMBED_CACHE_DB_MAX_ROWS,
+)
 
 class EmbeddingClient:
     def __init__(self):
@@ -21,9 +32,9 @@ class EmbeddingClient:
             raise ValueError("GEMINI_API_KEY is not set")
             
         try:
-            # モデル名は 'models/gemini-embedding-001' を使用
+            # モデル名は設定値 (デフォルト 'models/gemini-embedding-001') を使用
             result = genai.embed_content(
-                model="models/gemini-embedding-001",
+                model=settings.EMBED_MODEL,
                 content=text,
                 task_type="retrieval_document",
                 title=None
@@ -34,21 +45,200 @@ class EmbeddingClient:
             # リトライロジックなどは必要に応じて追加
             raise e
 
+    def get_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """
+        複数テキストのEmbeddingを1回のAPI呼び出しでまとめて取得する
+        (task_type: retrieval_document、戻り値は入力と同じ順序)
+        """
+        if not settings.GEMINI_API_KEY:
+            raise ValueError("GEMINI_API_KEY is not set")
+        if not texts:
+            return []
+
+        result = genai.embed_content(
+            model=settings.EMBED_MODEL,
+            content=texts,
+            task_type="retrieval_document",
+            title=None
+        )
+        embeddings = result['embedding']
+        if len(embeddings) != len(texts):
+            raise ValueError(f"Embedding count mismatch: {len(embeddings)} != {len(texts)}")
+        return embeddings
+
     def get_query_embedding(self, text: str) -> List[float]:
         """
         クエリ用のEmbeddingを取得する
         task_typeを retrieval_query に設定
+        同じ(正規化後の)クエリはキャッシュから返す
         """
+        cached = query_cache.get(text, settings.EMBED_MODEL, "retrieval_query")
+        if cached is not None:
+            return cached
+
         if not settings.GEMINI_API_KEY:
             raise ValueError("GEMINI_API_KEY is not set")
 
         try:
             result = genai.embed_content(
-                model="models/gemini-embedding-001",
+                model=settings.EMBED_MODEL,
                 content=text,
                 task_type="retrieval_query"
             )
-            return result['embedding']
+            embedding = result['embedding']
         except Exception as e:
             print(f"Error getting query embedding: {e}")
             raise e
+
+        embedding = query_cache.put(text, settings.EMBED_MODEL, "retrieval_query", embedding)
+        return embedding
+
+
+_client: Optional[EmbeddingClient] = None
+
+def get_embedding_client() -> EmbeddingClient:
+    """
+    プロセス全体で共有するEmbeddingClientを返す
+    """
+    global _client
+    if _client is None:
+        _client = EmbeddingClient()
+    return _client
+
+
+
+# 1回のバッチ呼び出しで送るテキスト数の上限 (Gemini APIのバッチ上限)
+MAX_TEXTS_PER_CALL = 100
+
+
+class AsyncEmbeddingClient:
+    """
+    非同期版のクエリEmbeddingクライアント
+
+    イベントループをブロックしないよう embed_content_async を使い、
+    呼び出しごとのタイムアウトと同時実行数の上限を設ける。
+    キャッシュは同期版と共有する (ディスク層がある場合、キャッシュの読み書きはスレッドプールで行う)。
+    """
+
+    def __init__(self, timeout_sec: Optional[float] = None, max_concurrency: Optional[int] = None):
+        self.timeout_sec = timeout_sec if timeout_sec is not None else settings.EMBED_TIMEOUT_SEC
+        self.max_concurrency = max_concurrency or settings.EMBED_MAX_CONCURRENCY
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        if settings.GEMINI_API_KEY:
+            genai.configure(api_key=settings.GEMINI_API_KEY)
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        # セマフォはイベントループごとに作る
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._loop = loop
+        return self._semaphore
+
+    @staticmethod
+    async def _cache_get_many(texts: List[str]) -> List[Optional[List[float]]]:
+        """
+        キャッシュをまとめて引く
+        ディスク層(SQLite)の読み込みでイベントループを止めないよう、その場合はスレッドプールで実行する
+        """
+        def _get():
+            return [query_cache.get(text, settings.EMBED_MODEL, "retrieval_query") for text in texts]
+        return await run_in_threadpool(_get) if query_cache.has_disk else _get()
+
+    @staticmethod
+    async def _cache_put_many(items: List[Tuple[str, List[float]]]) -> List[List[float]]:
+        """
+        キャッシュにまとめて保存し、キャッシュに持つ値を返す (ディスク層がある場合はスレッドプールで実行する)
+        """
+        def _put():
+            return [query_cache.put(text, settings.EMBED_MODEL, "retrieval_query", emb) for text, emb in items]
+        return await run_in_threadpool(_put) if query_cache.has_disk else _put()
+
+    async def get_query_embedding(self, text: str, timeout_sec: Optional[float] = None) -> List[float]:
+        """
+        クエリ用のEmbeddingを取得する (task_type: retrieval_query)
+        タイムアウト(省略時は EMBED_TIMEOUT_SEC)した場合は asyncio.TimeoutError を送出する
+        """
+        timeout_sec = self.timeout_sec if timeout_sec is None else timeout_sec
+        cached, = await self._cache_get_many([text])
+        if cached is not None:
+            return cached
+
+        if not settings.GEMINI_API_KEY:
+            raise ValueError("GEMINI_API_KEY is not set")
+
+        # 同時実行数の上限待ちも含めてタイムアウトの対象にする
+        async def _call():
+            async with self._get_semaphore():
+                return await genai.embed_content_async(
+                    model=settings.EMBED_MODEL,
+                    content=text,
+                    task_type="retrieval_query",
+                    request_options={"timeout": timeout_sec},
+                )
+
+        try:
+            result = await asyncio.wait_for(_call(), timeout=timeout_sec)
+            embedding = result['embedding']
+        except asyncio.TimeoutError:
+            print(f"Query embedding timed out after {timeout_sec}s")
+            raise
+        except Exception as e:
+            print(f"Error getting query embedding: {e}")
+            raise e
+
+        embedding, = await self._cache_put_many([(text, embedding)])
+        return embedding
+
+
+    async def get_query_embeddings(self, texts: List[str], timeout_sec: Optional[float] = None) -> List[List[float]]:
+        """
+        複数クエリのEmbeddingをまとめて取得する (戻り値は入力と同じ順序)
+        キャッシュにないテキストだけを重複を除いて MAX_TEXTS_PER_CALL 件ずつのバッチで問い合わせる
+        """
+        timeout_sec = self.timeout_sec if timeout_sec is None else timeout_sec
+        results: List[Optional[List[float]]] = await self._cache_get_many(texts)
+        missing = list(dict.fromkeys(text for text, emb in zip(texts, results) if emb is None))
+        if not missing:
+            return results
+
+        if not settings.GEMINI_API_KEY:
+            raise ValueError("GEMINI_API_KEY is not set")
+
+        async def _call(chunk: List[str]) -> List[List[float]]:
+            async with self._get_semaphore():
+                result = await genai.embed_content_async(
+                    model=settings.EMBED_MODEL,
+                    content=chunk,
+                    task_type="retrieval_query",
+                    request_options={"timeout": timeout_sec},
+                )
+            embeddings = result['embedding']
+            if len(embeddings) != len(chunk):
+                raise ValueError(f"Embedding count mismatch: {len(embeddings)} != {len(chunk)}")
+            return embeddings
+
+        chunks = [missing[i:i + MAX_TEXTS_PER_CALL] for i in range(0, len(missing), MAX_TEXTS_PER_CALL)]
+        try:
+            batches = await asyncio.wait_for(asyncio.gather(*(_call(c) for c in chunks)), timeout=timeout_sec)
+        except asyncio.TimeoutError:
+            print(f"Query embeddings timed out after {timeout_sec}s ({len(missing)} texts)")
+            raise
+
+        pairs = [pair for chunk, embeddings in zip(chunks, batches) for pair in zip(chunk, embeddings)]
+        stored = await self._cache_put_many(pairs)
+        fetched = {text: embedding for (text, _), embedding in zip(pairs, stored)}
+        return [emb if emb is not None else fetched[text] for text, emb in zip(texts, results)]
+
+
+_async_client: Optional[AsyncEmbeddingClient] = None
+
+def get_async_embedding_client() -> AsyncEmbeddingClient:
+    """
+    プロセス全体で共有するAsyncEmbeddingClientを返す
+    """
+    global _async_client
+    if _async_client is None:
+        _async_client = AsyncEmbeddingClient()
+    return _async_client
@@ -1,10 +1,22 @@
+import heapq
 import math
-from typing import List, Dict, Any, Optional
+import time
+import numpy as np
+from starlette.concurrency import run_in_threadpool
+from typing import List, Dict, Any, Optional, Tuple
+from pydantic import ValidationError
 from .. import database as db
-from ..models import RecommendationRequest, RecommendationResponse, RecommendationItem, RecommendationQuery
+from ..models import (
+    RecommendationRequest, RecommendationResponse, RecommendationItem, RecommendationQuery,
+    RecommendationFilters, RecommendationDiversity, BatchRecommendationResponse, BatchRecommendationResult,
+    SimilarSakeItem, SimilarSakesResponse,
+)
 from ..config import settings
 from .taste_v1 import estimate_taste_vector
-from .embedding import EmbeddingClient
+from .embedding import get_async_embedding_client, get_embedding_client
+from . import ann, catalog, diversity, flavor, neighbors
+from .scoring import top_k as top_k_positions
+from .response_cache import RecommendationCache, recommend_cache
 
 def _generate_reason(cand: Dict[str, Any], q_hits: Dict[str, List[str]], s_vector: List[float]) -> str:
     """
@@ -65,77 +77,176 @@ def _generate_reason(cand: Dict[str, Any], q_hits: Dict[str, List[str]], s_vecto
 
     return "、".join(parts)
 
+def warm_up() -> None:
+    """
+    API起動時の事前読み込み (カタログとANNインデックス)
+    DBやインデックスが無くても起動は継続する
+    """
+    cat = None
+    try:
+        cat = catalog.get_catalog()
+    except Exception as e:
+        print(f"Failed to load catalog: {e}")
+    if settings.USE_ANN == 1:
+        try:
+            # カタログのEmbeddingと次元が異なるインデックスは使わない
+            ann.load_index(dim=cat.embedding_dim if cat is not None and cat.embeddings is not None else None)
+        except Exception as e:
+            print(f"Failed to load ANN index: {e}")
+
 def recommend(request: RecommendationRequest) -> RecommendationResponse:
-    # 1. 入力テキストのベクトル化
-    q_vector, _, q_hits = estimate_taste_vector(request.text)
-    
+    # 1. クエリEmbeddingの取得 (Embeddingモードのみ)
     q_embedding = None
-    mode = "dict"
     if settings.USE_EMBEDDING == 1:
         try:
-            client = EmbeddingClient()
+            client = get_embedding_client()
             q_embedding = client.get_query_embedding(request.text)
-            mode = "embedding"
         except Exception as e:
             print(f"Failed to get embedding: {e}")
             # フォールバック: 従来モード
             pass
+
+    return rank(request, q_embedding)
+
+
+async def recommend_async(request: RecommendationRequest,
+                          cat: Optional["catalog.Catalog"] = None) -> RecommendationResponse:
+    """
+    recommend の非同期版
+    クエリEmbeddingは非同期クライアントで取得し(タイムアウト時は dict モードにフォールバック)、
+    カタログ読み込み・スコアリングはスレッドプールで実行してイベントループを塞がない。
+    cat を渡した場合はそのカタログでランキングする
+    """
+    q_embedding = None
+    if settings.USE_EMBEDDING == 1:
+        try:
+            q_embedding = await get_async_embedding_client().get_query_embedding(request.text)
+        except Exception as e:
+            print(f"Failed to get embedding: {e!r}")
+            # フォールバック: 従来モード
+            pass
+
+    return await run_in_threadpool(rank, request, q_embedding, cat)
+
+
+async def recommend_cached_async(request: RecommendationRequest) -> Tuple[bytes, str, bool]:
+    """
+    POST /recommend の本体 (recommend_async の結果をレスポンスキャッシュ経由で返す)
+    キーは正規化したリクエストとカタログのバージョンなので、sake_vectors が更新されれば自動的に再計算される。
+    debug=true (所要時間を含む) と、Embeddingモードで dict モードにフォールバックした結果はキャッシュしない
+    Returns: (シリアライズ済みのレスポンス, ETag, キャッシュヒットしたか)
+    """
+    if request.debug or recommend_cache.max_size <= 0:
+        body = (await recommend_async(request)).model_dump_json().encode("utf-8")
+        return body, RecommendationCache.make_etag(body), False
+
+    cat = await run_in_threadpool(catalog.get_catalog)
+    key = recommend_cache.make_key(request, cat.version)
+    cached = recommend_cache.get(key, cat.version)
+    if cached is not None:
+        body, etag = cached
+        return body, etag, True
+
+    # キーを作ったのと同じカタログでランキングする (途中で読み直されても別バージョンの結果を保存しない)
+    response = await recommend_async(request, cat)
+    body = response.model_dump_json().encode("utf-8")
+    if settings.USE_EMBEDDING == 1 and response.mode != "embedding":
+        return body, RecommendationCache.make_etag(body), False
+    return body, recommend_cache.put(key, cat.version, body), False
+
+
+def rank(request: RecommendationRequest, q_embedding: Optional[List[float]] = None,
+         cat: Optional["catalog.Catalog"] = None) -> RecommendationResponse:
+    """
+    クエリEmbedding取得後のランキング処理 (入力ベクトル化・フィルタ・スコアリング・理由生成)
+    q_embedding が None の場合は dict モードになる
+    cat が None の場合は現在のカタログを使う
+    """
+    # 入力テキストのベクトル化
+    q_vector, q_scores, q_hits = estimate_taste_vector(request.text)
     
-    # 2. 候補データの取得
-    candidates = db.get_all_sakes_with_vectors()
+    # 2. 候補データの取得 (インメモリカタログ)
+    if cat is None:
+        cat = catalog.get_catalog()
+    mismatch = cat.embedding_mismatch(q_embedding)
+    if mismatch is not None:
+        # 次元が異なるクエリEmbeddingは切り詰めずに dict モードにフォールバックする
+        print(f"{mismatch}; falling back to dict mode")
+        q_embedding = None
+    mode = "embedding" if q_embedding is not None else "dict"
+    q_flavor = _query_flavor(cat, q_scores)
     
     # 3. フィルタリング
-    filtered_candidates = []
-    for cand in candidates:
-        # 都道府県フィルタ
-        if request.filters and request.filters.prefecture:
-            if cand["prefecture"] not in request.filters.prefecture:
-                continue
-        
-        # 蔵元除外フィルタ
-        if request.filters and request.filters.exclude_brewery:
-            # 部分一致で除外判定 (簡易的)
-            is_excluded = False
-            for excl in request.filters.exclude_brewery:
-                if cand["brewery"] and excl in cand["brewery"]:
-                    is_excluded = True
-                    break
-            if is_excluded:
-                continue
-                
-        filtered_candidates.append(cand)
+    # 都道府県/蔵元のパーティションで、スコアリング前に候補行を絞り込む
+    filters = request.filters
+    filtered_rows = cat.filter_rows(
+        prefectures=filters.prefecture if filters else None,
+        exclude_breweries=filters.exclude_brewery if filters else None,
+    )
+
+    top_k = request.top_k if request.top_k else 5
 
     # 4. スコア計算
-    scored_items = []
-    for cand in filtered_candidates:
-        s_vector = cand["vector"]
+    index = ann.get_index() if settings.USE_ANN == 1 and q_embedding is not None else None
+    if settings.USE_STAGED_RANKING == 1:
+        # 多段ランキング: 安価な候補生成で絞り込み、候補だけを厳密なスコアで並べ直す
+        rows, positions, scores, dists, stages = _rank_staged(
+            cat, filtered_rows, q_vector, q_embedding, q_flavor, index, top_k, request.diversity)
+        result_items = [
+            _make_item(cat, int(rows[p]), float(scores[p]), float(dists[p]), q_hits, request.debug)
+            for p in positions
+        ]
+        debug_info = {"stages": stages} if request.debug else None
+        return _make_response(request, top_k, mode, q_vector, result_items, q_flavor, debug_info)
+
+    # フレーバーチャートのスコアと人気度の加点 (全行分、使わない場合は None)
+    f_scores = flavor.flavor_scores(cat.flavor_unit, q_flavor) if q_flavor is not None else None
+    boost = _popularity_boost(cat)
+    if settings.USE_VECTORIZED_SCORING == 1 or index is not None:
+        # バッチ計算: フィルタ後の行をまとめてスコアリングし、上位top_k件だけ組み立てる
+        rows = filtered_rows
+        if index is not None:
+            rows = _ann_candidate_rows(cat, index, rows, q_embedding, top_k)
+        scores, dists = cat.scorer.score(q_vector, q_embedding, q_embedding is not None, rows)
+        if f_scores is not None:
+            scores = flavor.blend(scores, f_scores[rows], settings.FLAVOR_WEIGHT)
+        if boost is not None:
+            scores = scores + boost[rows]
+        positions = top_k_positions(scores, _pool_size(request.diversity, top_k))
+        if request.diversity is not None:
+            positions = positions[_diversify(
+                cat, request.diversity, rows[positions], scores[positions], top_k, q_embedding is not None)]
+        result_items = [
+            _make_item(cat, int(rows[p]), float(scores[p]), float(dists[p]), q_hits, request.debug)
+            for p in positions
+        ]
+        return _make_response(request, top_k, mode, q_vector, result_items, q_flavor)
+
+    # 候補ごとには (score, distance, 行位置) だけを持ち、アイテムの組み立てと理由生成は上位top_k件に限る
+    scored = []
+    for i in filtered_rows.tolist():
+        s_vector = cat.taste[i].tolist()
         
-        if settings.USE_EMBEDDING == 1 and cand.get("embedding"):
+        if q_embedding is not None and cat.has_embedding[i]:
             # Embeddingによる類似度計算 (Cosine Similarity)
-            # q_embedding はループの外で計算すべきだが、構造上ここで参照できるようにする
-            # recommend関数の冒頭で計算しておく
-            if q_embedding is None:
-                 # フォールバック (あるいはエラー)
-                 score = 0
-                 dist = 1.0 # 適当な大文字
+            # クエリEmbeddingが取得できなかった場合は全行 dict モード(L2)で評価する
+            s_embedding = cat.embeddings[i].tolist()
+            # Cosine Similarity: dot(A, B) / (norm(A) * norm(B))
+            # Gemini Embeddingは通常正規化されていると仮定できるが、念のため計算
+            
+            dot_product = sum(a * b for a, b in zip(q_embedding, s_embedding))
+            norm_q = math.sqrt(sum(a * a for a in q_embedding))
+            norm_s = math.sqrt(sum(b * b for b in s_embedding))
+            
+            if norm_q * norm_s == 0:
+                similarity = 0.0
             else:
-                s_embedding = cand["embedding"]
-                # Cosine Similarity: dot(A, B) / (norm(A) * norm(B))
-                # Gemini Embeddingは通常正規化されていると仮定できるが、念のため計算
-                
-                dot_product = sum(a * b for a, b in zip(q_embedding, s_embedding))
-                norm_q = math.sqrt(sum(a * a for a in q_embedding))
-                norm_s = math.sqrt(sum(b * b for b in s_embedding))
-                
-                if norm_q * norm_s == 0:
-                    similarity = 0.0
-                else:
-                    similarity = dot_product / (norm_q * norm_s)
-                
-                # スコアは類似度そのものを使う (0~1)
-                score = similarity
-                # distanceは便宜上 1 - similarity とする
-                dist = 1.0 - similarity
+                similarity = dot_product / (norm_q * norm_s)
+            
+            # スコアは類似度そのものを使う (0~1)
+            score = similarity
+            # distanceは便宜上 1 - similarity とする
+            dist = 1.0 - similarity
 
         else:
             # 従来ロジック: L2距離 (Euclidean distance)
@@ -144,34 +255,339 @@ def recommend(request: RecommendationRequest) -> RecommendationResponse:
             
             # スコア化 (距離が0に近いほどスコアは1に近づく)
             score = 1.0 / (1.0 + dist)
+
+        if f_scores is not None:
+            # フレーバーチャートのスコアを合成する (distanceは味ベクトル/Embeddingのまま)
+            score = flavor.blend(score, float(f_scores[i]), settings.FLAVOR_WEIGHT)
+        if boost is not None:
+            score += float(boost[i])
         
-        # 理由生成
-        reason_text = _generate_reason(cand, q_hits, s_vector)
-        
-        item = RecommendationItem(
+        scored.append((score, dist, i))
+    
+    # 5. ランキング (スコア降順、同点は行位置順 = 安定ソートで上位top_k件を取るのと同じ)
+    top = heapq.nlargest(_pool_size(request.diversity, top_k), scored, key=lambda t: t[0])
+    if request.diversity is not None:
+        pool_rows = np.asarray([i for _, _, i in top], dtype=np.intp)
+        pool_scores = np.asarray([score for score, _, _ in top], dtype=np.float64)
+        top = [top[p] for p in _diversify(
+            cat, request.diversity, pool_rows, pool_scores, top_k, q_embedding is not None).tolist()]
+    
+    # top_k 件だけ組み立てる
+    result_items = [_make_item(cat, i, score, dist, q_hits, request.debug) for score, dist, i in top]
+    
+    return _make_response(request, top_k, mode, q_vector, result_items, q_flavor)
+
+
+def _rank_staged(cat: "catalog.Catalog", rows: np.ndarray, q_vector: List[float],
+                 q_embedding: Optional[List[float]], q_flavor: Optional[List[float]],
+                 index: Optional["ann.IVFIndex"], top_k: int,
+                 div: Optional[RecommendationDiversity] = None):
+    """
+    多段ランキング (USE_STAGED_RANKING=1)
+    1. retrieve: 安価な方法で候補を絞る
+       - ANNインデックスがあれば近いパーティションの行 (件数は ANN_NPROBE で決まる)
+       - それ以外は味ベクトルのL2距離の上位 RETRIEVE_CANDIDATES 件 (フィルタ後の行がそれ以下なら全行)
+    2. rerank: 候補だけを従来と同じ規則(コサイン類似度/L2距離)で厳密にスコアリングし、
+       フレーバーチャートの合成と人気度の加点もここで行う
+    3. diversify: 多様性の指定(div)がある場合のみ、スコア上位 DIVERSITY_POOL 件からMMRでtop_k件を選ぶ
+    Returns: (候補の行位置(昇順), 上位top_k件の候補内の位置, スコア, 距離, ステージごとの件数と所要時間)
+    """
+    stages: List[Dict[str, Any]] = []
+    started = time.perf_counter()
+
+    # 1. 候補生成 (候補は行位置の昇順に保つ = 同点の順序は1段の場合と同じ)
+    if index is not None:
+        candidates = _ann_candidate_rows(cat, index, rows, q_embedding, top_k)
+        method = "ann"
+    elif len(rows) > max(settings.RETRIEVE_CANDIDATES, top_k):
+        taste_scores, _ = cat.scorer.l2(q_vector, rows)
+        keep = top_k_positions(taste_scores, max(settings.RETRIEVE_CANDIDATES, top_k))
+        candidates = rows[np.sort(keep)]
+        method = "taste_l2"
+    else:
+        candidates = rows
+        method = "all"
+    started = _record_stage(stages, "retrieve", method, len(rows), len(candidates), started)
+
+    # 2. リランク
+    scores, dists = cat.scorer.score(q_vector, q_embedding, q_embedding is not None, candidates)
+    if q_flavor is not None:
+        f_scores = flavor.flavor_scores(cat.flavor_unit[candidates], q_flavor)
+        scores = flavor.blend(scores, f_scores, settings.FLAVOR_WEIGHT)
+    boost = _popularity_boost(cat)
+    if boost is not None:
+        scores = scores + boost[candidates]
+    positions = top_k_positions(scores, _pool_size(div, top_k))
+    started = _record_stage(stages, "rerank", "exact", len(candidates), len(positions), started)
+
+    # 3. 多様性
+    if div is not None:
+        n_pool = len(positions)
+        positions = positions[_diversify(
+            cat, div, candidates[positions], scores[positions], top_k, q_embedding is not None)]
+        _record_stage(stages, "diversify", "mmr", n_pool, len(positions), started)
+    return candidates, positions, scores, dists, stages
+
+
+def _pool_size(div: Optional[RecommendationDiversity], top_k: int) -> int:
+    """
+    スコア上位から取り出す件数 (多様性を考慮する場合はMMRの候補プール)
+    """
+    return max(top_k, settings.DIVERSITY_POOL) if div is not None else top_k
+
+
+def _diversify(cat: "catalog.Catalog", div: RecommendationDiversity, rows: np.ndarray, scores: np.ndarray,
+               top_k: int, use_embedding: bool) -> np.ndarray:
+    """
+    スコア降順の候補プールからMMRでtop_k件を選ぶ (Returns: プール内の位置)
+    スコアは関連度のまま返すため、多様性を考慮した順位ではスコアが降順にならないことがある
+    """
+    return diversity.mmr(cat, rows, scores, top_k, div.mmr_lambda, use_embedding,
+                         div.max_per_brewery, div.max_per_prefecture)
+
+
+def _record_stage(stages: List[Dict[str, Any]], name: str, method: str,
+                  n_in: int, n_out: int, started: float) -> float:
+    """
+    ステージの件数と所要時間(ミリ秒)を記録し、次のステージの開始時刻を返す
+    """
+    now = time.perf_counter()
+    stages.append({"stage": name, "method": method, "input": n_in, "output": n_out,
+                   "elapsed_ms": round((now - started) * 1000, 3)})
+    return now
+
+
+def _query_flavor(cat: "catalog.Catalog", q_scores: Dict[str, float]) -> Optional[List[float]]:
+    """
+    フレーバーチャートのスコアを合成する場合のクエリ(6軸)
+    無効時・チャートを持つ銘柄が無い場合・辞書にヒットしない場合は None
+    """
+    if settings.USE_FLAVOR_SCORING != 1 or not cat.has_flavor.any():
+        return None
+    return flavor.project_query(q_scores)
+
+
+def _popularity_boost(cat: "catalog.Catalog") -> Optional[np.ndarray]:
+    """
+    人気度による加点 (全行分、無効時は None)
+    同点の多い既定ベクトルの銘柄は、人気の高い順に並ぶ
+    """
+    if settings.USE_POPULARITY_PRIOR != 1:
+        return None
+    return settings.POPULARITY_WEIGHT * cat.popularity
+
+
+# rank_batch で一度にスコア行列を作るクエリ数 (メモリ使用量 = クエリ数 x 銘柄数)
+BATCH_SCORING_CHUNK = 256
+
+
+async def recommend_batch_async(raw_requests: List[Dict[str, Any]]) -> BatchRecommendationResponse:
+    """
+    複数リクエストをまとめて処理する (POST /recommend/batch)
+    要素ごとに検証し、不正な要素や失敗した要素はその要素だけ error を返す。
+    クエリEmbeddingはまとめて取得し、失敗した場合は全件 dict モードにフォールバックする。
+    """
+    results: List[Optional[BatchRecommendationResult]] = [None] * len(raw_requests)
+    valid: List[Tuple[int, RecommendationRequest]] = []
+    for idx, raw in enumerate(raw_requests):
+        try:
+            valid.append((idx, RecommendationRequest.model_validate(raw)))
+        except ValidationError as e:
+            results[idx] = BatchRecommendationResult(index=idx, error=f"invalid request: {e.errors()}")
+
+    requests = [req for _, req in valid]
+    q_embeddings: List[Optional[List[float]]] = [None] * len(requests)
+    if settings.USE_EMBEDDING == 1 and requests:
+        try:
+            q_embeddings = await get_async_embedding_client().get_query_embeddings(
+                [req.text for req in requests], timeout_sec=settings.RECOMMEND_BATCH_EMBED_TIMEOUT_SEC)
+        except Exception as e:
+            print(f"Failed to get batch embeddings: {e!r}")
+            # フォールバック: 従来モード
+
+    ranked = await run_in_threadpool(rank_batch, requests, q_embeddings)
+    for (idx, _), (response, error) in zip(valid, ranked):
+        results[idx] = BatchRecommendationResult(index=idx, response=response, error=error)
+    return BatchRecommendationResponse(results=results)
+
+
+def rank_batch(requests: List[RecommendationRequest],
+               q_embeddings: List[Optional[List[float]]]) -> List[Tuple[Optional[RecommendationResponse], Optional[str]]]:
+    """
+    複数リクエストのランキングをまとめて行う
+    味ベクトル/Embeddingのスコアはクエリ x 全銘柄の行列として一度に計算し、
+    フィルタと上位top_k件の抽出だけをリクエストごとに行う。
+    スコア/距離の規則は rank と同じ (ANNインデックスは使わず全件を評価する)
+    Returns: リクエストと同じ順序の (response, error)
+    """
+    cat = catalog.get_catalog()
+    out: List[Tuple[Optional[RecommendationResponse], Optional[str]]] = []
+    for start in range(0, len(requests), BATCH_SCORING_CHUNK):
+        chunk = requests[start:start + BATCH_SCORING_CHUNK]
+        chunk_embeddings = q_embeddings[start:start + BATCH_SCORING_CHUNK]
+        out.extend(_rank_chunk(cat, chunk, chunk_embeddings))
+    return out
+
+
+def _rank_chunk(cat: "catalog.Catalog", requests: List[RecommendationRequest],
+                q_embeddings: List[Optional[List[float]]]) -> List[Tuple[Optional[RecommendationResponse], Optional[str]]]:
+    parsed = [estimate_taste_vector(req.text) for req in requests]
+    q_vectors = np.asarray([vector for vector, _, _ in parsed], dtype=np.float64).reshape(len(requests), -1)
+    scores, dists = cat.scorer.l2_many(q_vectors)
+
+    # Embeddingを持つ行は、クエリEmbeddingがあるリクエストだけコサイン類似度で上書きする
+    # 次元がカタログと異なるクエリEmbeddingは切り詰めずにそのリクエストだけエラーにする
+    errors: Dict[int, str] = {}
+    emb_rows = np.flatnonzero(cat.has_embedding)
+    for qi, emb in enumerate(q_embeddings):
+        mismatch = cat.embedding_mismatch(emb)
+        if mismatch is not None:
+            errors[qi] = mismatch
+    with_emb = [qi for qi, emb in enumerate(q_embeddings) if emb is not None and qi not in errors]
+    if with_emb and len(emb_rows):
+        q_matrix = np.asarray([q_embeddings[qi] for qi in with_emb], dtype=np.float64)
+        sims, sim_dists = cat.scorer.cosine_many(q_matrix, emb_rows)
+        scores[np.ix_(with_emb, emb_rows)] = sims
+        dists[np.ix_(with_emb, emb_rows)] = sim_dists
+
+    # フレーバーチャートのスコアも、合成するリクエスト分を行列でまとめて計算する
+    q_flavors = [_query_flavor(cat, q_scores) for _, q_scores, _ in parsed]
+    with_flavor = [qi for qi, q_flavor in enumerate(q_flavors) if q_flavor is not None]
+    if with_flavor:
+        f_scores = flavor.flavor_scores(cat.flavor_unit, np.asarray([q_flavors[qi] for qi in with_flavor]))
+        scores[with_flavor] = flavor.blend(scores[with_flavor], f_scores, settings.FLAVOR_WEIGHT)
+    boost = _popularity_boost(cat)
+    if boost is not None:
+        scores += boost
+
+    out = []
+    for qi, req in enumerate(requests):
+        if qi in errors:
+            print(f"Failed to rank batch item: {errors[qi]}")
+            out.append((None, errors[qi]))
+            continue
+        try:
+            q_vector, _, q_hits = parsed[qi]
+            mode = "embedding" if q_embeddings[qi] is not None else "dict"
+            filters = req.filters
+            rows = cat.filter_rows(
+                prefectures=filters.prefecture if filters else None,
+                exclude_breweries=filters.exclude_brewery if filters else None,
+            )
+            top_k = req.top_k if req.top_k else 5
+            row_scores = scores[qi, rows]
+            positions = top_k_positions(row_scores, _pool_size(req.diversity, top_k))
+            if req.diversity is not None:
+                positions = positions[_diversify(
+                    cat, req.diversity, rows[positions], row_scores[positions], top_k, q_embeddings[qi] is not None)]
+            items = [
+                _make_item(cat, int(rows[p]), float(row_scores[p]), float(dists[qi, rows[p]]), q_hits, req.debug)
+                for p in positions
+            ]
+            out.append((_make_response(req, top_k, mode, q_vector, items, q_flavors[qi]), None))
+        except Exception as e:
+            print(f"Failed to rank batch item: {e!r}")
+            out.append((None, str(e)))
+    return out
+
+
+def similar(sake_id: int, top_k: int = 5, filters: Optional[RecommendationFilters] = None,
+            method: str = "auto") -> Optional[SimilarSakesResponse]:
+    """
+    GET /sakes/{sake_id}/similar の本体 (銘柄の味ベクトル/Embeddingを起点にした類似銘柄)
+
+    現在のカタログで計算した sake_neighbors があれば、それをフィルタで絞り込んで返す。
+    無い(古い)場合や、絞り込んだ結果がtop_k件に満たない場合はその場で計算する。
+    カタログに無い(ベクトル未計算の)銘柄は None
+    """
+    cat = catalog.get_catalog()
+    i = cat.row_of.get(sake_id)
+    if i is None:
+        return None
+    prefectures = filters.prefecture if filters else None
+    exclude_breweries = filters.exclude_brewery if filters else None
+
+    # 自分自身や非有限のスコア(旧版のエクスポートが保存したもの)は使わない
+    stored = [
+        (nid, score, dist) for nid, score, dist in db.get_sake_neighbors(sake_id, method, cat.neighbor_version)
+        if nid != sake_id and math.isfinite(score) and math.isfinite(dist)
+    ]
+    # 同じバージョンなら近傍は全てカタログにある
+    stored_rows = [cat.row_of[nid] for nid, _, _ in stored if nid in cat.row_of]
+    passing = cat.filter_subset(np.asarray(stored_rows, dtype=np.intp), prefectures, exclude_breweries)
+    # 保存済みリストが全銘柄を含む場合は件数が足りなくてもそれ以上は無い
+    if stored and (len(passing) >= top_k or len(stored) >= len(cat) - 1):
+        by_row = {row: (score, dist) for row, (_, score, dist) in zip(stored_rows, stored)}
+        top = [(j, *by_row[j]) for j in passing[:top_k].tolist()]
+        source = "precomputed"
+    else:
+        rows = cat.filter_rows(prefectures=prefectures, exclude_breweries=exclude_breweries)
+        top = neighbors.live_neighbors(cat, i, rows, top_k, method)
+        source = "live"
+
+    items = []
+    for j, score, dist in top:
+        cand = cat.row(j)
+        items.append(SimilarSakeItem(
             sake_id=cand["sake_id"],
             name=cand["name"],
             brewery=cand["brewery"],
             prefecture=cand["prefecture"],
             score=score,
             distance=dist,
-            taste_vector=s_vector,
-            reason=reason_text,
-            debug_info={"hits": q_hits} if request.debug else None
-        )
-        scored_items.append(item)
-    
-    # 5. ランキング (スコア降順)
-    scored_items.sort(key=lambda x: x.score, reverse=True)
-    
-    # top_k 件返す
-    top_k = request.top_k if request.top_k else 5
-    result_items = scored_items[:top_k]
-    
+            taste_vector=cand["vector"],
+        ))
+    return SimilarSakesResponse(sake_id=sake_id, top_k=top_k, method=method, source=source, recommendations=items)
+
+
+def _ann_candidate_rows(cat: "catalog.Catalog", index: "ann.IVFIndex", rows: np.ndarray,
+                        q_embedding: List[float], top_k: int) -> np.ndarray:
+    """
+    ANNインデックスで候補行を絞り込む
+    Embeddingを持たない行は従来通りL2で評価するため候補に残す。
+    絞り込み後がtop_k件に満たない場合は全件スキャンに戻す。
+    """
+    mask = ~cat.has_embedding
+    mask[index.probe(cat, q_embedding, settings.ANN_NPROBE)] = True
+    narrowed = rows[mask[rows]]
+    if len(narrowed) < top_k:
+        return rows
+    return narrowed
+
+
+def _make_item(cat: "catalog.Catalog", i: int, score: float, dist: float,
+               q_hits: Dict[str, List[str]], debug: Optional[bool]) -> RecommendationItem:
+    """
+    カタログのi行目からレスポンス用の推薦アイテムを組み立てる
+    """
+    cand = cat.row(i)
+    s_vector = cand["vector"]
+
+    # 理由生成
+    reason_text = _generate_reason(cand, q_hits, s_vector)
+
+    return RecommendationItem(
+        sake_id=cand["sake_id"],
+        name=cand["name"],
+        brewery=cand["brewery"],
+        prefecture=cand["prefecture"],
+        score=score,
+        distance=dist,
+        taste_vector=s_vector,
+        reason=reason_text,
+        debug_info={"hits": q_hits} if debug else None
+    )
+
+
+def _make_response(request: RecommendationRequest, top_k: int, mode: str,
+                   q_vector: List[float], items: List[RecommendationItem],
+                   q_flavor: Optional[List[float]] = None,
+                   debug_info: Optional[Dict[str, Any]] = None) -> RecommendationResponse:
     return RecommendationResponse(
         input_text=request.text,
         top_k=top_k,
         mode=mode,
-        query=RecommendationQuery(taste_vector=q_vector),
-        recommendations=result_items
+        query=RecommendationQuery(taste_vector=q_vector, flavor_vector=q_flavor),
+        recommendations=items,
+        debug_info=debug_info,
     )
@@ -0,0 +1,70 @@
+from typing import Dict, List, Optional
+
+import numpy as np
+
+# さけのわフレーバーチャートの6軸 (sakenowa_flavor_charts.f1 ~ f6)
+FLAVOR_AXES = ("華やか", "芳醇", "重厚", "穏やか", "ドライ", "軽快")
+FLAVOR_DIM = len(FLAVOR_AXES)
+
+# 辞書カテゴリ(taste_v1.LEXICONS)の素点 -> フレーバーチャート6軸 への射影
+#                  華やか 芳醇  重厚  穏やか ドライ 軽快
+_PROJECTION = {
+    "sweet":   [0.0, 0.5, 0.0, 0.3, 0.0, 0.0],
+    "dry":     [0.0, 0.0, 0.0, 0.0, 1.0, 0.3],
+    "light":   [0.0, 0.0, 0.0, 0.3, 0.3, 1.0],
+    "rich":    [0.0, 1.0, 0.7, 0.0, 0.0, 0.0],
+    "fruity":  [1.0, 0.3, 0.0, 0.0, 0.0, 0.0],
+    "modern":  [0.5, 0.0, 0.0, 0.0, 0.0, 0.3],
+    "classic": [0.0, 0.3, 0.7, 0.5, 0.0, 0.0],
+}
+
+
+def project_query(scores: Dict[str, float]) -> Optional[List[float]]:
+    """
+    クエリテキストの辞書カテゴリ素点(estimate_taste_vector の scores)をフレーバーチャートの6軸に射影する
+    どの軸にも当たらない(辞書にヒットしない)場合は None
+    """
+    q = np.zeros(FLAVOR_DIM, dtype=np.float64)
+    for category, weights in _PROJECTION.items():
+        score = scores.get(category, 0.0)
+        if score:
+            q += score * np.asarray(weights)
+    if not q.any():
+        return None
+    return q.tolist()
+
+
+def normalize_charts(charts: np.ndarray, has_chart: np.ndarray) -> np.ndarray:
+    """
+    銘柄 x 6 のフレーバーチャートを、軸ごとに標準化(チャートを持つ銘柄の平均0・分散1)してから行ごとにL2正規化する
+    チャートを持たない行はゼロベクトル
+    """
+    unit = np.zeros_like(charts, dtype=np.float64)
+    if not has_chart.any():
+        return unit
+    rows = charts[has_chart]
+    std = rows.std(axis=0)
+    z = (rows - rows.mean(axis=0)) / np.where(std > 0, std, 1.0)
+    norms = np.linalg.norm(z, axis=1, keepdims=True)
+    unit[has_chart] = np.divide(z, norms, out=np.zeros_like(z), where=norms > 0)
+    return unit
+
+
+def flavor_scores(unit: np.ndarray, q_flavors: np.ndarray) -> np.ndarray:
+    """
+    正規化済みチャートとクエリ(1件 (6,) または複数 (q, 6))のコサイン類似度を 0~1 に写したスコア
+    チャートを持たない行は 0.5 (中立)
+    Returns: (n,) または (q, n)
+    """
+    q = np.atleast_2d(np.asarray(q_flavors, dtype=np.float64))
+    q = q / np.linalg.norm(q, axis=1, keepdims=True)
+    sims = q @ unit.T
+    scores = (1.0 + sims) / 2.0
+    return scores[0] if np.ndim(q_flavors) == 1 else scores
+
+
+def blend(base: np.ndarray, flavor: np.ndarray, weight: float) -> np.ndarray:
+    """
+    味ベクトル/Embeddingのスコアとフレーバーチャートのスコアを重み付きで合成する
+    """
+    return (1.0 - weight) * base + weight * flavor
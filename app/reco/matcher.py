@@ -0,0 +1,90 @@
+import re
+from collections import deque
+from typing import Dict, List, Sequence, Tuple
+
+
+class LexiconMatcher:
+    """
+    複数カテゴリの辞書を1つの Aho–Corasick オートマトンにまとめた照合器
+
+    テキストを1回走査するだけで、全カテゴリの単語の出現(部分一致)を検出する。
+    失敗遷移を事前に展開した DFA にしているので、1文字あたり dict 参照1回で進む。
+    辞書の単語に現れない文字ではオートマトンは必ず初期状態に戻るため、
+    そうした文字は正規表現(C実装)で読み飛ばし、単語の文字が連続する区間だけを走査する。
+    """
+
+    def __init__(self, lexicons: Sequence[Tuple[str, Dict[str, float]]]):
+        self.categories = [name for name, _ in lexicons]
+        # 単語ごとの出力: (カテゴリ番号, 辞書内の順番, 単語, スコア)
+        outputs: List[List[Tuple[int, int, str, float]]] = [[]]
+        goto: List[Dict[str, int]] = [{}]
+
+        for cat_idx, (_, lexicon) in enumerate(lexicons):
+            for order, (word, score) in enumerate(lexicon.items()):
+                if not word:
+                    continue
+                state = 0
+                for ch in word:
+                    nxt = goto[state].get(ch)
+                    if nxt is None:
+                        nxt = len(goto)
+                        goto[state][ch] = nxt
+                        goto.append({})
+                        outputs.append([])
+                    state = nxt
+                outputs[state].append((cat_idx, order, word, score))
+
+        # BFS で失敗遷移を求め、遷移表を DFA に展開する
+        delta: List[Dict[str, int]] = [dict() for _ in goto]
+        delta[0] = dict(goto[0])
+        fail = [0] * len(goto)
+        queue = deque()
+        for child in goto[0].values():
+            queue.append(child)
+        while queue:
+            state = queue.popleft()
+            # 失敗先の遷移を引き継ぎ、自身の遷移で上書きする
+            table = dict(delta[fail[state]])
+            for ch, child in goto[state].items():
+                fail[child] = delta[fail[state]].get(ch, 0)
+                table[ch] = child
+                queue.append(child)
+            delta[state] = table
+            # 失敗先(より短い接尾辞)でマッチする単語も出力に含める
+            outputs[state] = outputs[state] + outputs[fail[state]]
+
+        self._delta = delta
+        self._step = [table.get for table in delta]
+        self._outputs = [tuple(out) for out in outputs]
+        alphabet = sorted({ch for table in goto for ch in table})
+        self._runs = re.compile("[" + "".join(re.escape(ch) for ch in alphabet) + "]+") if alphabet else None
+
+    def match(self, text: str) -> Tuple[Dict[str, float], Dict[str, List[str]]]:
+        """
+        テキスト中に出現する単語を検出し、カテゴリごとの最大スコアとヒット単語を返す
+        ヒット単語は辞書の定義順 (`k in text` を辞書順に調べた場合と同じ)
+        """
+        found: List[Dict[int, Tuple[str, float]]] = [{} for _ in self.categories]
+        step = self._step
+        outputs = self._outputs
+        for run in (self._runs.findall(text) if self._runs else ()):
+            state = 0
+            for ch in run:
+                state = step[state](ch, 0)
+                out = outputs[state]
+                if out:
+                    for cat_idx, order, word, score in out:
+                        found[cat_idx][order] = (word, score)
+
+        scores: Dict[str, float] = {}
+        hits: Dict[str, List[str]] = {}
+        for cat_idx, name in enumerate(self.categories):
+            matched = found[cat_idx]
+            if matched:
+                items = [matched[order] for order in sorted(matched)]
+                scores[name] = max(score for _, score in items)
+                hits[name] = [word for word, _ in items]
+            else:
+                scores[name] = 0.0
+                hits[name] = []
+        return scores, hits
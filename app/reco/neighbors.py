@@ -0,0 +1,151 @@
+import json
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from .catalog import Catalog
+from .scoring import top_k as top_k_positions
+
+# 近傍の計算方式
+#   auto:  起点がEmbeddingを持てば /recommend の embedding モードと同じ規則
+#          (Embeddingを持つ行はコサイン類似度、持たない行は味ベクトルのL2)、持たなければ味ベクトルのL2
+#   taste: 味ベクトルのL2のみ
+NEIGHBOR_METHODS = ("auto", "taste")
+
+# (近傍の sake_id, score, distance)
+Neighbor = Tuple[int, float, float]
+
+
+def select_rows(cat: Catalog, shard: int = 0, num_shards: int = 1,
+                after: Optional[int] = None, skip: Optional[Iterable[int]] = None) -> np.ndarray:
+    """
+    近傍を計算する起点の行を選ぶ (sake_id 昇順)
+    - shard / num_shards: sake_id % num_shards == shard の銘柄だけ (複数プロセスで分担する)
+    - after: この sake_id より大きい銘柄だけ (途中から再開する)
+    - skip: 計算済みの sake_id
+    """
+    ids = np.asarray(cat.sake_ids, dtype=np.int64)
+    mask = np.ones(len(ids), dtype=bool)
+    if num_shards > 1:
+        mask &= ids % num_shards == shard
+    if after is not None:
+        mask &= ids > after
+    if skip:
+        mask &= ~np.isin(ids, np.fromiter(skip, dtype=np.int64))
+    rows = np.flatnonzero(mask)
+    return rows[np.argsort(ids[rows], kind="stable")]
+
+
+def _score_block(cat: Catalog, block: np.ndarray, method: str) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    起点 block 行 x 全行 のスコア/距離を計算する (メモリは len(block) x 銘柄数)
+    """
+    scores, dists = cat.scorer.l2_many(cat.taste[block])
+    if method == "taste" or cat.embeddings is None:
+        return scores, dists
+
+    src = np.flatnonzero(cat.has_embedding[block])
+    emb_rows = np.flatnonzero(cat.has_embedding)
+    if len(src) and len(emb_rows):
+        sims, sim_dists = cat.scorer.cosine_many(cat.embeddings[block[src]], emb_rows)
+        scores[np.ix_(src, emb_rows)] = sims
+        dists[np.ix_(src, emb_rows)] = sim_dists
+    return scores, dists
+
+
+def iter_neighbors(cat: Catalog, rows: np.ndarray, n_neighbors: int = 10, method: str = "auto",
+                   block_size: int = 256) -> Iterator[Tuple[int, List[Neighbor]]]:
+    """
+    起点の各行について上位 n_neighbors 件の近傍を返す (自分自身は除く)
+    block_size 行ずつ計算するので、銘柄数 x 銘柄数 の行列は作らない
+    """
+    if method not in NEIGHBOR_METHODS:
+        raise ValueError(f"Unknown neighbor method: {method}")
+    # 自分自身を除くと候補は 銘柄数 - 1 件まで
+    k = min(n_neighbors, len(cat) - 1)
+    for start in range(0, len(rows), block_size):
+        block = rows[start:start + block_size]
+        scores, dists = _score_block(cat, block, method)
+        # 自分自身を除外する
+        scores[np.arange(len(block)), block] = -np.inf
+        for b, i in enumerate(block.tolist()):
+            neighbors = [
+                (cat.sake_ids[j], float(scores[b, j]), float(dists[b, j]))
+                for j in top_k_positions(scores[b], k).tolist()
+                if j != i and np.isfinite(scores[b, j])
+            ]
+            yield cat.sake_ids[i], neighbors
+
+
+def live_neighbors(cat: Catalog, i: int, rows: np.ndarray, n_neighbors: int,
+                   method: str = "auto") -> List[Tuple[int, float, float]]:
+    """
+    i行目を起点に、rows(フィルタ後の行位置)の中から上位 n_neighbors 件をその場で計算する
+    Returns: (行位置, score, distance) のリスト
+    """
+    scores, dists = _score_block(cat, np.array([i], dtype=np.intp), method)
+    rows = rows[rows != i]
+    row_scores = scores[0, rows]
+    return [
+        (int(rows[p]), float(row_scores[p]), float(dists[0, rows[p]]))
+        for p in top_k_positions(row_scores, n_neighbors)
+    ]
+
+
+def to_ndjson(sake_id: int, neighbors: List[Neighbor], method: str, version: str) -> str:
+    """
+    1銘柄分の近傍を NDJSON の1行にする
+    """
+    return json.dumps({
+        "sake_id": sake_id,
+        "method": method,
+        "catalog_version": version,
+        "neighbors": [
+            {"sake_id": nid, "score": score, "distance": dist} for nid, score, dist in neighbors
+        ],
+    }, ensure_ascii=False) + "\n"
+
+
+def stream_ndjson(cat: Catalog, rows: np.ndarray, n_neighbors: int, method: str,
+                  block_size: int) -> Iterator[str]:
+    """
+    GET /neighbors/export 用: 近傍を計算しながら NDJSON を1行ずつ返す
+    """
+    version = cat.neighbor_version
+    for sake_id, neighbors in iter_neighbors(cat, rows, n_neighbors, method, block_size):
+        yield to_ndjson(sake_id, neighbors, method, version)
+
+
+def save_neighbors(conn, items: List[Tuple[int, List[Neighbor]]], method: str, version: str) -> None:
+    """
+    近傍を sake_neighbors に保存する (銘柄・方式ごとに置き換える。他の方式の行は残す)
+    """
+    conn.executemany("DELETE FROM sake_neighbors WHERE sake_id = ? AND method = ?",
+                     [(sake_id, method) for sake_id, _ in items])
+    conn.executemany("""
+        INSERT INTO sake_neighbors (sake_id, rank, neighbor_id, score, distance, method, catalog_version)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, [
+        (sake_id, rank, nid, score, dist, method, version)
+        for sake_id, neighbors in items
+        for rank, (nid, score, dist) in enumerate(neighbors, start=1)
+    ])
+
+
+def load_done_ids(conn, method: str, version: str) -> List[int]:
+    """
+    現在のカタログで計算済みの sake_id (再開時に飛ばす)
+    """
+    rows = conn.execute(
+        "SELECT DISTINCT sake_id FROM sake_neighbors WHERE method = ? AND catalog_version = ?",
+        (method, version),
+    ).fetchall()
+    return [row[0] for row in rows]
+
+
+def neighbors_status(conn, version: str) -> Dict[str, Any]:
+    row = conn.execute("""
+        SELECT COUNT(DISTINCT sake_id), SUM(catalog_version = ?), MAX(computed_at)
+        FROM sake_neighbors
+    """, (version,)).fetchone()
+    return {"sakes": row[0] or 0, "fresh_rows": row[1] or 0, "last_computed_at": row[2]}
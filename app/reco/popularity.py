@@ -0,0 +1,45 @@
+from typing import Dict, Iterable, Tuple
+
+
+def _month_index(year_month: int) -> int:
+    """
+    YYYYMM -> 通算月 (月の差を取る用)
+    """
+    return (year_month // 100) * 12 + (year_month % 100 - 1)
+
+
+def compute_priors(history: Iterable[Tuple[int, int, int]], half_life_months: float,
+                   months: int) -> Dict[int, float]:
+    """
+    さけのわランキングの履歴 (sake_id, yearMonth, rank) から銘柄ごとの人気度(0~1)を計算する
+
+    最新の yearMonth から months ヶ月以内の各月について、順位を (最下位 - rank + 1) / 最下位 で 0~1 にし、
+    half_life_months ヶ月で半分になる重みで加重平均する (その月に載っていない銘柄は0として数える)。
+    減衰の基準は実行時刻ではなく最新のランキング月なので、同じデータなら結果は常に同じ。
+    ランキングに一度も載っていない銘柄は含まない (0 とみなす)
+    """
+    by_month: Dict[int, Dict[int, int]] = {}
+    for sake_id, year_month, rank in history:
+        ranks = by_month.setdefault(_month_index(year_month), {})
+        # 同じ月に複数回載っている場合は上位の順位を使う
+        ranks[sake_id] = min(rank, ranks.get(sake_id, rank))
+    if not by_month:
+        return {}
+
+    latest = max(by_month)
+    total_weight = 0.0
+    priors: Dict[int, float] = {}
+    for month in sorted(by_month):
+        age = latest - month
+        if age >= months:
+            continue
+        weight = 0.5 ** (age / half_life_months) if half_life_months > 0 else float(age == 0)
+        total_weight += weight
+        ranks = by_month[month]
+        lowest = max(ranks.values())
+        for sake_id, rank in ranks.items():
+            priors[sake_id] = priors.get(sake_id, 0.0) + weight * (lowest - rank + 1) / lowest
+
+    if total_weight == 0:
+        return {}
+    return {sake_id: value / total_weight for sake_id, value in priors.items()}
@@ -0,0 +1,140 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from ..config import settings
+from ..models import RecommendationRequest
+
+
+def canonical_request(request: RecommendationRequest) -> Dict[str, Any]:
+    """
+    結果が同じになるリクエストを同じ形にそろえる (キャッシュキー用)
+    - top_k 未指定は既定値(5)
+    - フィルタは未指定/空リストを区別せず、重複を除いて並べ替える (どちらも順序・重複に依存しない)
+    テキストは味ベクトルの推定にそのまま使うため、正規化しない
+    """
+    filters = request.filters
+    diversity = request.diversity
+    return {
+        "text": request.text,
+        "top_k": request.top_k if request.top_k else 5,
+        "prefecture": sorted(set(filters.prefecture)) if filters and filters.prefecture else [],
+        "exclude_brewery": sorted(set(filters.exclude_brewery)) if filters and filters.exclude_brewery else [],
+        "diversity": diversity.model_dump() if diversity is not None else None,
+    }
+
+
+def _ranking_settings() -> Tuple[Any, ...]:
+    """
+    ランキング結果に影響する設定 (プロセス内では通常変わらないが、変わった場合に古い結果を返さないようキーに含める)
+    """
+    return (
+        settings.USE_EMBEDDING, settings.EMBED_MODEL, settings.USE_VECTORIZED_SCORING,
+        settings.USE_ANN, settings.ANN_NPROBE, settings.USE_STAGED_RANKING, settings.RETRIEVE_CANDIDATES,
+        settings.DIVERSITY_POOL, settings.USE_FLAVOR_SCORING, settings.FLAVOR_WEIGHT,
+        settings.USE_POPULARITY_PRIOR, settings.POPULARITY_WEIGHT,
+    )
+
+
+class RecommendationCache:
+    """
+    /recommend のレスポンスキャッシュ
+
+    正規化したリクエスト + ランキング設定 + カタログのバージョンをキーに、
+    シリアライズ済みのレスポンス(JSONバイト列)とETagをメモリ上のLRU(件数/バイト数上限つき)に保持する。
+    カタログのバージョンが変わったら(sake_vectors などが更新されたら)全件を捨てる。
+    """
+
+    def __init__(self, max_size: int = 1024, max_bytes: int = 64 * 1024 * 1024):
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self._items: "OrderedDict[str, Tuple[bytes, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._version: Optional[str] = None
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def make_key(request: RecommendationRequest, catalog_version: str) -> str:
+        raw = json.dumps([catalog_version, _ranking_settings(), canonical_request(request)],
+                         ensure_ascii=False, sort_keys=True)
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def make_etag(body: bytes) -> str:
+        return '"' + hashlib.sha1(body).hexdigest() + '"'
+
+    def _check_version(self, catalog_version: str) -> None:
+        if catalog_version != self._version:
+            if self._items:
+                self.invalidations += 1
+            self._items.clear()
+            self.bytes = 0
+            self._version = catalog_version
+
+    def get(self, key: str, catalog_version: str) -> Optional[Tuple[bytes, str]]:
+        """
+        Returns: (レスポンスのJSON, ETag)。無ければ None
+        """
+        with self._lock:
+            self._check_version(catalog_version)
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item
+
+    def put(self, key: str, catalog_version: str, body: bytes) -> str:
+        """
+        レスポンスを保存して ETag を返す (上限を超えるほど大きいレスポンスは保存しない)
+        """
+        etag = self.make_etag(body)
+        with self._lock:
+            self._check_version(catalog_version)
+            if self.max_size <= 0 or len(body) > self.max_bytes:
+                return etag
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.bytes -= len(old[0])
+            self._items[key] = (body, etag)
+            self.bytes += len(body)
+            while len(self._items) > self.max_size or self.bytes > self.max_bytes:
+                _, (evicted, _) = self._items.popitem(last=False)
+                self.bytes -= len(evicted)
+                self.evictions += 1
+        return etag
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+            self.bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._items),
+                "max_size": self.max_size,
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "catalog_version": self._version,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+# /recommend のレスポンスキャッシュ (プロセス全体で共有)
+recommend_cache = RecommendationCache(
+    max_size=settings.RECOMMEND_CACHE_SIZE,
+    max_bytes=settings.RECOMMEND_CACHE_MAX_BYTES,
+)
@@ -0,0 +1,137 @@
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+
+
+class VectorScorer:
+    """
+    候補行列をまとめてスコアリングするバッチ計算エンジン
+
+    味ベクトル行列とEmbedding行列(および事前計算したノルム)を保持し、
+    カタログ全体(またはフィルタ後の行)を1回の行列ベクトル積で評価する。
+    スコア/距離の定義は engine の従来ループと同じ:
+      - L2:     distance = ||q - s||,      score = 1 / (1 + distance)
+      - Cosine: score = cos(q, s),         distance = 1 - score
+    """
+
+    def __init__(self, taste: np.ndarray, embeddings: Optional[np.ndarray] = None,
+                 has_embedding: Optional[np.ndarray] = None):
+        self.taste = taste
+        self.embeddings = embeddings
+        if has_embedding is None:
+            has_embedding = np.zeros(len(taste), dtype=bool)
+        self.has_embedding = has_embedding
+        # 味ベクトルの二乗ノルム (l2_many 用)
+        self.taste_sq = np.einsum("ij,ij->i", taste, taste)
+        # Embeddingのノルムはロード時に一度だけ計算しておく
+        self.embedding_norms = (
+            np.linalg.norm(embeddings, axis=1) if embeddings is not None else None
+        )
+
+    def l2(self, q_vector: Sequence[float], rows: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        味ベクトルのL2距離でスコアリングする
+        Returns: (scores, distances)
+        """
+        taste = self.taste if rows is None else self.taste[rows]
+        q = np.asarray(q_vector, dtype=np.float64)
+        diff = taste - q
+        dists = np.sqrt(np.einsum("ij,ij->i", diff, diff))
+        return 1.0 / (1.0 + dists), dists
+
+    def cosine(self, q_embedding: Sequence[float], rows: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Embeddingのコサイン類似度でスコアリングする
+        Returns: (scores, distances)
+        """
+        emb = self.embeddings if rows is None else self.embeddings[rows]
+        norms = self.embedding_norms if rows is None else self.embedding_norms[rows]
+        q = np.asarray(q_embedding, dtype=np.float64)
+        # 次元が異なるクエリは切り詰めずにエラーにする (呼び出し側で dict モード等にフォールバックする)
+        if len(q) != emb.shape[1]:
+            raise ValueError(f"Query embedding dimension {len(q)} does not match catalog dimension {emb.shape[1]}")
+        denom = norms * np.linalg.norm(q)
+        dots = emb @ q
+        # ノルムが0の行は類似度0とする
+        sims = np.divide(dots, denom, out=np.zeros_like(dots), where=denom != 0)
+        return sims, 1.0 - sims
+
+    def l2_many(self, q_vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        複数クエリの味ベクトルL2距離を全行に対してまとめて計算する
+        q_vectors: (q, 4) / Returns: (scores, distances) それぞれ (q, n)
+        ||q - s||^2 = ||q||^2 + ||s||^2 - 2 q.s として行列積1回で計算する ((q, n, 4) の差分テンソルは作らない)
+        """
+        q_vectors = np.asarray(q_vectors, dtype=np.float64)
+        sq = np.einsum("ij,ij->i", q_vectors, q_vectors)[:, None] + self.taste_sq[None, :]
+        sq -= 2.0 * (q_vectors @ self.taste.T)
+        # 桁落ちで負になった分は0に丸める
+        np.maximum(sq, 0.0, out=sq)
+        dists = np.sqrt(sq, out=sq)
+        return 1.0 / (1.0 + dists), dists
+
+    def cosine_many(self, q_embeddings: np.ndarray, rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        複数クエリのコサイン類似度を行列積1回で計算する
+        q_embeddings: (q, dim) / Returns: (scores, distances) それぞれ (q, len(rows))
+        """
+        emb = self.embeddings[rows]
+        if q_embeddings.shape[1] != emb.shape[1]:
+            raise ValueError(
+                f"Query embedding dimension {q_embeddings.shape[1]} does not match catalog dimension {emb.shape[1]}")
+        denom = np.linalg.norm(q_embeddings, axis=1)[:, None] * self.embedding_norms[rows][None, :]
+        dots = q_embeddings @ emb.T
+        sims = np.divide(dots, denom, out=np.zeros_like(dots), where=denom != 0)
+        return sims, 1.0 - sims
+
+    def score(self, q_vector: Sequence[float], q_embedding: Optional[Sequence[float]],
+              use_embedding: bool, rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        engine の従来ロジックと同じ規則で行ごとの計算方式を切り替えてスコアリングする
+        - use_embedding かつ Embeddingを持つ行: コサイン類似度
+          (クエリEmbeddingが取れなかった場合は score=0, distance=1.0)
+        - それ以外の行: 味ベクトルのL2距離
+        rows は昇順・重複なしの行位置 (全行の場合は行列のコピーを避ける)
+        """
+        full = len(rows) == len(self.taste)
+        scores, dists = self.l2(q_vector, None if full else rows)
+        if not use_embedding or self.embeddings is None:
+            return scores, dists
+
+        emb_mask = self.has_embedding[rows]
+        if not emb_mask.any():
+            return scores, dists
+
+        if q_embedding is None:
+            scores[emb_mask] = 0.0
+            dists[emb_mask] = 1.0
+        else:
+            emb_rows = None if full and emb_mask.all() else rows[emb_mask]
+            e_scores, e_dists = self.cosine(q_embedding, emb_rows)
+            scores[emb_mask] = e_scores
+            dists[emb_mask] = e_dists
+        return scores, dists
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    スコア上位k件の位置をスコア降順で返す
+
+    argpartition でちょうどk件を取り出し、そのk件だけを並べ替える。
+    同点は位置の若い順(従来の安定ソートと同じ順序)にする。
+    """
+    n = len(scores)
+    if k <= 0 or n == 0:
+        return np.empty(0, dtype=np.intp)
+    if k >= n:
+        candidates = np.arange(n)
+    else:
+        part = np.argpartition(-scores, k - 1)[:k]
+        threshold = scores[part].min()
+        # k位より上は全て part に入っている。k位と同点の銘柄は位置の若い順に残りの枠を埋める
+        above = part[scores[part] > threshold]
+        ties = np.flatnonzero(scores == threshold)[:k - len(above)]
+        candidates = np.concatenate([above, ties])
+    order = np.lexsort((candidates, -scores[candidates]))
+    return candidates[order]
+
@@ -0,0 +1,120 @@
+import asyncio
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from starlette.concurrency import run_in_threadpool
+
+from .. import database as db
+from ..config import settings
+from ..models import SakeListItem, SakeSearchResponse
+from . import ann, catalog
+from .embedding import get_async_embedding_client
+from .scoring import top_k as top_k_positions
+
+SEARCH_MODES = ("keyword", "semantic", "hybrid")
+
+
+def semantic_search(cat: "catalog.Catalog", q_embedding: List[float], limit: int) -> List[Tuple[int, float]]:
+    """
+    インメモリカタログのEmbeddingとのコサイン類似度で検索する
+    Returns: (カタログの行番号, 類似度) のリスト (類似度降順)
+    """
+    mismatch = cat.embedding_mismatch(q_embedding)
+    if mismatch is not None:
+        # 切り詰めずに空を返す (呼び出し側でキーワード検索の結果にフォールバックする)
+        print(f"{mismatch}; skipping semantic search")
+        return []
+    rows = np.flatnonzero(cat.has_embedding)
+    index = ann.get_index() if settings.USE_ANN == 1 else None
+    if index is not None:
+        # ANNインデックスがあれば候補を絞り込む (足りなければ全件)
+        probed = np.intersect1d(rows, index.probe(cat, q_embedding, settings.ANN_NPROBE))
+        if len(probed) >= limit:
+            rows = probed
+    if len(rows) == 0:
+        return []
+    scores, _ = cat.scorer.cosine(q_embedding, rows)
+    return [(int(rows[p]), float(scores[p])) for p in top_k_positions(scores, limit)]
+
+
+def reciprocal_rank_fusion(rankings: List[List[int]], k: int) -> List[int]:
+    """
+    複数の順位リスト(sake_id)を Reciprocal Rank Fusion で1つにまとめる
+    score(d) = Σ 1 / (k + rank)、同点は sake_id 昇順
+    """
+    fused: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, sake_id in enumerate(ranking, start=1):
+            fused[sake_id] = fused.get(sake_id, 0.0) + 1.0 / (k + rank)
+    return sorted(fused, key=lambda sake_id: (-fused[sake_id], sake_id))
+
+
+def _catalog_item(cat: "catalog.Catalog", i: int) -> SakeListItem:
+    return SakeListItem(
+        sake_id=cat.sake_ids[i],
+        name=cat.names[i],
+        brewery=cat.breweries[i],
+        prefecture=cat.prefectures[i],
+    )
+
+
+def _fuse(cat: "catalog.Catalog", keyword_items: List[SakeListItem], semantic_rows: List[Tuple[int, float]],
+          mode: str, limit: int) -> List[SakeListItem]:
+    items: Dict[int, SakeListItem] = {item.sake_id: item for item in keyword_items}
+    for i, _ in semantic_rows:
+        items.setdefault(cat.sake_ids[i], _catalog_item(cat, i))
+    semantic_ids = [cat.sake_ids[i] for i, _ in semantic_rows]
+    if mode == "semantic":
+        return [items[sake_id] for sake_id in semantic_ids[:limit]]
+    keyword_ids = [item.sake_id for item in keyword_items]
+    fused = reciprocal_rank_fusion([keyword_ids, semantic_ids], settings.SEARCH_RRF_K)
+    return [items[sake_id] for sake_id in fused[:limit]]
+
+
+async def search_async(query: str, limit: int, mode: Optional[str] = None,
+                       in_texts: bool = False) -> SakeSearchResponse:
+    """
+    /search の本体
+
+    - keyword: FTS5/LIKE によるキーワード検索
+    - semantic: クエリEmbeddingとカタログのEmbeddingのコサイン類似度
+    - hybrid: 両者を Reciprocal Rank Fusion で融合
+
+    キーワード検索とクエリEmbeddingの取得は並行して行い、
+    Embeddingが SEARCH_LATENCY_BUDGET_SEC 以内に取れなければキーワード検索の結果を返す。
+    """
+    if mode is None:
+        mode = settings.SEARCH_MODE if settings.USE_EMBEDDING == 1 else "keyword"
+    if mode not in SEARCH_MODES:
+        raise ValueError(f"Unknown search mode: {mode}")
+
+    if mode == "keyword":
+        items = await run_in_threadpool(db.search_sakes, query, limit, in_texts)
+        return SakeSearchResponse(items=items, mode="keyword")
+
+    candidates = max(limit, settings.SEARCH_CANDIDATES)
+    budget = settings.SEARCH_LATENCY_BUDGET_SEC
+
+    async def _embed() -> Optional[List[float]]:
+        try:
+            return await get_async_embedding_client().get_query_embedding(query, timeout_sec=budget)
+        except Exception as e:
+            print(f"Failed to get embedding for search: {e!r}")
+            return None
+
+    keyword_items, q_embedding = await asyncio.gather(
+        run_in_threadpool(db.search_sakes, query, candidates, in_texts),
+        _embed(),
+    )
+    if q_embedding is None:
+        # 予算切れ/失敗: キーワード検索の結果だけを返す
+        return SakeSearchResponse(items=keyword_items[:limit], mode="keyword")
+
+    # 行番号がずれないよう、スコアリングと結果の組み立てで同じカタログを使う
+    cat = await run_in_threadpool(catalog.get_catalog)
+    semantic_rows = await run_in_threadpool(semantic_search, cat, q_embedding, candidates)
+    if not semantic_rows:
+        # Embedding計算済みの銘柄がない
+        return SakeSearchResponse(items=keyword_items[:limit], mode="keyword")
+    items = _fuse(cat, keyword_items, semantic_rows, mode, limit)
+    return SakeSearchResponse(items=items, mode=mode)
@@ -3,9 +3,24 @@ from .lexicon_v1 import (
     SWEET_WORDS, DRY_WORDS, LIGHT_WORDS, RICH_WORDS,
     FRUITY_WORDS, MODERN_WORDS, CLASSIC_WORDS
 )
+from .matcher import LexiconMatcher
 
 from typing import List, Dict, Tuple, Any
 
+# カテゴリ名と辞書 (この順で scores / hits に格納される)
+LEXICONS = [
+    ("sweet", SWEET_WORDS),
+    ("dry", DRY_WORDS),
+    ("light", LIGHT_WORDS),
+    ("rich", RICH_WORDS),
+    ("fruity", FRUITY_WORDS),
+    ("modern", MODERN_WORDS),
+    ("classic", CLASSIC_WORDS),
+]
+
+# 辞書はインポート時に1回だけオートマトンにコンパイルする
+_matcher = LexiconMatcher(LEXICONS)
+
 def estimate_taste_vector(text: str) -> Tuple[List[float], Dict[str, float]]:
     """
     テキストから日本酒の味ベクトル(4次元)とスコア明細を推定する。
@@ -20,26 +35,8 @@ def estimate_taste_vector(text: str) -> Tuple[List[float], Dict[str, float]]:
     if not text:
         return [0.0, 0.0, 0.0, 0.0], {}, {}
 
-    scores = {}
-    hits = {}
-
-    def _calc(category: str, lexicon: Dict[str, float]):
-        matched = {k: v for k, v in lexicon.items() if k in text}
-        if matched:
-            scores[category] = max(matched.values())
-            # マッチした単語を全て記録 (理由生成で使う)
-            hits[category] = list(matched.keys())
-        else:
-            scores[category] = 0.0
-            hits[category] = []
-
-    _calc("sweet", SWEET_WORDS)
-    _calc("dry", DRY_WORDS)
-    _calc("light", LIGHT_WORDS)
-    _calc("rich", RICH_WORDS)
-    _calc("fruity", FRUITY_WORDS)
-    _calc("modern", MODERN_WORDS)
-    _calc("classic", CLASSIC_WORDS)
+    # 全カテゴリの辞書を1回の走査で照合する
+    scores, hits = _matcher.match(text)
 
     # 4次元ベクトルの組み立て
     # 1. 甘辛 
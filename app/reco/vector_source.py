@@ -0,0 +1,39 @@
+import hashlib
+from typing import Any, Dict, List, Optional
+
+# 味ベクトルの生成ロジックのバージョン (sake_vectors.version)
+TASTE_VERSION = "v1-dict"
+
+
+def source_hash(name: str, brewery: Optional[str], prefecture: Optional[str], texts: List[str]) -> str:
+    """
+    ベクトル計算の入力(銘柄名/蔵元/都道府県/sake_texts)のハッシュ
+    入力が変わっていない銘柄は再計算しない(差分計算)ために sake_vectors に保存する
+    """
+    parts = [name or "", brewery or "", prefecture or ""] + list(texts)
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+def embedding_source_hash(source: str, model: str) -> str:
+    """
+    Embedding用のハッシュ (入力が同じでもモデルが変われば再計算する)
+    """
+    return hashlib.sha256(f"{model}\x1f{source}".encode("utf-8")).hexdigest()
+
+
+def is_taste_stale(row: Dict[str, Any]) -> bool:
+    """
+    味ベクトルが未計算、または入力/バージョンが変わっている
+    """
+    return (
+        not row["has_vector"]
+        or row["source_hash"] != row["current_hash"]
+        or row["version"] != TASTE_VERSION
+    )
+
+
+def is_embedding_stale(row: Dict[str, Any], model: str) -> bool:
+    """
+    Embeddingが未計算、または入力/モデルが変わっている
+    """
+    return row["embedding_source_hash"] != embedding_source_hash(row["current_hash"], model)
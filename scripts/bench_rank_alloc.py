@@ -0,0 +1,105 @@
+# Usage: uv run python scripts/bench_rank_alloc.py [--sakes 3000] [--top-k 5]
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+from typing import List, Optional
+from unittest.mock import patch
+
+# プロジェクトルートをパスに追加
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from app.config import settings
+from app.models import RecommendationRequest, RecommendationResponse
+from app.reco import engine
+from app.reco.catalog import Catalog
+from app.reco.taste_v1 import estimate_taste_vector
+
+
+def make_catalog(n: int, seed: int = 0) -> Catalog:
+    rnd = random.Random(seed)
+    rows = [{
+        "sake_id": i + 1,
+        "name": f"Sake {i}",
+        "brewery": f"Brewery {i % 300}",
+        "prefecture": f"Pref {i % 47}",
+        "vector": [rnd.choice([-1.0, -0.5, 0.0, 0.5, 1.0]) for _ in range(4)],
+        "embedding": None,
+    } for i in range(n)]
+    return Catalog.from_rows(rows, fingerprint=("bench",))
+
+
+def rank_eager(request: RecommendationRequest, cat: Catalog,
+               q_embedding: Optional[List[float]] = None) -> RecommendationResponse:
+    """
+    変更前の実装: 全候補の RecommendationItem と推薦理由を作ってから並べ替えて切り捨てる (dictモード)
+    """
+    q_vector, _, q_hits = estimate_taste_vector(request.text)
+    top_k = request.top_k if request.top_k else 5
+    items = []
+    for i in range(len(cat)):
+        cand = cat.row(i)
+        dist = sum((q - s) ** 2 for q, s in zip(q_vector, cand["vector"])) ** 0.5
+        items.append(engine._make_item(cat, i, 1.0 / (1.0 + dist), dist, q_hits, request.debug))
+    items.sort(key=lambda x: x.score, reverse=True)
+    return engine._make_response(request, top_k, "dict", q_vector, items[:top_k])
+
+
+def measure(label: str, fn, requests: List[RecommendationRequest], cat: Catalog) -> List[List[int]]:
+    counts = {"items": 0, "reasons": 0}
+    make_item, generate_reason = engine._make_item, engine._generate_reason
+
+    def counting_make_item(*args, **kwargs):
+        counts["items"] += 1
+        return make_item(*args, **kwargs)
+
+    def counting_reason(*args, **kwargs):
+        counts["reasons"] += 1
+        return generate_reason(*args, **kwargs)
+
+    results = []
+    with patch.object(engine, "_make_item", counting_make_item), \
+         patch.object(engine, "_generate_reason", counting_reason):
+        # 確保量 (リクエストごとのピーク)
+        peaks = []
+        tracemalloc.start()
+        for req in requests:
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            res = fn(req, cat)
+            peaks.append(tracemalloc.get_traced_memory()[1] - base)
+            results.append([r.sake_id for r in res.recommendations])
+        tracemalloc.stop()
+
+        # レイテンシ (tracemalloc なし)
+        t0 = time.perf_counter()
+        for req in requests:
+            fn(req, cat)
+        elapsed = (time.perf_counter() - t0) / len(requests)
+
+    n = len(requests) * 2
+    print(f"{label:<6} peak={sum(peaks) / len(peaks) / 1024:8.1f}KiB/req  "
+          f"items={counts['items'] / n:7.1f}/req  reasons={counts['reasons'] / n:7.1f}/req  "
+          f"latency={elapsed * 1000:6.2f}ms/req")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="/recommend のランキング処理のアロケーション比較 (全件組み立て vs 上位top_kのみ)")
+    parser.add_argument("--sakes", type=int, default=3000)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--requests", type=int, default=50)
+    args = parser.parse_args()
+
+    cat = make_catalog(args.sakes)
+    texts = ["フルーティで甘口", "辛口ですっきり", "濃厚で芳醇なクラシックタイプ", "ワインのような酸味"]
+    requests = [RecommendationRequest(text=texts[n % len(texts)], top_k=args.top_k) for n in range(args.requests)]
+
+    print(f"catalog={args.sakes} sakes, top_k={args.top_k}, requests={args.requests} (dict mode)")
+    with patch.object(settings, "USE_VECTORIZED_SCORING", 0), patch.object(settings, "USE_ANN", 0), \
+         patch("app.reco.catalog.get_catalog", return_value=cat):
+        before = measure("eager", rank_eager, requests, cat)
+        after = measure("lazy", lambda req, c: engine.rank(req), requests, cat)
+    assert before == after, "ranking changed"
@@ -0,0 +1,116 @@
+# Usage: uv run python scripts/bench_search.py [--sakes 3000] [--texts-per-sake 5] [--queries 200]
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# プロジェクトルートをパスに追加
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from app.config import settings
+
+ROOT = Path(__file__).resolve().parents[1]
+SCHEMA_PATH = ROOT / "app" / "db" / "schema.sql"
+SEARCH_FTS_PATH = ROOT / "app" / "db" / "migrations" / "002_search_fts.sql"
+
+PREFECTURES = ["北海道", "青森県", "秋田県", "山形県", "新潟県", "長野県", "静岡県", "兵庫県", "京都府", "広島県", "山口県", "高知県", "佐賀県"]
+KANJI = "酒泉菊鶴正宗月山川田水花雪梅松竹龍鳳白黒金銀大吟醸純米本醸造生一喜久寿福富士玉光明"
+REVIEW = "冷やでも燗でも美味しい。香りは穏やかで、口に含むと米の旨味が広がる。食中酒として優秀。"
+
+
+def _word(rnd: random.Random, n: int) -> str:
+    return "".join(rnd.choice(KANJI) for _ in range(n))
+
+
+def build_catalog(path: str, sakes: int, texts_per_sake: int, seed: int) -> None:
+    """
+    さけのわ規模の合成カタログを作る (銘柄/蔵元/別名/レビュー)
+    """
+    rnd = random.Random(seed)
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA_PATH.read_text(encoding="utf-8"))
+    conn.executescript(SEARCH_FTS_PATH.read_text(encoding="utf-8"))
+    for i in range(sakes):
+        name = f"{_word(rnd, rnd.randint(2, 4))} {_word(rnd, 2)}"
+        brewery = f"{_word(rnd, 2)}酒造"
+        cur = conn.execute(
+            "INSERT INTO sake_master (name, brewery, prefecture) VALUES (?, ?, ?)",
+            (name, brewery, rnd.choice(PREFECTURES)),
+        )
+        sake_id = cur.lastrowid
+        conn.execute("INSERT INTO sake_aliases (sake_id, alias) VALUES (?, ?)", (sake_id, f"alias-{i:05d}"))
+        conn.executemany(
+            "INSERT INTO sake_texts (sake_id, source, text) VALUES (?, 'sakenowa_review', ?)",
+            [(sake_id, REVIEW + _word(rnd, 8)) for _ in range(texts_per_sake)],
+        )
+    conn.commit()
+    conn.close()
+
+
+def _timeit(fn, queries, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for q in queries:
+            fn(q)
+        best = min(best, time.perf_counter() - t0)
+    return best / len(queries)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="/search のベンチマーク (LIKE全件走査 vs FTS5)")
+    parser.add_argument("--sakes", type=int, default=3000)
+    parser.add_argument("--texts-per-sake", type=int, default=5)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    settings.DB_PATH = os.path.join(tmpdir, "bench_search.db")
+    t0 = time.perf_counter()
+    build_catalog(settings.DB_PATH, args.sakes, args.texts_per_sake, args.seed)
+    print(f"catalog: {args.sakes} sakes, {args.sakes * args.texts_per_sake} texts (built in {time.perf_counter() - t0:.1f}s)")
+
+    from app import database as db
+
+    rnd = random.Random(args.seed + 1)
+    conn = sqlite3.connect(settings.DB_PATH)
+    names = [r[0] for r in conn.execute("SELECT name FROM sake_master")]
+    queries = []
+    while len(queries) < args.queries:
+        name = rnd.choice(names).replace(" ", "")
+        start = rnd.randint(0, max(0, len(name) - 3))
+        queries.append(name[start:start + 3])
+
+    def like_search(q):
+        # 従来の実装
+        return conn.execute(
+            """
+            SELECT sake_id, name, brewery, prefecture
+            FROM sake_master
+            WHERE name LIKE ? OR brewery LIKE ? OR prefecture LIKE ?
+            ORDER BY prefecture ASC, brewery ASC, sake_id ASC
+            LIMIT ?
+            """,
+            (f"%{q}%", f"%{q}%", f"%{q}%", 20),
+        ).fetchall()
+
+    def fts_search(q):
+        return db.search_sakes(q, 20)
+
+    # 結果集合が一致することを確認する (件数上限なし)
+    for q in queries:
+        old = {r[0] for r in conn.execute(
+            "SELECT sake_id FROM sake_master WHERE name LIKE ? OR brewery LIKE ? OR prefecture LIKE ?",
+            (f"%{q}%",) * 3)}
+        new = {item.sake_id for item in db.search_sakes(q, 100000)}
+        assert old == new, q
+
+    like = _timeit(like_search, queries, args.repeat)
+    fts = _timeit(fts_search, queries, args.repeat)
+    print(f"LIKE: {like * 1e6:8.1f}us/query  FTS5: {fts * 1e6:8.1f}us/query  speedup={like / fts:5.1f}x")
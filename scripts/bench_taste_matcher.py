@@ -0,0 +1,107 @@
+# Usage: uv run python scripts/bench_taste_matcher.py [--texts 200] [--length 500 2000] [--hit-rate 0.1] [--lexicon-scale 1 4]
+import argparse
+import os
+import random
+import sys
+import time
+from typing import Dict, List, Tuple
+
+# プロジェクトルートをパスに追加
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from app.reco.matcher import LexiconMatcher
+from app.reco.taste_v1 import LEXICONS
+
+# レビューの地の文 (辞書の単語を含まない)
+SENTENCES = [
+    "今日は友人と居酒屋でこのお酒を頂きました。",
+    "冷酒でも燗酒でも楽しめて、刺身や焼き鳥との相性も抜群です。",
+    "精米歩合五十五パーセントの純米吟醸、無濾過生原酒とのこと。",
+    "開栓直後は少し閉じた印象でしたが、二日目から印象が変化しました。",
+    "酒販店の店主に勧められて購入、720mlで1,650円(税込)。",
+    "山田錦を使用した限定品で、蔵元の新しい挑戦が感じられる一本。",
+    "グラスに注ぐと微発泡で、口に含むと舌の上で弾けるような感触。",
+    "正月に家族で飲むために購入しましたが、評判は上々でした。",
+]
+
+
+def scan_match(text: str, lexicons=LEXICONS) -> Tuple[Dict[str, float], Dict[str, List[str]]]:
+    """
+    従来の実装: 全辞書の単語ごとに `k in text` で部分一致を調べる
+    """
+    scores: Dict[str, float] = {}
+    hits: Dict[str, List[str]] = {}
+    for category, lexicon in lexicons:
+        matched = {k: v for k, v in lexicon.items() if k in text}
+        if matched:
+            scores[category] = max(matched.values())
+            hits[category] = list(matched.keys())
+        else:
+            scores[category] = 0.0
+            hits[category] = []
+    return scores, hits
+
+
+def scale_lexicons(rnd: random.Random, scale: int):
+    """
+    辞書の成長を模擬して、各カテゴリに (scale - 1) 倍の架空の単語(漢字2〜4文字)を足す
+    """
+    scaled = []
+    for category, lexicon in LEXICONS:
+        extended = dict(lexicon)
+        while len(extended) < len(lexicon) * scale:
+            word = "".join(chr(rnd.randint(0x4E00, 0x9FFF)) for _ in range(rnd.randint(2, 4)))
+            extended.setdefault(word, round(rnd.random(), 1))
+        scaled.append((category, extended))
+    return scaled
+
+
+def make_review(rnd: random.Random, length: int, hit_rate: float = 0.1) -> str:
+    """
+    地の文に辞書の単語をときどき挟んだ長めのレビュー文を作る
+    """
+    # 架空の単語は地の文には出てこないので、ヒットは元の辞書の単語だけ
+    words = [w for _, lexicon in LEXICONS for w in lexicon]
+    parts: List[str] = []
+    size = 0
+    while size < length:
+        part = rnd.choice(words) + "な感じ。" if rnd.random() < hit_rate else rnd.choice(SENTENCES)
+        parts.append(part)
+        size += len(part)
+    return "".join(parts)[:length]
+
+
+def bench(fn, texts: List[str], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for text in texts:
+            fn(text)
+        best = min(best, time.perf_counter() - t0)
+    return best / len(texts)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="味ベクトル推定の辞書照合のベンチマーク (従来の部分一致 vs Aho–Corasick)")
+    parser.add_argument("--texts", type=int, default=200)
+    parser.add_argument("--length", type=int, nargs="+", default=[30, 500, 2000, 10000], help="テキスト長(文字数)")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--hit-rate", type=float, default=0.1, help="文ごとに辞書の単語を含む確率")
+    parser.add_argument("--lexicon-scale", type=int, nargs="+", default=[1, 4], help="辞書の単語数の倍率")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rnd = random.Random(args.seed)
+    for scale in args.lexicon_scale:
+        lexicons = scale_lexicons(rnd, scale)
+        matcher = LexiconMatcher(lexicons)
+        n_words = sum(len(lexicon) for _, lexicon in lexicons)
+        print(f"lexicon: {n_words} words in {len(lexicons)} categories")
+        for length in args.length:
+            texts = [make_review(rnd, length, args.hit_rate) for _ in range(args.texts)]
+            # 結果が従来実装と一致することを確認する
+            for text in texts:
+                assert matcher.match(text) == scan_match(text, lexicons), text
+            scan = bench(lambda t: scan_match(t, lexicons), texts, args.repeat)
+            ac = bench(matcher.match, texts, args.repeat)
+            print(f"  length={length:>6}  scan={scan * 1e6:9.1f}us  aho-corasick={ac * 1e6:9.1f}us  speedup={scan / ac:5.2f}x")
@@ -0,0 +1,77 @@
+# Usage: uv run python scripts/build_ann_index.py [--nlist 64] [--check-recall]
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+# プロジェクトルートをパスに追加
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from app.config import settings
+from app.reco import catalog
+from app.reco.ann import IVFIndex, recall_at_k
+
+
+def build_index(output: str, nlist: int, n_iter: int, seed: int) -> IVFIndex:
+    print("Loading catalog...")
+    cat = catalog.load_catalog()
+    rows = np.flatnonzero(cat.has_embedding)
+    if len(rows) == 0:
+        raise SystemExit("Error: no embeddings found. Run scripts/compute_embeddings.py first.")
+
+    print(f"Building IVF index for {len(rows)} embeddings (dim={cat.embedding_dim})...")
+    started = time.perf_counter()
+    index = IVFIndex.build(
+        sake_ids=[cat.sake_ids[i] for i in rows],
+        embeddings=cat.embeddings[rows],
+        nlist=nlist,
+        n_iter=n_iter,
+        seed=seed,
+        meta={"model": settings.EMBED_MODEL, "catalog_fingerprint": list(cat.fingerprint)},
+    )
+    sizes = np.diff(index.list_offsets)
+    print(f"  nlist={index.nlist}, list size min/avg/max = {sizes.min()}/{sizes.mean():.1f}/{sizes.max()}"
+          f" ({time.perf_counter() - started:.1f}s)")
+
+    index.save(output)
+    print(f"✅ ANN index saved: {output}")
+    return index
+
+
+def check_recall(index: IVFIndex, k: int, n_queries: int, noise: float, nprobes, seed: int) -> None:
+    """
+    カタログのEmbeddingにノイズを加えた擬似クエリで、厳密スコアとのrecall@kを測る
+    """
+    cat = catalog.load_catalog()
+    rows = np.flatnonzero(cat.has_embedding)
+    rng = np.random.default_rng(seed)
+    picked = cat.embeddings[rng.choice(rows, size=min(n_queries, len(rows)), replace=False)]
+    scale = noise * np.linalg.norm(picked, axis=1, keepdims=True) / np.sqrt(cat.embedding_dim)
+    queries = picked + rng.normal(size=picked.shape) * scale
+
+    print(f"\nrecall@{k} over {len(queries)} queries (noise={noise})")
+    print(f"{'nprobe':>6} {'recall':>7} {'cands':>8} {'exact_ms':>9} {'ann_ms':>7}")
+    for nprobe in nprobes:
+        r = recall_at_k(index, cat, queries, k, nprobe)
+        print(f"{r['nprobe']:>6} {r['recall']:>7.3f} {r['avg_candidates']:>8.0f}"
+              f" {r['exact_ms']:>9.2f} {r['ann_ms']:>7.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Embedding用のIVF近似最近傍インデックスを構築する")
+    parser.add_argument("--output", default=settings.ANN_INDEX_PATH)
+    parser.add_argument("--nlist", type=int, default=settings.ANN_NLIST, help="パーティション数 (0: 自動)")
+    parser.add_argument("--iters", type=int, default=20, help="k-meansの反復回数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--check-recall", action="store_true", help="構築後に厳密スコアとのrecall@kを測る")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--noise", type=float, default=0.5, help="擬似クエリに加えるノイズの大きさ")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    args = parser.parse_args()
+
+    index = build_index(args.output, args.nlist, args.iters, args.seed)
+    if args.check_recall:
+        check_recall(index, args.k, args.queries, args.noise, args.nprobe, args.seed)
@@ -1,101 +1,272 @@
-
+# Usage: uv run python scripts/compute_embeddings.py [--batch-size 32] [--rate 1.0] [--concurrency 4] [--incremental] [--changes-since RUN_ID|latest] [--dry-run] [--fake]
 import sys
 import os
-import json
 import time
-import sqlite3
-from typing import List, Dict, Any
+import random
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Dict, Any, Callable, Optional, Tuple
 
 # プロジェクトルートをパスに追加
 sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
 
-from app.database import get_conn
+from app.database import get_conn, get_vector_sources
+from app.db.codec import encode_embedding
+from app.db.core import ensure_vector_columns
 from app.reco.embedding import EmbeddingClient
+from app.reco.vector_source import embedding_source_hash, is_embedding_stale
 from app.config import settings
+from scripts.compute_vectors import load_change_set
+
+# texts -> embeddings (入力と同じ順序)
+EmbedBatchFn = Callable[[List[str]], List[List[float]]]
+
+
+class TokenBucket:
+    """
+    トークンバケット方式のレートリミッタ (スレッドセーフ)
+    rate: 1秒あたりに補充されるトークン数 / capacity: 最大バースト数
+    """
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1.0) -> None:
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class FakeEmbeddingProvider:
+    """
+    ローカル検証用の偽Embeddingプロバイダ
+    テキストのハッシュから決定的なベクトルを返す。レイテンシや失敗率も指定できる。
+    """
+
+    def __init__(self, dim: int = 768, latency: float = 0.05, failure_rate: float = 0.0, seed: int = 0):
+        self.dim = dim
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.calls = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def __call__(self, texts: List[str]) -> List[List[float]]:
+        with self._lock:
+            self.calls += 1
+            fail = self._rng.random() < self.failure_rate
+        time.sleep(self.latency)
+        if fail:
+            raise RuntimeError("fake provider: 429 Resource has been exhausted")
+        out = []
+        for text in texts:
+            rnd = random.Random(hashlib.sha1(text.encode("utf-8")).digest())
+            out.append([rnd.gauss(0.0, 1.0) for _ in range(self.dim)])
+        return out
+
+
+def embed_with_retry(embed_batch: EmbedBatchFn, texts: List[str], bucket: TokenBucket,
+                     max_retries: int, backoff_base: float = 1.0, backoff_max: float = 60.0) -> List[List[float]]:
+    """
+    レート制限を守りつつバッチを埋め込む。失敗時は指数バックオフ(+ジッタ)でリトライする
+    """
+    attempt = 0
+    while True:
+        bucket.acquire()
+        try:
+            return embed_batch(texts)
+        except Exception as e:
+            attempt += 1
+            if attempt > max_retries:
+                raise
+            wait = min(backoff_max, backoff_base * (2 ** (attempt - 1))) * (0.5 + random.random() / 2)
+            print(f"  Retry {attempt}/{max_retries} in {wait:.1f}s ({e})")
+            time.sleep(wait)
+
+
+def _fetch_targets(incremental: bool = False, sake_ids: Optional[List[int]] = None) -> List[Dict[str, Any]]:
+    """
+    埋め込み対象の銘柄と入力テキストを取得する
+    incremental=True なら、入力テキストかモデルが変わった銘柄だけを返す
+    sake_ids を指定した場合はその銘柄だけを対象にする (取り込みの変更セット)
+    """
+    targets = []
+    for row in get_vector_sources() if sake_ids is None else get_vector_sources(sake_ids):
+        if incremental and not is_embedding_stale(row, settings.EMBED_MODEL):
+            continue
+        # 埋め込み対象のテキストを作成
+        # 銘柄名、蔵元、都道府県、説明文を含める
+        content = f"{row['name']} {row['brewery'] or ''} {row['prefecture'] or ''} {' '.join(row['texts'])}"
+        if len(content.strip()) == 0:
+            print(f"Skipping sake_id={row['sake_id']} (empty content)")
+            continue
+        targets.append({
+            "sake_id": row["sake_id"],
+            "name": row["name"],
+            "content": content,
+            "source_hash": embedding_source_hash(row["current_hash"], settings.EMBED_MODEL),
+        })
+    return targets
+
+
+def _write_embeddings(items: List[Tuple[int, str, List[float]]]) -> None:
+    """
+    まとめてUPSERTして1トランザクションでコミットする
+    書き込み接続はこの間だけ借りる (APIの待ち時間中は他の書き込みを塞がない)
+    新規行の taste_vector は既定値 [0,0,0,0] で埋める (compute_vectors.py で上書きされる)
+    """
+    params = [
+        (sake_id, encode_embedding(emb, dtype=settings.EMBED_STORAGE_DTYPE, model=settings.EMBED_MODEL), source_hash)
+        for sake_id, source_hash, emb in items
+    ]
+    with get_conn() as conn:
+        conn.executemany("""
+            INSERT INTO sake_vectors (sake_id, embedding, embedding_source_hash, taste_vector, computed_at)
+            VALUES (?, ?, ?, '[0,0,0,0]', datetime('now'))
+            ON CONFLICT(sake_id) DO UPDATE SET
+                embedding = excluded.embedding,
+                embedding_source_hash = excluded.embedding_source_hash,
+                computed_at = datetime('now')
+        """, params)
 
-def compute_embeddings():
+
+def compute_embeddings(embed_batch: Optional[EmbedBatchFn] = None,
+                       batch_size: Optional[int] = None,
+                       rate: Optional[float] = None,
+                       concurrency: Optional[int] = None,
+                       max_retries: Optional[int] = None,
+                       commit_every: int = 500,
+                       incremental: bool = False,
+                       dry_run: bool = False,
+                       changes_since: Optional[str] = None):
+    """
+    全銘柄のEmbeddingを計算して保存する
+
+    - テキストを batch_size 件ずつまとめてプロバイダに送る
+    - トークンバケットで 1秒あたり rate リクエストに制限する
+    - 最大 concurrency リクエストを並列に実行する
+    - 失敗したバッチは指数バックオフでリトライする
+    - 結果は commit_every 件ごとにまとめてコミットする
+    - incremental=True なら入力テキストかモデルが変わった銘柄だけを再計算する
+    - dry_run=True なら対象件数だけ表示してAPIもDBも触らない
+    - changes_since があれば取り込みで変わった銘柄だけを対象にする (compute_vectors.py と同じ)
+    """
     print("Starting embedding computation...")
-    
-    if not settings.GEMINI_API_KEY:
-        print("Error: GEMINI_API_KEY is not set.")
-        return
 
-    client = EmbeddingClient()
-    
+    batch_size = batch_size or settings.EMBED_BATCH_SIZE
+    rate = settings.EMBED_RATE_LIMIT if rate is None else rate
+    concurrency = concurrency or settings.EMBED_CONCURRENCY
+    max_retries = settings.EMBED_MAX_RETRIES if max_retries is None else max_retries
+
+    # 1. 対象銘柄を取得
+    targets = _fetch_targets(incremental, load_change_set(changes_since))
+    print(f"Found {len(targets)} sakes to embed (incremental={incremental}, model={settings.EMBED_MODEL}).")
+    if dry_run:
+        for t in targets[:20]:
+            print(f"  - sake_id={t['sake_id']} {t['name']}")
+        if len(targets) > 20:
+            print(f"  ... and {len(targets) - 20} more")
+        print("Dry run: nothing embedded.")
+        return len(targets)
+
+    if embed_batch is None:
+        if not settings.GEMINI_API_KEY:
+            print("Error: GEMINI_API_KEY is not set.")
+            return
+        embed_batch = EmbeddingClient().get_embeddings
+
+    bucket = TokenBucket(rate)
+    started = time.perf_counter()
+
     with get_conn() as conn:
-        # 1. 全銘柄を取得
-        sql = """
-            SELECT 
-                m.sake_id, m.name, m.brewery, m.prefecture,
-                GROUP_CONCAT(t.text, ' ') as all_text
-            FROM sake_master m
-            LEFT JOIN sake_texts t ON m.sake_id = t.sake_id
-            GROUP BY m.sake_id
-        """
-        cursor = conn.execute(sql)
-        rows = cursor.fetchall()
-        
-        print(f"Found {len(rows)} sakes.")
-        
-        # 2. Embeddingを計算して保存
-        updated_count = 0
-        for row in rows:
-            sake_id = row['sake_id']
-            name = row['name']
-            brewery = row['brewery'] or ""
-            prefecture = row['prefecture'] or ""
-            texts = row['all_text'] or ""
-            
-            # 埋め込み対象のテキストを作成
-            # 銘柄名、蔵元、都道府県、説明文を含める
-            content = f"{name} {brewery} {prefecture} {texts}"
-            
-            # テキストが短すぎる場合はスキップ（あるいは名前だけでもやるか）
-            if len(content.strip()) == 0:
-                print(f"Skipping sake_id={sake_id} (empty content)")
-                continue
-                
-            print(f"Processing sake_id={sake_id} ({name})...")
-            
+        ensure_vector_columns(conn)
+
+    batches = [targets[i:i + batch_size] for i in range(0, len(targets), batch_size)]
+    print(f"Embedding in {len(batches)} batches (batch_size={batch_size}, rate={rate}/s, concurrency={concurrency})")
+
+    # 2. Embeddingを計算して保存
+    updated_count = 0
+    failed_count = 0
+    pending: List[Tuple[int, str, List[float]]] = []
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {
+            executor.submit(embed_with_retry, embed_batch, [t["content"] for t in batch], bucket, max_retries): batch
+            for batch in batches
+        }
+        # DBへの書き込みはメインスレッドのみで行う
+        for future in as_completed(futures):
+            batch = futures[future]
             try:
-                embedding = client.get_embedding(content)
-                
-                # DBに保存
-                # sake_vectorsテーブルが存在し、embeddingカラムがある前提
-                # taste_vectorは既存のものを維持するか、なければ初期値を入れる
-                # ここではUPSERT的に処理したいが、SQLiteのバージョンによる
-                # まずは既存行があるか確認
-                
-                check_sql = "SELECT sake_id, taste_vector FROM sake_vectors WHERE sake_id = ?"
-                curr_row = conn.execute(check_sql, (sake_id,)).fetchone()
-                
-                embedding_json = json.dumps(embedding)
-                
-                if curr_row:
-                    # 更新
-                    update_sql = "UPDATE sake_vectors SET embedding = ?, computed_at = datetime('now') WHERE sake_id = ?"
-                    conn.execute(update_sql, (embedding_json, sake_id))
-                else:
-                    # 新規 (taste_vectorはデフォルト値でとりあえず埋める)
-                    insert_sql = """
-                        INSERT INTO sake_vectors (sake_id, embedding, taste_vector, computed_at)
-                        VALUES (?, ?, ?, datetime('now'))
-                    """
-                    # taste_vectorは空配列のJSONにしておく（アプリ側でハンドリング必要）
-                    default_taste = "[0,0,0,0]"
-                    conn.execute(insert_sql, (sake_id, embedding_json, default_taste))
-                
-                updated_count += 1
-                conn.commit()
-                
-                # Rate Limit回避のためのウェイト
-                time.sleep(1.0) 
-                
+                embeddings = future.result()
             except Exception as e:
-                print(f"Error processing sake_id={sake_id}: {e}")
+                failed_count += len(batch)
+                ids = [t["sake_id"] for t in batch]
+                print(f"Error processing sake_id={ids[0]}..{ids[-1]}: {e}")
                 # 継続する
-    
-    print(f"Finished. Updated {updated_count} sakes.")
+                continue
+
+            pending.extend((t["sake_id"], t["source_hash"], emb) for t, emb in zip(batch, embeddings))
+            if len(pending) >= commit_every:
+                _write_embeddings(pending)
+                updated_count += len(pending)
+                pending = []
+                print(f"  Committed {updated_count}/{len(targets)} sakes...")
+
+    if pending:
+        _write_embeddings(pending)
+        updated_count += len(pending)
+
+    elapsed = time.perf_counter() - started
+    print(f"Finished. Updated {updated_count} sakes, failed {failed_count} ({elapsed:.1f}s).")
+    return updated_count
+
 
 if __name__ == "__main__":
-    compute_embeddings()
+    parser = argparse.ArgumentParser(description="銘柄テキストのEmbeddingを計算して sake_vectors に保存する")
+    parser.add_argument("--batch-size", type=int, default=settings.EMBED_BATCH_SIZE)
+    parser.add_argument("--rate", type=float, default=settings.EMBED_RATE_LIMIT, help="1秒あたりのリクエスト数 (0: 無制限)")
+    parser.add_argument("--concurrency", type=int, default=settings.EMBED_CONCURRENCY)
+    parser.add_argument("--max-retries", type=int, default=settings.EMBED_MAX_RETRIES)
+    parser.add_argument("--commit-every", type=int, default=500)
+    parser.add_argument("--incremental", action="store_true", help="入力テキストかモデルが変わった銘柄だけ再計算する")
+    parser.add_argument("--changes-since", metavar="RUN_ID|latest",
+                        help="取り込み(ingest_runs)で内容が変わった銘柄(ingest_changes)だけを対象にする")
+    parser.add_argument("--dry-run", action="store_true", help="再計算対象の件数だけ表示してAPIを呼ばない")
+    parser.add_argument("--fake", action="store_true", help="APIを呼ばずローカルの偽プロバイダで実行する")
+    parser.add_argument("--fake-dim", type=int, default=768)
+    parser.add_argument("--fake-latency", type=float, default=0.05)
+    parser.add_argument("--fake-failure-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    provider = None
+    if args.fake:
+        provider = FakeEmbeddingProvider(dim=args.fake_dim, latency=args.fake_latency,
+                                         failure_rate=args.fake_failure_rate)
+
+    compute_embeddings(
+        embed_batch=provider,
+        batch_size=args.batch_size,
+        rate=args.rate,
+        concurrency=args.concurrency,
+        max_retries=args.max_retries,
+        commit_every=args.commit_every,
+        incremental=args.incremental,
+        dry_run=args.dry_run,
+        changes_since=args.changes_since,
+    )
@@ -1,32 +1,60 @@
+# Usage: uv run python scripts/compute_vectors.py [--incremental] [--changes-since RUN_ID|latest] [--dry-run]
+import argparse
 import json
-import sqlite3
 import sys
 import os
+from typing import List, Optional
 
 sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
 
-from app.db.core import get_conn
+from app.db.core import ensure_vector_columns, get_conn
+from app.database import get_changed_sake_ids, get_vector_sources
 from app.reco import estimate_taste_vector
+from app.reco.vector_source import TASTE_VERSION, is_taste_stale
 
-def compute_vectors():
+def load_change_set(changes_since: Optional[str]) -> Optional[List[int]]:
+    """
+    --changes-since の値から再計算対象の sake_id を得る (指定なしなら None = 全銘柄)
+    latest: 最新の成功した取り込みで変わった銘柄 / 数値: その run_id 以降の取り込みで変わった銘柄
+    """
+    if changes_since is None:
+        return None
+    run_id, sake_ids = get_changed_sake_ids(None if changes_since == "latest" else int(changes_since))
+    print(f"  change set: {len(sake_ids)} sakes changed since ingest run {run_id}")
+    return sake_ids
+
+def compute_vectors(incremental: bool = False, dry_run: bool = False, changes_since: Optional[str] = None):
     print("🚀 Starting taste vector computation (Dictionary-based)...")
-    
+
+    with get_conn() as conn:
+        ensure_vector_columns(conn)
+
+    # 1. 銘柄とそのテキスト情報を取得
+    # 各銘柄の全てのテキストを結合して分析対象とする
+    # --changes-since があれば取り込みで変わった銘柄だけを読む
+    sake_ids = load_change_set(changes_since)
+    sakes = get_vector_sources() if sake_ids is None else get_vector_sources(sake_ids)
+    if incremental:
+        # 入力ハッシュかバージョンが変わった銘柄だけを再計算する
+        targets = [s for s in sakes if is_taste_stale(s)]
+    else:
+        targets = sakes
+    print(f"  {len(targets)}/{len(sakes)} sakes to compute (incremental={incremental})")
+
+    if dry_run:
+        for sake in targets[:20]:
+            print(f"  - sake_id={sake['sake_id']} {sake['name']}")
+        if len(targets) > 20:
+            print(f"  ... and {len(targets) - 20} more")
+        print("Dry run: nothing written.")
+        return len(targets)
+
     with get_conn() as conn:
-        # 1. 銘柄とそのテキスト情報を取得
-        # 各銘柄の全てのテキストを結合して分析対象とする
-        sql = """
-            SELECT m.sake_id, m.name, GROUP_CONCAT(t.text, ' ') as all_text
-            FROM sake_master m
-            LEFT JOIN sake_texts t ON m.sake_id = t.sake_id
-            GROUP BY m.sake_id
-        """
-        sakes = conn.execute(sql).fetchall()
-        
         count = 0
-        for sake in sakes:
+        for sake in targets:
             sake_id = sake["sake_id"]
             name = sake["name"]
-            desc = sake["all_text"] or ""
+            desc = " ".join(sake["texts"])
             
             # 銘柄名も分析対象に含める
             analysis_text = f"{name} {desc}"
@@ -37,19 +65,27 @@ def compute_vectors():
             
             # 3. DBを更新 (upsert)
             conn.execute("""
-                INSERT INTO sake_vectors (sake_id, taste_vector, version)
-                VALUES (?, ?, ?)
+                INSERT INTO sake_vectors (sake_id, taste_vector, version, source_hash)
+                VALUES (?, ?, ?, ?)
                 ON CONFLICT(sake_id) DO UPDATE SET
                     taste_vector = excluded.taste_vector,
                     version = excluded.version,
+                    source_hash = excluded.source_hash,
                     computed_at = datetime('now')
-            """, (sake_id, json.dumps(vector), "v1-dict"))
+            """, (sake_id, json.dumps(vector), TASTE_VERSION, sake["current_hash"]))
             
             count += 1
             if count % 10 == 0:
                 print(f"  Processed {count} sakes...")
 
     print(f"✅ Successfully computed vectors for {count} sakes.")
+    return count
 
 if __name__ == "__main__":
-    compute_vectors()
+    parser = argparse.ArgumentParser(description="銘柄テキストから味ベクトルを計算して sake_vectors に保存する")
+    parser.add_argument("--incremental", action="store_true", help="入力テキストかバージョンが変わった銘柄だけ再計算する")
+    parser.add_argument("--changes-since", metavar="RUN_ID|latest",
+                        help="取り込み(ingest_runs)で内容が変わった銘柄(ingest_changes)だけを対象にする")
+    parser.add_argument("--dry-run", action="store_true", help="再計算対象の件数だけ表示して書き込まない")
+    args = parser.parse_args()
+    compute_vectors(incremental=args.incremental, dry_run=args.dry_run, changes_since=args.changes_since)
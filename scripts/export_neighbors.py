@@ -0,0 +1,115 @@
+# Usage: uv run python scripts/export_neighbors.py [--n 10] [--method auto] [--output neighbors.ndjson] [--shard 0 --num-shards 4] [--resume]
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from app.db.core import apply_schema, get_conn
+from app.reco import neighbors as nb
+from app.reco.catalog import load_catalog
+
+
+def _done_ids_in_file(path: str, method: str, version: str):
+    """
+    出力ファイルに書き出し済みの sake_id (同じカタログ・方式の行のみ)
+    途中で止まった場合の最終行(不完全なJSON)は無視する
+    """
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if rec.get("method") == method and rec.get("catalog_version") == version:
+                done.add(rec["sake_id"])
+    return done
+
+
+def export_neighbors(n_neighbors: int = 10, method: str = "auto", block_size: int = 128,
+                     shard: int = 0, num_shards: int = 1, resume: bool = False,
+                     output: str = None, write_db: bool = True):
+    """
+    銘柄ごとの上位N件の類似銘柄を block_size 件ずつ計算し、NDJSON と sake_neighbors に書き出す
+    - ブロックごとに書き込み・コミットするので、中断しても --resume で続きから再開できる
+    - --shard/--num-shards で sake_id を分割して複数プロセスで並列に実行できる
+    """
+    # 標準出力はNDJSON用なのでログは標準エラーに出す
+    print(f"🚀 Exporting item-to-item neighbors (n={n_neighbors}, method={method}, shard={shard}/{num_shards})...",
+          file=sys.stderr)
+    if write_db:
+        with get_conn() as conn:
+            apply_schema(conn)
+
+    cat = load_catalog()
+    version = cat.neighbor_version
+    print(f"  catalog: {len(cat)} sakes, version={version}", file=sys.stderr)
+
+    done = set()
+    if resume:
+        if write_db:
+            with get_conn() as conn:
+                done.update(nb.load_done_ids(conn, method, version))
+        if output:
+            done_in_file = _done_ids_in_file(output, method, version)
+            # DBとファイルの両方に書き出し済みのものだけを飛ばす
+            done = done & done_in_file if write_db else done_in_file
+    rows = nb.select_rows(cat, shard=shard, num_shards=num_shards, skip=done)
+    print(f"  {len(rows)} sakes to compute ({len(done)} already done)", file=sys.stderr)
+
+    out = sys.stdout
+    if output:
+        out = open(output, "a" if resume else "w", encoding="utf-8")
+    t0 = time.perf_counter()
+    count = 0
+    try:
+        batch = []
+        for item in nb.iter_neighbors(cat, rows, n_neighbors, method, block_size):
+            batch.append(item)
+            if len(batch) >= block_size:
+                _flush(batch, out, method, version, write_db)
+                count += len(batch)
+                batch = []
+                print(f"  Processed {count}/{len(rows)} sakes...", file=sys.stderr)
+        if batch:
+            _flush(batch, out, method, version, write_db)
+            count += len(batch)
+    finally:
+        if output:
+            out.close()
+
+    print(f"✅ Exported neighbors for {count} sakes in {time.perf_counter() - t0:.1f}s.", file=sys.stderr)
+    return count
+
+
+def _flush(batch, out, method: str, version: str, write_db: bool):
+    # ファイル → DB の順に書く (再開時は両方にあるものだけを飛ばす)
+    out.write("".join(nb.to_ndjson(sake_id, neighbors, method, version) for sake_id, neighbors in batch))
+    out.flush()
+    if write_db:
+        with get_conn() as conn:
+            nb.save_neighbors(conn, batch, method, version)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="銘柄間の類似銘柄(上位N件)を NDJSON と sake_neighbors に書き出す")
+    parser.add_argument("--n", type=int, default=10, help="1銘柄あたりの近傍数")
+    parser.add_argument("--method", choices=nb.NEIGHBOR_METHODS, default="auto",
+                        help="auto: Embeddingがあればコサイン類似度 / taste: 味ベクトルのL2のみ")
+    parser.add_argument("--block-size", type=int, default=128, help="一度に計算する起点の銘柄数 (メモリ使用量に比例)")
+    parser.add_argument("--shard", type=int, default=0, help="このプロセスが担当するシャード番号 (sake_id %% num_shards)")
+    parser.add_argument("--num-shards", type=int, default=1, help="シャード数 (並列に実行するプロセス数)")
+    parser.add_argument("--resume", action="store_true", help="現在のカタログで計算済みの銘柄を飛ばして続きから実行する")
+    parser.add_argument("--output", help="NDJSONの出力先 (省略時は標準出力)")
+    parser.add_argument("--no-db", action="store_true", help="sake_neighbors に書き込まない")
+    args = parser.parse_args()
+    if not 0 <= args.shard < args.num_shards:
+        parser.error("--shard must be in [0, --num-shards)")
+    export_neighbors(n_neighbors=args.n, method=args.method, block_size=args.block_size,
+                     shard=args.shard, num_shards=args.num_shards, resume=args.resume,
+                     output=args.output, write_db=not args.no_db)
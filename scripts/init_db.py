@@ -11,6 +11,8 @@ ROOT = Path(__file__).resolve().parents[1]
 
 DB_PATH = Path(os.environ.get("SAKE_DB_PATH", str(ROOT / "var" / "sake.db")))
 SCHEMA_PATH = ROOT / "app" / "db" / "schema.sql"
+# 全文検索インデックス (FTS5が使えるSQLiteでのみ適用する)
+SEARCH_FTS_PATH = ROOT / "app" / "db" / "migrations" / "002_search_fts.sql"
 
 
 def init_db() -> None:
@@ -23,11 +25,29 @@ def init_db() -> None:
         conn.execute("PRAGMA foreign_keys = ON;")  # 外部キー制約を有効化
         conn.executescript(schema)
         conn.commit()
+        fts_applied = apply_search_fts(conn)
     finally:
         conn.close()
 
     print(f"✅ DB initialized: {DB_PATH}")
     print(f"✅ Schema applied : {SCHEMA_PATH}")
+    if fts_applied:
+        print(f"✅ Search index   : {SEARCH_FTS_PATH}")
+    else:
+        print("⚠️ FTS5 is not available; /search falls back to LIKE")
+
+
+def apply_search_fts(conn: sqlite3.Connection) -> bool:
+    """全文検索インデックスとトリガーを作成し、既存データから作り直す"""
+    try:
+        conn.executescript(SEARCH_FTS_PATH.read_text(encoding="utf-8"))
+        conn.commit()
+    except sqlite3.OperationalError as e:
+        # FTS5(trigram) 非対応のSQLite
+        conn.rollback()
+        print(f"Skipping search index: {e}")
+        return False
+    return True
 
 
 if __name__ == "__main__":
@@ -0,0 +1,163 @@
+# Usage:
+#   uv run python scripts/load_test_recommend.py --inprocess --concurrency 50
+#   uv run python scripts/load_test_recommend.py --url http://localhost:8000 --concurrency 50
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from typing import Dict, List
+from unittest.mock import patch
+
+import httpx
+
+# プロジェクトルートをパスに追加
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+QUERIES = [
+    "フルーティで甘口",
+    "辛口ですっきり",
+    "魚料理に合う、すっきりした辛口",
+    "濃厚で芳醇なクラシックタイプ",
+    "ワインのような酸味",
+]
+
+
+def _percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def run_load(client: httpx.AsyncClient, path: str, concurrency: int, total: int) -> Dict[str, float]:
+    """
+    concurrency 並列で total 件の POST を投げ、並行して /health のレイテンシも測る
+    """
+    latencies: List[float] = []
+    health: List[float] = []
+    errors = 0
+    modes: Dict[str, int] = {}
+    counter = iter(range(total))
+    done = asyncio.Event()
+
+    async def worker():
+        nonlocal errors
+        for n in counter:
+            # キャッシュが効かないよう毎回異なるテキストにする
+            payload = {"text": f"{QUERIES[n % len(QUERIES)]} {path}#{n}", "top_k": 5}
+            t0 = time.perf_counter()
+            try:
+                res = await client.post(path, json=payload)
+                res.raise_for_status()
+                mode = res.json().get("mode", "?")
+                modes[mode] = modes.get(mode, 0) + 1
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - t0)
+
+    async def health_probe():
+        while not done.is_set():
+            t0 = time.perf_counter()
+            try:
+                await client.get("/health")
+            except Exception:
+                pass
+            health.append(time.perf_counter() - t0)
+            await asyncio.sleep(0.05)
+
+    started = time.perf_counter()
+    probe = asyncio.create_task(health_probe())
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    done.set()
+    await probe
+
+    return {
+        "requests": total,
+        "errors": errors,
+        "rps": total / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": _percentile(latencies, 0.95) * 1000,
+        "health_p95_ms": _percentile(health, 0.95) * 1000,
+        "modes": modes,
+    }
+
+
+def _print_result(label: str, r: Dict[str, float]) -> None:
+    print(f"{label:<8} rps={r['rps']:7.1f}  p50={r['p50_ms']:7.1f}ms  p95={r['p95_ms']:7.1f}ms"
+          f"  /health p95={r['health_p95_ms']:7.1f}ms  errors={r['errors']}  modes={r['modes']}")
+
+
+async def run_inprocess(concurrency: int, total: int, latency: float, timeout: float) -> None:
+    """
+    埋め込みAPIを固定レイテンシの偽実装に差し替え、
+    同期ハンドラ(従来)と非同期ハンドラ(/recommend)のスループットを比較する
+    """
+    from app.config import settings
+    from app.main import app
+    from app.models import RecommendationRequest, RecommendationResponse
+    from app.reco import catalog, engine
+
+    settings.USE_EMBEDDING = 1
+    # 埋め込み待ちの差だけを見るため、スコアリングはバッチ計算にする
+    settings.USE_VECTORIZED_SCORING = 1
+    settings.GEMINI_API_KEY = settings.GEMINI_API_KEY or "DUMMY_KEY"
+    settings.EMBED_TIMEOUT_SEC = timeout
+    settings.EMBED_MAX_CONCURRENCY = max(settings.EMBED_MAX_CONCURRENCY, concurrency)
+
+    cat = catalog.get_catalog()
+    dim = cat.embedding_dim or 768
+    fake = {"embedding": [0.01] * dim}
+
+    def fake_embed(*args, **kwargs):
+        time.sleep(latency)
+        return fake
+
+    async def fake_embed_async(*args, **kwargs):
+        await asyncio.sleep(latency)
+        return fake
+
+    # 比較用: 従来と同じ同期ハンドラ (FastAPIのスレッドプールで実行される)
+    @app.post("/_loadtest/recommend_sync", response_model=RecommendationResponse)
+    def recommend_sync(request: RecommendationRequest):
+        return engine.recommend(request)
+
+    print(f"catalog={len(cat)} sakes, fake embed latency={latency * 1000:.0f}ms, "
+          f"timeout={timeout}s, concurrency={concurrency}, requests={total}")
+    with patch("google.generativeai.embed_content", fake_embed), \
+         patch("google.generativeai.embed_content_async", fake_embed_async):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=60) as client:
+            # ウォームアップ
+            await client.post("/recommend", json={"text": "warmup"})
+            sync_result = await run_load(client, "/_loadtest/recommend_sync", concurrency, total)
+            async_result = await run_load(client, "/recommend", concurrency, total)
+
+    _print_result("sync", sync_result)
+    _print_result("async", async_result)
+    print(f"throughput ratio (async/sync): {async_result['rps'] / sync_result['rps']:.2f}x")
+
+
+async def run_remote(url: str, concurrency: int, total: int) -> None:
+    limits = httpx.Limits(max_connections=concurrency + 1)
+    async with httpx.AsyncClient(base_url=url, timeout=60, limits=limits) as client:
+        result = await run_load(client, "/recommend", concurrency, total)
+    _print_result("remote", result)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="/recommend の負荷試験")
+    parser.add_argument("--url", help="起動中のサーバーに対して実行する (例: http://localhost:8000)")
+    parser.add_argument("--inprocess", action="store_true", help="偽の埋め込みAPIで同期/非同期ハンドラを比較する")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--embed-latency", type=float, default=0.3, help="偽の埋め込みAPIのレイテンシ(秒)")
+    parser.add_argument("--timeout", type=float, default=2.0, help="EMBED_TIMEOUT_SEC")
+    args = parser.parse_args()
+
+    if args.url:
+        asyncio.run(run_remote(args.url, args.concurrency, args.requests))
+    else:
+        asyncio.run(run_inprocess(args.concurrency, args.requests, args.embed_latency, args.timeout))
@@ -1,13 +1,32 @@
 import sqlite3
 import sys
 import os
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
 
 # 追加: プロジェクトルートをパスに追加して app モジュールをインポート可能にする
 sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
 
-from app.db.core import get_conn
+from app.db.core import apply_schema, get_conn
 from scripts.sakenowa_client import SakenowaClient
 
+# 001_sakenowa.sql で作る生データのテーブルと、旧スキーマ(001_initial_sakenowa.sql)と区別するためのカラム
+_RAW_TABLE_COLUMNS = {
+    "sakenowa_areas": "areaId",
+    "sakenowa_breweries": "breweryId",
+    "sakenowa_brands": "brandId",
+    "sakenowa_flavor_charts": "brandId",
+    "sakenowa_tags": "tagName",
+    "sakenowa_sake_tags": "brandId",
+    "sakenowa_rankings": "yearMonth",
+}
+
+def _has_raw_tables(conn) -> bool:
+    for table, column in _RAW_TABLE_COLUMNS.items():
+        columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+        if column not in columns:
+            return False
+    return True
+
 def run_migrations():
     print("Running migrations...")
     with get_conn() as conn:
@@ -25,151 +44,309 @@ def run_migrations():
             print("Adding 'external_sakenowa_id' column to sake_master")
             conn.execute("ALTER TABLE sake_master ADD COLUMN external_sakenowa_id INTEGER")
             
+        # external_sakenowa_id での突き合わせ用 (マスタ同期の upsert の衝突対象)
+        conn.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_sake_master_external_sakenowa_id
+            ON sake_master(external_sakenowa_id) WHERE external_sakenowa_id IS NOT NULL
+        """)
+
         # SQLファイル実行
-        with open("app/db/migrations/001_sakenowa.sql", "r") as f:
-            sql = f.read()
-            conn.executescript(sql)
+        # 生データのテーブルは差分取り込みの比較対象なので、正しいスキーマで作成済みなら作り直さない
+        if not _has_raw_tables(conn):
+            with open("app/db/migrations/001_sakenowa.sql", "r") as f:
+                sql = f.read()
+                conn.executescript(sql)
+
+        # 後から追加したテーブル (ingest_changes など)
+        apply_schema(conn)
     print("Migrations done.")
 
-def load_sakenowa_data():
-    client = SakenowaClient()
-    
+def _ranking_rows(data: List[Dict[str, Any]]) -> List[Tuple[Any, ...]]:
+    rows = []
+    for year_data in data:
+        if not isinstance(year_data, dict): continue
+        ym = year_data.get("yearMonth")
+        ranks = year_data.get("overall", [])
+        if not ranks:
+            ranks = year_data.get("ranking", [])
+        rows.extend((ym, r["rank"], r["brandId"], r.get("score")) for r in ranks)
+    return rows
+
+def _stage(conn, name: str, columns: str, rows: List[Tuple[Any, ...]], or_ignore: bool = False):
+    """
+    取り込みデータを一時テーブルに入れる (保存済みデータとの差分をSQLで取るため)
+    """
+    conn.execute(f"DROP TABLE IF EXISTS temp.{name}")
+    conn.execute(f"CREATE TEMP TABLE {name} ({columns})")
+    n_columns = len(rows[0]) if rows else 0
+    if rows:
+        placeholders = ", ".join("?" * n_columns)
+        conn.executemany(f"INSERT {'OR IGNORE ' if or_ignore else ''}INTO {name} VALUES ({placeholders})", rows)
+
+def _upsert_raw(conn, data: Dict[str, Any], skip: Iterable[str] = ()) -> Dict[str, int]:
+    """
+    さけのわの生データを sakenowa_* テーブルに書き込む
+    保存済みデータと比較して、変わった行だけを書き込む (行ごとの execute はしない)
+    skip のキー (前回から変わっていないエンドポイント) は比較もせずに飛ばす
+    Returns: テーブルごとの書き込み行数
+    """
+    skip = set(skip)
+    written = dict.fromkeys(data, 0)
+
+    # 1. Areas
+    if "areas" not in skip:
+        written["areas"] = conn.executemany("""
+            INSERT INTO sakenowa_areas (areaId, name) VALUES (?, ?)
+            ON CONFLICT(areaId) DO UPDATE SET name = excluded.name
+            WHERE sakenowa_areas.name IS NOT excluded.name
+        """, [(row["id"], row["name"]) for row in data["areas"]]).rowcount
+
+    # 2. Breweries
+    if "breweries" not in skip:
+        written["breweries"] = conn.executemany("""
+            INSERT INTO sakenowa_breweries (breweryId, name, areaId) VALUES (?, ?, ?)
+            ON CONFLICT(breweryId) DO UPDATE SET name = excluded.name, areaId = excluded.areaId
+            WHERE sakenowa_breweries.name IS NOT excluded.name OR sakenowa_breweries.areaId IS NOT excluded.areaId
+        """, [(row["id"], row["name"], row["areaId"]) for row in data["breweries"]]).rowcount
+
+    # 3. Brands
+    if "brands" not in skip:
+        written["brands"] = conn.executemany("""
+            INSERT INTO sakenowa_brands (brandId, name, breweryId) VALUES (?, ?, ?)
+            ON CONFLICT(brandId) DO UPDATE SET name = excluded.name, breweryId = excluded.breweryId
+            WHERE sakenowa_brands.name IS NOT excluded.name OR sakenowa_brands.breweryId IS NOT excluded.breweryId
+        """, [(row["id"], row["name"], row["breweryId"]) for row in data["brands"]]).rowcount
+
+    # 4. Flavor Charts
+    if "flavor_charts" not in skip:
+        written["flavor_charts"] = conn.executemany("""
+            INSERT INTO sakenowa_flavor_charts (brandId, f1, f2, f3, f4, f5, f6)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(brandId) DO UPDATE SET
+                f1 = excluded.f1, f2 = excluded.f2, f3 = excluded.f3,
+                f4 = excluded.f4, f5 = excluded.f5, f6 = excluded.f6
+            WHERE (sakenowa_flavor_charts.f1, sakenowa_flavor_charts.f2, sakenowa_flavor_charts.f3,
+                   sakenowa_flavor_charts.f4, sakenowa_flavor_charts.f5, sakenowa_flavor_charts.f6)
+                  IS NOT (excluded.f1, excluded.f2, excluded.f3, excluded.f4, excluded.f5, excluded.f6)
+        """, [(row["brandId"], row["f1"], row["f2"], row["f3"], row["f4"], row["f5"], row["f6"])
+              for row in data["flavor_charts"]]).rowcount
+
+    # 5. Tags
+    if "tags" not in skip:
+        written["tags"] = conn.executemany("""
+            INSERT INTO sakenowa_tags (tagId, tagName) VALUES (?, ?)
+            ON CONFLICT(tagId) DO UPDATE SET tagName = excluded.tagName
+            WHERE sakenowa_tags.tagName IS NOT excluded.tagName
+        """, [(row["id"], row["tag"]) for row in data["tags"]]).rowcount
+
+    # 6. Brand Tags (取り込みデータと同じ集合になるよう、無くなった組を消して増えた組を足す)
+    if "brand_tags" not in skip:
+        _stage(conn, "_incoming_sake_tags", "brandId INTEGER, tagId INTEGER, PRIMARY KEY (brandId, tagId)",
+               [(row["brandId"], tid) for row in data["brand_tags"] for tid in row["tagIds"]], or_ignore=True)
+        written["brand_tags"] = conn.execute("""
+            DELETE FROM sakenowa_sake_tags
+            WHERE NOT EXISTS (
+                SELECT 1 FROM _incoming_sake_tags i
+                WHERE i.brandId = sakenowa_sake_tags.brandId AND i.tagId = sakenowa_sake_tags.tagId
+            )
+        """).rowcount
+        written["brand_tags"] += conn.execute("""
+            INSERT INTO sakenowa_sake_tags (brandId, tagId)
+            SELECT brandId, tagId FROM _incoming_sake_tags
+            EXCEPT
+            SELECT brandId, tagId FROM sakenowa_sake_tags
+        """).rowcount
+        conn.execute("DROP TABLE temp._incoming_sake_tags")
+
+    # 7. Rankings (取り込みデータに含まれる月だけ同じ内容にする)
+    # APIは最新月しか返さないため、含まれない過去の月は人気度の計算(月ごとの減衰)用に残す
+    if "rankings" not in skip:
+        _stage(conn, "_incoming_rankings", "yearMonth INTEGER, rank INTEGER, brandId INTEGER, score REAL, PRIMARY KEY (yearMonth, rank)",
+               _ranking_rows(data["rankings"]))
+        written["rankings"] = conn.execute("""
+            DELETE FROM sakenowa_rankings
+            WHERE yearMonth IN (SELECT yearMonth FROM _incoming_rankings)
+              AND NOT EXISTS (
+                SELECT 1 FROM _incoming_rankings i
+                WHERE i.yearMonth = sakenowa_rankings.yearMonth AND i.rank = sakenowa_rankings.rank
+            )
+        """).rowcount
+        written["rankings"] += conn.execute("""
+            INSERT INTO sakenowa_rankings (yearMonth, rank, brandId, score)
+            SELECT yearMonth, rank, brandId, score FROM _incoming_rankings WHERE true
+            ON CONFLICT(yearMonth, rank) DO UPDATE SET brandId = excluded.brandId, score = excluded.score
+            WHERE (sakenowa_rankings.brandId, sakenowa_rankings.score) IS NOT (excluded.brandId, excluded.score)
+        """).rowcount
+        conn.execute("DROP TABLE temp._incoming_rankings")
+
+    for table, count in written.items():
+        print(f"  sakenowa {table}: {'not modified, skipped' if table in skip else f'{count} rows written'}")
+    return written
+
+def _sync_master(conn, run_id: int) -> Dict[str, int]:
+    """
+    sakenowa_brands + breweries + areas => sake_master、タグ => sake_texts を集合演算で取り込む
+    external_sakenowa_id のユニークインデックスで突き合わせるので銘柄数に対して O(n)
+    内容が変わった銘柄だけを書き込み、その sake_id を ingest_changes に記録する
+    Returns: 種類ごとの変更件数
+    """
+    # 取り込み元 (brandId ごとに1行)
+    source_sql = """
+        SELECT b.brandId, b.name AS brandName, br.name AS breweryName, a.name AS prefName
+        FROM sakenowa_brands b
+        LEFT JOIN sakenowa_breweries br ON b.breweryId = br.breweryId
+        LEFT JOIN sakenowa_areas a ON br.areaId = a.areaId
+    """
+    record_sql = "INSERT OR IGNORE INTO ingest_changes (run_id, sake_id, kind) "
+
+    # 既存銘柄の更新 (external_sakenowa_id で一致し、内容が変わったもの)
+    conn.execute(record_sql + f"""
+        SELECT ?, m.sake_id, 'update'
+        FROM sake_master m JOIN ({source_sql}) AS src ON m.external_sakenowa_id = src.brandId
+        WHERE (m.name, m.brewery, m.prefecture) IS NOT (src.brandName, src.breweryName, src.prefName)
+    """, (run_id,))
+    conn.execute(f"""
+        UPDATE sake_master SET
+            name = src.brandName, brewery = src.breweryName, prefecture = src.prefName,
+            updated_at = datetime('now')
+        FROM ({source_sql}) AS src
+        WHERE sake_master.external_sakenowa_id = src.brandId
+          AND (sake_master.name, sake_master.brewery, sake_master.prefecture)
+              IS NOT (src.brandName, src.breweryName, src.prefName)
+    """)
+
+    # 新規銘柄の追加
+    # INSERT ... ON CONFLICT DO UPDATE は衝突した行でも AUTOINCREMENT の採番が進むため、更新と追加を分けている
+    last_sake_id = conn.execute("SELECT COALESCE(MAX(sake_id), 0) FROM sake_master").fetchone()[0]
+    conn.execute(f"""
+        INSERT INTO sake_master (name, brewery, prefecture, source, external_sakenowa_id)
+        SELECT src.brandName, src.breweryName, src.prefName, 'sakenowa', src.brandId
+        FROM ({source_sql}) AS src
+        WHERE NOT EXISTS (SELECT 1 FROM sake_master m WHERE m.external_sakenowa_id = src.brandId)
+        ORDER BY src.brandId
+    """)
+    conn.execute(record_sql + """
+        SELECT ?, sake_id, 'insert' FROM sake_master WHERE sake_id > ? AND external_sakenowa_id IS NOT NULL
+    """, (run_id, last_sake_id))
+
+    # sake_texts へ取り込み (タグ情報)
+    # 銘柄ごとのタグを1回のGROUP BYで集約し、保存済みのテキストと異なる銘柄だけ置き換える
+    conn.execute("DROP TABLE IF EXISTS temp._sakenowa_tag_texts")
+    conn.execute("CREATE TEMP TABLE _sakenowa_tag_texts (sake_id INTEGER PRIMARY KEY, text TEXT)")
+    conn.execute("""
+        INSERT INTO _sakenowa_tag_texts (sake_id, text)
+        SELECT sake_id, 'さけのわタグ: ' || GROUP_CONCAT(tagName, ', ')
+        FROM (
+            SELECT m.sake_id, t.tagName
+            FROM sakenowa_sake_tags st
+            JOIN sakenowa_brands b ON b.brandId = st.brandId
+            JOIN sakenowa_tags t ON st.tagId = t.tagId
+            JOIN sake_master m ON m.external_sakenowa_id = st.brandId
+            ORDER BY m.sake_id, st.tagId
+        )
+        GROUP BY sake_id
+    """)
+    # タグが無くなった銘柄は text = NULL (保存済みのタグテキストを消す)
+    conn.execute("""
+        INSERT INTO _sakenowa_tag_texts (sake_id, text)
+        SELECT DISTINCT s.sake_id, NULL
+        FROM sake_texts s
+        JOIN sake_master m ON m.sake_id = s.sake_id
+        JOIN sakenowa_brands b ON b.brandId = m.external_sakenowa_id
+        WHERE s.source = 'sakenowa_tags'
+          AND s.sake_id NOT IN (SELECT sake_id FROM _sakenowa_tag_texts)
+    """)
+    # 保存済み (source = 'sakenowa_tags' の行をまとめたもの) と一致しない銘柄
+    conn.execute(record_sql + """
+        SELECT ?, t.sake_id, 'tags'
+        FROM _sakenowa_tag_texts t
+        LEFT JOIN (
+            SELECT sake_id, MIN(text) AS text, COUNT(*) AS n
+            FROM sake_texts WHERE source = 'sakenowa_tags'
+            GROUP BY sake_id
+        ) s ON s.sake_id = t.sake_id
+        WHERE t.text IS NOT s.text OR s.n > 1
+    """, (run_id,))
+    changed_tags = "SELECT sake_id FROM ingest_changes WHERE run_id = ? AND kind = 'tags'"
+    conn.execute(f"""
+        DELETE FROM sake_texts
+        WHERE source = 'sakenowa_tags' AND sake_id IN ({changed_tags})
+    """, (run_id,))
+    conn.execute(f"""
+        INSERT INTO sake_texts (sake_id, source, text, created_at)
+        SELECT sake_id, 'sakenowa_tags', text, datetime('now') FROM _sakenowa_tag_texts
+        WHERE text IS NOT NULL AND sake_id IN ({changed_tags})
+    """, (run_id,))
+    conn.execute("DROP TABLE temp._sakenowa_tag_texts")
+
+    counts = {kind: 0 for kind in ("insert", "update", "tags")}
+    for kind, count in conn.execute(
+        "SELECT kind, COUNT(*) FROM ingest_changes WHERE run_id = ? GROUP BY kind", (run_id,)
+    ).fetchall():
+        counts[kind] = count
+    print(f"Master Sync: Inserted={counts['insert']}, Updated={counts['update']}, Tags changed={counts['tags']}")
+    return counts
+
+def _unchanged_since_last_run(conn, client: SakenowaClient, run_id: int) -> Set[str]:
+    """
+    書き込みを省いてよい (304 で前回と同じ内容だった) fetch_all() のキー
+    前回の取り込みが失敗していた場合は、保存済みレスポンスが書き込まれていない可能性があるので省かない
+    """
+    if not client.unchanged_keys:
+        return set()
+    last = conn.execute(
+        "SELECT status FROM ingest_runs WHERE source = 'sakenowa' AND run_id < ? ORDER BY run_id DESC LIMIT 1",
+        (run_id,),
+    ).fetchone()
+    return set(client.unchanged_keys) if last is not None and last[0] == "success" else set()
+
+def fetch_sakenowa_data(client: SakenowaClient) -> Dict[str, Any]:
+    # 独立したエンドポイントを並行して取得する (変更のないものは 304 で保存済みのレスポンスを使う)
+    data = client.fetch_all()
+    if client.unchanged:
+        print(f"Not modified since last fetch: {', '.join(sorted(client.unchanged))}")
+    return data
+
+def load_sakenowa_data(client: Optional[SakenowaClient] = None):
+    own_client = client is None
+    client = client or SakenowaClient()
+
+    # ingest log start (取り込み本体とは別にコミットしておく)
     with get_conn() as conn:
-        # ingest log start
-        conn.execute("INSERT INTO ingest_runs (source, status, started_at) VALUES (?, ?, datetime('now'))", ("sakenowa", "running"))
-        
-        try:
-            # 1. Areas
-            data = client.get_areas()
-            print(f"Upserting {len(data)} areas...")
-            for row in data:
-                conn.execute("INSERT OR REPLACE INTO sakenowa_areas (areaId, name) VALUES (?, ?)", (row["id"], row["name"]))
-
-            # 2. Breweries
-            data = client.get_breweries()
-            print(f"Upserting {len(data)} breweries...")
-            for row in data:
-                conn.execute("INSERT OR REPLACE INTO sakenowa_breweries (breweryId, name, areaId) VALUES (?, ?, ?)", (row["id"], row["name"], row["areaId"]))
-
-            # 3. Brands
-            data = client.get_brands()
-            print(f"Upserting {len(data)} brands...")
-            for row in data:
-                conn.execute("INSERT OR REPLACE INTO sakenowa_brands (brandId, name, breweryId) VALUES (?, ?, ?)", (row["id"], row["name"], row["breweryId"]))
-            
-            # 4. Flavor Charts
-            data = client.get_flavor_charts()
-            print(f"Upserting {len(data)} flavor charts...")
-            for row in data:
-                conn.execute("""
-                    INSERT OR REPLACE INTO sakenowa_flavor_charts (brandId, f1, f2, f3, f4, f5, f6) 
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                """, (row["brandId"], row["f1"], row["f2"], row["f3"], row["f4"], row["f5"], row["f6"]))
-
-            # 5. Tags
-            data = client.get_tags()
-            print(f"Upserting {len(data)} tags...")
-            for row in data:
-                conn.execute("INSERT OR REPLACE INTO sakenowa_tags (tagId, tagName) VALUES (?, ?)", (row["id"], row["tag"]))
-
-            # 6. Brand Tags
-            data = client.get_brand_tags()
-            print(f"Upserting {len(data)} brand tags...")
-            conn.execute("DELETE FROM sakenowa_sake_tags") 
-            for row in data:
-                brand_id = row["brandId"]
-                tag_ids = row["tagIds"] # List[int]
-                for tid in tag_ids:
-                    conn.execute("INSERT OR IGNORE INTO sakenowa_sake_tags (brandId, tagId) VALUES (?, ?)", (brand_id, tid))
-
-            # 7. Rankings
-            data = client.get_rankings()
-            
-            print(f"Upserting rankings...")
-            conn.execute("DELETE FROM sakenowa_rankings")
-            
-            count = 0
-            for year_data in data:
-                if not isinstance(year_data, dict): continue
-                ym = year_data.get("yearMonth")
-                ranks = year_data.get("overall", [])
-                if not ranks:
-                    ranks = year_data.get("ranking", [])
-                
-                for r in ranks:
-                    conn.execute("INSERT INTO sakenowa_rankings (yearMonth, rank, brandId, score) VALUES (?, ?, ?, ?)", 
-                                 (ym, r["rank"], r["brandId"], r.get("score")))
-                    count += 1
-            print(f"Upserted {count} ranking records.")
-
-
-            # --- Transfer to Internal Model (sake_master, sake_texts) ---
-            print("Transferring to internal model...")
-            
-            # sake_master へ取り込み
-            # sakenowa_brands + breweries + areas => sake_master
-            sql_master = """
-                SELECT b.brandId, b.name as brandName, br.name as breweryName, a.name as prefName
-                FROM sakenowa_brands b
-                LEFT JOIN sakenowa_breweries br ON b.breweryId = br.breweryId
-                LEFT JOIN sakenowa_areas a ON br.areaId = a.areaId
-            """
-            rows = conn.execute(sql_master).fetchall()
-            
-            updated_count = 0
-            inserted_count = 0
-            
-            for r in rows:
-                # Check exist by external_id
-                cursor = conn.execute("SELECT sake_id FROM sake_master WHERE external_sakenowa_id = ?", (r["brandId"],))
-                existing = cursor.fetchone()
-                
-                if existing:
-                    conn.execute("""
-                        UPDATE sake_master SET 
-                            name = ?, brewery = ?, prefecture = ?, updated_at = datetime('now')
-                        WHERE sake_id = ?
-                    """, (r["brandName"], r["breweryName"], r["prefName"], existing[0]))
-                    sake_id = existing[0]
-                    updated_count += 1
-                else:
-                    conn.execute("""
-                        INSERT INTO sake_master (name, brewery, prefecture, source, external_sakenowa_id)
-                        VALUES (?, ?, ?, 'sakenowa', ?)
-                    """, (r["brandName"], r["breweryName"], r["prefName"], r["brandId"]))
-                    sake_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
-                    inserted_count += 1
-
-                # sake_texts へ取り込み (タグ情報)
-                tags_query = """
-                    SELECT t.tagName 
-                    FROM sakenowa_sake_tags st
-                    JOIN sakenowa_tags t ON st.tagId = t.tagId
-                    WHERE st.brandId = ?
-                """
-                tags = [tr[0] for tr in conn.execute(tags_query, (r["brandId"],)).fetchall()]
-                
-                if tags:
-                    tag_text = "さけのわタグ: " + ", ".join(tags)
-                    # テキスト重複チェック
-                    conn.execute("DELETE FROM sake_texts WHERE sake_id = ? AND source = 'sakenowa_tags'", (sake_id,))
-                    conn.execute("""
-                        INSERT INTO sake_texts (sake_id, source, text, created_at)
-                        VALUES (?, 'sakenowa_tags', ?, datetime('now'))
-                    """, (sake_id, tag_text))
-            
-            print(f"Master Sync: Inserted={inserted_count}, Updated={updated_count}")
+        run_id = conn.execute(
+            "INSERT INTO ingest_runs (source, status, started_at) VALUES (?, ?, datetime('now'))",
+            ("sakenowa", "running"),
+        ).lastrowid
 
+    try:
+        # API取得はトランザクションの外で行い、書き込みロックを握ったまま待たない
+        data = fetch_sakenowa_data(client)
+
+        # 生データの書き込みとマスタへの反映は1トランザクション (失敗時は全てロールバック)
+        with get_conn() as conn:
+            print("Upserting raw data...")
+            written = _upsert_raw(conn, data, skip=_unchanged_since_last_run(conn, client, run_id))
+            print("Transferring to internal model...")
+            counts = _sync_master(conn, run_id)
+            # カタログに載る内容が変わった場合だけ、カタログ(とレスポンスキャッシュ)を読み直させる
+            if written["flavor_charts"] or written["rankings"] or any(counts.values()):
+                conn.execute("UPDATE catalog_data_version SET version = version + 1")
             # Log success
-            conn.execute("UPDATE ingest_runs SET status = 'success', ended_at = datetime('now') WHERE status = 'running'")
-            print("Completed successfully.")
-            
-        except Exception as e:
-            print(f"Error: {e}")
-            import traceback
-            traceback.print_exc()
-            conn.execute("UPDATE ingest_runs SET status = 'failed', ended_at = datetime('now'), detail = ? WHERE status = 'running'", (str(e),))
-            # raise
+            detail = ", ".join(f"{kind}={count}" for kind, count in counts.items())
+            conn.execute("UPDATE ingest_runs SET status = 'success', ended_at = datetime('now'), detail = ? WHERE run_id = ?", (detail, run_id))
+        print(f"Completed successfully (run_id={run_id}). Changed sakes are recorded in ingest_changes.")
+        return run_id
+
+    except Exception as e:
+        print(f"Error: {e}")
+        import traceback
+        traceback.print_exc()
+        with get_conn() as conn:
+            conn.execute("UPDATE ingest_runs SET status = 'failed', ended_at = datetime('now'), detail = ? WHERE run_id = ?", (str(e), run_id))
+        # raise
+    finally:
+        if own_client:
+            client.close()
 
 if __name__ == "__main__":
     run_migrations()
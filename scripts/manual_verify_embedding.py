@@ -3,7 +3,6 @@ import sys
 import os
 import unittest
 from unittest.mock import MagicMock, patch
-import json
 
 # プロジェクトルートをパスに追加
 sys.path.append(os.getcwd())
@@ -33,35 +32,35 @@ def test_embedding_flow():
         settings.GEMINI_API_KEY = "DUMMY_KEY"
         
         instance = MockClient.return_value
-        instance.get_embedding.return_value = mock_embedding
+        # バッチAPI: 入力と同じ件数のEmbeddingを返す
+        instance.get_embeddings.side_effect = lambda texts: [mock_embedding for _ in texts]
         
         # 計算実行（注意: 実際のDBを更新しないようにする）
         # テスト用DBを使うべきだが、ここでは compute_embeddings 内の get_conn をモック化して
         # 実際のDBへの書き込みを回避する。
         
-        with patch("scripts.compute_embeddings.get_conn") as mock_get_conn:
+        with patch("scripts.compute_embeddings.get_conn") as mock_get_conn, \
+             patch("scripts.compute_embeddings.get_vector_sources") as mock_sources:
             mock_conn = MagicMock()
             mock_cursor = MagicMock()
             mock_get_conn.return_value.__enter__.return_value = mock_conn
             mock_conn.execute.return_value = mock_cursor
             
             # 銘柄取得のモック
-            mock_cursor.fetchall.return_value = [
-                {"sake_id": 1, "name": "Sake A", "brewery": "B1", "prefecture": "P1", "all_text": "text"}
+            mock_sources.return_value = [
+                {"sake_id": 1, "name": "Sake A", "brewery": "B1", "prefecture": "P1", "texts": ["text"],
+                 "current_hash": "h1", "embedding_source_hash": None}
             ]
-            # 既存ベクトルの取得モック
-            mock_cursor.fetchone.return_value = None # 既存なし
-            
-            compute_embeddings()
+            compute_embeddings(rate=0)
             
             # 呼び出し確認
-            assert instance.get_embedding.call_count == 1
-            print("  -> compute_embeddings called get_embedding: OK")
+            assert instance.get_embeddings.call_count == 1
+            print("  -> compute_embeddings called get_embeddings: OK")
             
             # DBへの書き込み確認
-            # INSERT または UPDATE が実行されたか
-            args, _ = mock_conn.execute.call_args_list[-1]
-            sql_executed = args[0]
+            # まとめてUPSERTされたか
+            args, _ = mock_conn.executemany.call_args_list[-1]
+            sql_executed = args[0].strip()
             print(f"  -> Last SQL executed: {sql_executed[:50]}...")
             assert "INSERT INTO sake_vectors" in sql_executed or "UPDATE sake_vectors" in sql_executed
             print("  -> DB Update attempted: OK")
@@ -74,12 +73,13 @@ def test_embedding_flow():
     settings.USE_EMBEDDING = 1
     
     # 使用されている箇所でパッチを当てる
-    with patch("app.reco.engine.EmbeddingClient") as MockClient:
+    with patch("app.reco.engine.get_embedding_client") as MockClient:
         instance = MockClient.return_value
         instance.get_query_embedding.return_value = [0.1] * 768 # 次元数を合わせる
         
         # DBの get_all_sakes_with_vectors をモック化して、ダミーデータと有効な taste_vector を返す
-        with patch("app.database.get_all_sakes_with_vectors") as mock_get_all:
+        with patch("app.database.get_all_sakes_with_vectors") as mock_get_all, \
+             patch("app.database.get_vector_fingerprint", return_value=(2, None, "v1", "v1")):
              mock_get_all.return_value = [
                  {
                      "sake_id": 1, 
@@ -0,0 +1,86 @@
+# Usage: uv run python scripts/migrate_embeddings_binary.py [--dtype float16] [--vacuum]
+import argparse
+import os
+import sys
+import time
+
+# プロジェクトルートをパスに追加
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from app.config import settings
+from app.db.codec import decode_embedding, encode_embedding, is_binary_embedding
+from app.db.core import get_conn
+
+BATCH_SIZE = 500
+
+
+def _db_size() -> int:
+    return os.path.getsize(settings.DB_PATH) if os.path.exists(settings.DB_PATH) else 0
+
+
+def migrate_embeddings(dtype: str, model: str, vacuum: bool) -> None:
+    """
+    sake_vectors.embedding の旧JSON形式の行をバイナリ形式に変換する
+    既にバイナリ形式の行はそのまま残す
+    """
+    print(f"Converting JSON embeddings to binary ({dtype}, model={model or '-'})...")
+    size_before = _db_size()
+
+    converted = 0
+    skipped = 0
+    failed = 0
+    started = time.perf_counter()
+
+    with get_conn() as conn:
+        rows = conn.execute(
+            "SELECT sake_id, embedding FROM sake_vectors WHERE embedding IS NOT NULL"
+        ).fetchall()
+        print(f"Found {len(rows)} embeddings.")
+
+        updates = []
+        for row in rows:
+            raw = row["embedding"]
+            if is_binary_embedding(raw):
+                skipped += 1
+                continue
+            try:
+                values = decode_embedding(raw)
+            except Exception as e:
+                print(f"Error parsing embedding for sake_id={row['sake_id']}: {e}")
+                failed += 1
+                continue
+            if values is None:
+                skipped += 1
+                continue
+            # computed_at は変えない (中身は同じベクトルのため)
+            updates.append((encode_embedding(values, dtype=dtype, model=model), row["sake_id"]))
+
+            if len(updates) >= BATCH_SIZE:
+                conn.executemany("UPDATE sake_vectors SET embedding = ? WHERE sake_id = ?", updates)
+                converted += len(updates)
+                updates = []
+                print(f"  Converted {converted} embeddings...")
+
+        if updates:
+            conn.executemany("UPDATE sake_vectors SET embedding = ? WHERE sake_id = ?", updates)
+            converted += len(updates)
+
+    if vacuum:
+        # 空いたページを回収してファイルサイズを縮める
+        with get_conn() as conn:
+            conn.execute("VACUUM")
+
+    elapsed = time.perf_counter() - started
+    size_after = _db_size()
+    print(f"✅ Converted={converted}, AlreadyBinary/Empty={skipped}, Failed={failed} ({elapsed:.1f}s)")
+    print(f"DB size: {size_before / 1024 / 1024:.1f} MB -> {size_after / 1024 / 1024:.1f} MB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="sake_vectors.embedding をJSONからバイナリ形式に変換する")
+    parser.add_argument("--dtype", default=settings.EMBED_STORAGE_DTYPE, choices=["float32", "float16"])
+    parser.add_argument("--model", default=settings.EMBED_MODEL, help="ヘッダに記録するモデル名")
+    parser.add_argument("--vacuum", action="store_true", help="変換後にVACUUMしてファイルサイズを縮める")
+    args = parser.parse_args()
+
+    migrate_embeddings(args.dtype, args.model, args.vacuum)
@@ -1,22 +1,102 @@
-import requests
-from typing import Any, Dict, List, Optional, Union
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set
+
+import httpx
+
+from app.config import settings
 
 class SakenowaClient:
     BASE_URL = "https://muro.sakenowa.com/sakenowa-data/api"
 
-    def __init__(self, timeout: int = 10):
+    def __init__(self, timeout: int = 10, base_url: Optional[str] = None,
+                 cache_dir: Optional[str] = None, max_workers: Optional[int] = None):
+        """
+        - 接続はセッション(httpx.Client)で使い回す
+        - cache_dir があれば、前回のレスポンスと ETag/Last-Modified を保存して条件付きリクエストを送る
+          (304 Not Modified ならダウンロードせずに保存済みのレスポンスを返す)
+        """
         self.timeout = timeout
+        self.base_url = (base_url or settings.SAKENOWA_BASE_URL or self.BASE_URL).rstrip("/")
+        cache_dir = settings.SAKENOWA_CACHE_DIR if cache_dir is None else cache_dir
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        self.max_workers = max_workers or settings.SAKENOWA_FETCH_CONCURRENCY
+        self._http = httpx.Client(
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=self.max_workers, max_keepalive_connections=self.max_workers),
+        )
+        self._lock = threading.Lock()
+        # 前回から変わっていなかったエンドポイント (304 Not Modified)
+        self.unchanged: Set[str] = set()
+        # 上を fetch_all() の戻り値のキー ("flavor_charts" など) で表したもの
+        self.unchanged_keys: Set[str] = set()
+
+    def close(self):
+        self._http.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _cache_path(self, endpoint: str) -> Path:
+        return self.cache_dir / f"{endpoint}.json"
+
+    def _load_cache(self, endpoint: str) -> Optional[Dict[str, Any]]:
+        if self.cache_dir is None:
+            return None
+        path = self._cache_path(endpoint)
+        if not path.exists():
+            return None
+        try:
+            return json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, json.JSONDecodeError):
+            # 壊れたキャッシュは無視して取り直す
+            return None
+
+    def _save_cache(self, endpoint: str, res: httpx.Response, body: Any):
+        etag = res.headers.get("ETag")
+        last_modified = res.headers.get("Last-Modified")
+        if self.cache_dir is None or not (etag or last_modified):
+            return
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        path = self._cache_path(endpoint)
+        tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_text(json.dumps({"etag": etag, "last_modified": last_modified, "body": body},
+                                  ensure_ascii=False), encoding="utf-8")
+        # 書きかけのファイルを読まないよう置き換えで保存する
+        os.replace(tmp, path)
 
     def _get_json(self, endpoint: str) -> Any:
-        url = f"{self.BASE_URL}/{endpoint}"
+        url = f"{self.base_url}/{endpoint}"
+        cached = self._load_cache(endpoint)
+        headers = {}
+        if cached:
+            if cached.get("etag"):
+                headers["If-None-Match"] = cached["etag"]
+            if cached.get("last_modified"):
+                headers["If-Modified-Since"] = cached["last_modified"]
         print(f"Fetching {url}...")
         try:
-            res = requests.get(url, timeout=self.timeout)
+            res = self._http.get(url, headers=headers)
+            if res.status_code == 304 and cached:
+                print(f"Not modified: {url}")
+                with self._lock:
+                    self.unchanged.add(endpoint)
+                return cached["body"]
             res.raise_for_status()
-            return res.json()
-        except requests.RequestException as e:
+            body = res.json()
+        except httpx.HTTPError as e:
             print(f"Error fetching {url}: {e}")
             raise
+        with self._lock:
+            self.unchanged.discard(endpoint)
+        self._save_cache(endpoint, res, body)
+        return body
 
     def get_areas(self) -> List[Dict[str, Any]]:
         # JSON: {"areas": [{"id": 1, "name": "...", ...}, ...]}
@@ -53,7 +133,7 @@ class SakenowaClient:
         # OR {"rankings": [...]} (List wrapper)
         # OR [...] (List)
         data = self._get_json("rankings")
-        
+
         ranking_list = []
         if isinstance(data, dict):
             if "overall" in data and "yearMonth" in data:
@@ -62,5 +142,26 @@ class SakenowaClient:
                 ranking_list = data["rankings"]
         elif isinstance(data, list):
             ranking_list = data
-            
+
         return ranking_list
+
+    def fetch_all(self) -> Dict[str, Any]:
+        """
+        全エンドポイントを並行して取得する (エンドポイント同士は独立)
+        304 で保存済みのレスポンスを使ったものは、戻り値のキーで unchanged_keys に記録する
+        Returns: {"areas": [...], "breweries": [...], ...}
+        """
+        getters = {
+            "areas": ("areas", self.get_areas),
+            "breweries": ("breweries", self.get_breweries),
+            "brands": ("brands", self.get_brands),
+            "flavor_charts": ("flavor-charts", self.get_flavor_charts),
+            "tags": ("flavor-tags", self.get_tags),
+            "brand_tags": ("brand-flavor-tags", self.get_brand_tags),
+            "rankings": ("rankings", self.get_rankings),
+        }
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {key: executor.submit(getter) for key, (_, getter) in getters.items()}
+            data = {key: future.result() for key, future in futures.items()}
+        self.unchanged_keys = {key for key, (endpoint, _) in getters.items() if endpoint in self.unchanged}
+        return data
@@ -0,0 +1,119 @@
+import logging
+from unittest.mock import patch
+
+import numpy as np
+
+from app.config import settings
+from app.reco import ann
+from app.reco.ann import IVFIndex, recall_at_k
+from app.reco.catalog import Catalog
+from app.reco.scoring import top_k
+
+MODEL = "models/test-embedding"
+
+
+def _clustered_catalog(n_clusters: int = 8, per_cluster: int = 40, dim: int = 16, extra=()):
+    rng = np.random.default_rng(0)
+    centers = rng.normal(size=(n_clusters, dim))
+    embeddings = np.vstack([c + 0.1 * rng.normal(size=(per_cluster, dim)) for c in centers])
+    rows = [{
+        "sake_id": i + 1,
+        "name": f"Sake {i}",
+        "brewery": None,
+        "prefecture": None,
+        "vector": [0.0, 0.0, 0.0, 0.0],
+        "embedding": emb.tolist(),
+    } for i, emb in enumerate(list(embeddings) + list(extra))]
+    return Catalog.from_rows(rows, fingerprint=("ann",)), centers
+
+
+def _build(cat, nlist: int = 4, **kwargs):
+    rows = np.flatnonzero(cat.has_embedding)
+    return IVFIndex.build([cat.sake_ids[i] for i in rows], cat.embeddings[rows], nlist=nlist, **kwargs)
+
+
+def test_build_partitions_every_sake_once():
+    cat, _ = _clustered_catalog()
+    index = _build(cat, meta={"model": MODEL})
+    assert (index.nlist, index.dim, len(index)) == (4, 16, len(cat))
+    assert sorted(index.list_sake_ids.tolist()) == cat.sake_ids
+    assert index.list_offsets[0] == 0 and index.list_offsets[-1] == len(cat)
+    assert (index.meta["model"], index.meta["dim"], index.meta["n"]) == (MODEL, 16, len(cat))
+    # 球面k-meansで、同じクラスタの銘柄は同じパーティションに入る
+    partition = {}
+    for i in range(index.nlist):
+        for sid in index.list_sake_ids[index.list_offsets[i]:index.list_offsets[i + 1]].tolist():
+            partition[sid] = i
+    assert all(len({partition[sid] for sid in range(c * 40 + 1, c * 40 + 41)}) == 1 for c in range(8))
+
+
+def test_probe_recall_against_brute_force():
+    cat, centers = _clustered_catalog()
+    index = _build(cat)
+    emb_rows = np.flatnonzero(cat.has_embedding)
+    rng = np.random.default_rng(1)
+    queries = centers + 0.05 * rng.normal(size=centers.shape)
+    for q in queries:
+        probed = index.probe(cat, q, nprobe=1)
+        assert 0 < len(probed) < len(cat) and len(probed) % 40 == 0
+        exact, _ = cat.scorer.cosine(q, emb_rows)
+        assert set(emb_rows[top_k(exact, 10)].tolist()) <= set(probed.tolist())
+        # 全パーティションを見れば全件スキャンと同じ
+        assert sorted(index.probe(cat, q, nprobe=index.nlist).tolist()) == emb_rows.tolist()
+
+    assert recall_at_k(index, cat, queries, k=10, nprobe=1)["recall"] == 1.0
+    full = recall_at_k(index, cat, queries, k=10, nprobe=index.nlist)
+    assert (full["recall"], full["avg_candidates"]) == (1.0, len(cat))
+
+
+def test_save_load_round_trip(tmp_path):
+    cat, centers = _clustered_catalog()
+    index = _build(cat, meta={"model": MODEL})
+    path = str(tmp_path / "ann" / "index.npz")
+    index.save(path)
+    loaded = IVFIndex.load(path)
+    assert np.array_equal(loaded.centroids, index.centroids)
+    assert np.array_equal(loaded.list_offsets, index.list_offsets)
+    assert np.array_equal(loaded.list_sake_ids, index.list_sake_ids)
+    assert loaded.meta == index.meta
+    with patch.object(settings, "EMBED_MODEL", MODEL):
+        for q in centers:
+            assert np.array_equal(loaded.probe(cat, q, 2), index.probe(cat, q, 2))
+        assert ann.load_index(path, dim=16) is not None
+        assert ann.get_index().meta == index.meta
+    assert ann.load_index(str(tmp_path / "missing.npz")) is None
+
+
+def test_embeddings_added_after_build_are_always_candidates():
+    cat, centers = _clustered_catalog()
+    index = _build(cat)
+    grown, _ = _clustered_catalog(extra=[-centers[0]])
+    probed = index.probe(grown, centers[0], nprobe=1)
+    assert len(grown) - 1 in probed.tolist()
+
+
+def test_mismatched_index_falls_back_to_full_scan(tmp_path, caplog):
+    cat, centers = _clustered_catalog()
+    index = _build(cat, meta={"model": MODEL})
+    path = str(tmp_path / "index.npz")
+    index.save(path)
+    emb_rows = np.flatnonzero(cat.has_embedding).tolist()
+
+    with caplog.at_level(logging.WARNING, logger="app.reco.ann"):
+        # 別モデル/別次元用のインデックスは読み込まない
+        with patch.object(settings, "EMBED_MODEL", "models/other"):
+            assert ann.load_index(path) is None
+            assert ann.get_index() is None
+            assert index.probe(cat, centers[0], 1).tolist() == emb_rows
+        with patch.object(settings, "EMBED_MODEL", MODEL):
+            assert ann.load_index(path, dim=32) is None
+            # クエリを切り詰めずに全件スキャンにする
+            assert index.probe(cat, centers[0][:8], 1).tolist() == emb_rows
+            other, _ = _clustered_catalog(dim=32)
+            assert index.probe(other, np.ones(32), 1).tolist() == np.flatnonzero(other.has_embedding).tolist()
+            # 同じ不一致の警告は1回だけ
+            index.probe(cat, centers[1][:8], 1)
+    messages = [r.getMessage() for r in caplog.records]
+    assert sum("dim 16 != 8" in m for m in messages) == 1
+    assert any("model 'models/test-embedding' != 'models/other'" in m for m in messages)
+    assert any("dim 16 != 32" in m for m in messages)
@@ -0,0 +1,108 @@
+import time
+from collections import Counter
+from unittest.mock import patch
+
+from app.config import settings
+from app.db.codec import decode_embedding
+from app.db.core import apply_schema, get_conn, pool
+from scripts import compute_embeddings as ce
+
+N_SAKES = 25
+
+
+class _FailingProvider(ce.FakeEmbeddingProvider):
+    """
+    指定したテキストを含むバッチは常に失敗する偽プロバイダ
+    """
+
+    def __init__(self, poison: str, **kwargs):
+        super().__init__(**kwargs)
+        self.poison = poison
+
+    def __call__(self, texts):
+        if any(self.poison in text for text in texts):
+            with self._lock:
+                self.calls += 1
+            raise RuntimeError("fake provider: 500 Internal error")
+        return super().__call__(texts)
+
+
+def _seed():
+    with get_conn() as conn:
+        apply_schema(conn)
+        for sake_id in range(1, N_SAKES + 1):
+            conn.execute("INSERT INTO sake_master (sake_id, name, brewery, prefecture) VALUES (?, ?, ?, ?)",
+                         (sake_id, f"銘柄{sake_id}", "蔵元", "新潟県"))
+
+
+def _run(provider, max_retries: int):
+    written = Counter()
+    write = ce._write_embeddings
+    waits = []
+    held = []
+
+    def record_write(items):
+        held.append(pool._writer_depth)
+        written.update(sake_id for sake_id, _, _ in items)
+        write(items)
+
+    def embed(texts):
+        held.append(pool._writer_depth)
+        return provider(texts)
+
+    def record_wait(sec):
+        # 偽プロバイダのレイテンシ(0秒)は数えない
+        if sec > 0:
+            waits.append(sec)
+
+    # バックオフの待ち時間は記録するだけで実際には待たない
+    with patch.object(ce, "_write_embeddings", record_write), \
+         patch.object(ce.time, "sleep", record_wait), \
+         patch.object(settings, "EMBED_STORAGE_DTYPE", "float32"):
+        updated = ce.compute_embeddings(embed_batch=embed, batch_size=4, rate=0, concurrency=3,
+                                        max_retries=max_retries, commit_every=5)
+    # APIの呼び出し中も書き込みの合間も書き込み接続を握らない
+    assert held and not any(held)
+    return updated, written, waits
+
+
+def test_fake_provider_failures_are_retried_and_written_once(tmp_path):
+    with patch.object(settings, "DB_PATH", str(tmp_path / "sake.db")):
+        _seed()
+        provider = ce.FakeEmbeddingProvider(dim=8, latency=0, failure_rate=0.3, seed=1)
+        updated, written, waits = _run(provider, max_retries=10)
+
+        batches = -(-N_SAKES // 4)
+        assert updated == N_SAKES
+        assert written == Counter(range(1, N_SAKES + 1))
+        # 失敗した回数だけ(バックオフを挟んで)呼び直す
+        assert provider.calls == batches + len(waits)
+        assert 0 < len(waits) <= batches * 10
+        with get_conn() as conn:
+            rows = conn.execute("SELECT sake_id, embedding FROM sake_vectors ORDER BY sake_id").fetchall()
+        assert [row[0] for row in rows] == list(range(1, N_SAKES + 1))
+        assert all(len(decode_embedding(row[1])) == 8 for row in rows)
+
+
+def test_batch_that_keeps_failing_stops_after_max_retries(tmp_path):
+    with patch.object(settings, "DB_PATH", str(tmp_path / "sake.db")):
+        _seed()
+        # 銘柄7はバッチ2 (銘柄5~8)
+        provider = _FailingProvider("銘柄7 ", dim=8, latency=0)
+        updated, written, waits = _run(provider, max_retries=3)
+
+        assert updated == N_SAKES - 4
+        assert written == Counter(i for i in range(1, N_SAKES + 1) if not 5 <= i <= 8)
+        # 失敗するバッチは 1 + max_retries 回で諦める
+        assert provider.calls == -(-N_SAKES // 4) + 3
+        assert len(waits) == 3
+        assert waits == sorted(waits) and waits[-1] <= 4.0
+
+
+def test_token_bucket_limits_request_rate():
+    bucket = ce.TokenBucket(rate=100)
+    started = time.monotonic()
+    for _ in range(11):
+        bucket.acquire()
+    # 最初の1回はバースト分、残り10回は 1/100 秒ずつ
+    assert time.monotonic() - started >= 0.09
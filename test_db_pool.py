@@ -0,0 +1,59 @@
+import sqlite3
+import threading
+
+import pytest
+
+from app.db.core import ConnectionPool
+
+
+def _count(path) -> int:
+    with sqlite3.connect(path) as other:
+        return other.execute("SELECT COUNT(*) FROM t").fetchone()[0]
+
+
+def test_nested_writer_commits_only_at_outermost_level(tmp_path, monkeypatch):
+    path = str(tmp_path / "pool.db")
+    monkeypatch.setattr("app.db.core.settings.DB_PATH", path)
+    pool = ConnectionPool()
+    with pool.writer() as conn:
+        conn.execute("CREATE TABLE t (x INTEGER)")
+
+    with pool.writer() as outer:
+        outer.execute("INSERT INTO t VALUES (1)")
+        with pool.writer() as inner:
+            assert inner is outer
+            inner.execute("INSERT INTO t VALUES (2)")
+        # 内側のブロックを抜けても外側のトランザクションは続いている
+        assert _count(path) == 0
+        with pytest.raises(ValueError):
+            with pool.writer() as inner:
+                inner.execute("INSERT INTO t VALUES (3)")
+                raise ValueError
+    # 内側の例外は内側の変更だけを取り消す
+    assert sorted(row[0] for row in pool.reader().execute("SELECT x FROM t")) == [1, 2]
+
+    with pytest.raises(ValueError):
+        with pool.writer() as outer:
+            outer.execute("INSERT INTO t VALUES (4)")
+            with pool.writer() as inner:
+                inner.execute("INSERT INTO t VALUES (5)")
+            raise ValueError
+    assert _count(path) == 2
+
+
+def test_reader_does_not_wait_for_writer(tmp_path, monkeypatch):
+    monkeypatch.setattr("app.db.core.settings.DB_PATH", str(tmp_path / "pool.db"))
+    pool = ConnectionPool()
+    with pool.writer() as conn:
+        conn.execute("CREATE TABLE t (x INTEGER)")
+        conn.execute("INSERT INTO t VALUES (1)")
+
+    result = []
+    # 長い書き込みの途中でも、新しいスレッドの読み取り接続はすぐに開けて確定済みの行を読める
+    with pool.writer() as conn:
+        conn.execute("INSERT INTO t VALUES (2)")
+        worker = threading.Thread(target=lambda: result.append(pool.reader().execute("SELECT COUNT(*) FROM t").fetchone()[0]))
+        worker.start()
+        worker.join(timeout=2)
+        assert not worker.is_alive()
+    assert result == [1]
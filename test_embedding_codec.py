@@ -0,0 +1,72 @@
+import json
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+
+from app import database as db
+from app.config import settings
+from app.db.codec import MAGIC, decode_embedding, encode_embedding, is_binary_embedding, read_header
+from app.db.core import apply_schema, get_conn
+from scripts.migrate_embeddings_binary import migrate_embeddings
+
+VALUES = [0.1, -1.5, 1 / 3, 2.0 ** -10, 65504.0]
+
+
+def test_binary_embedding_round_trip():
+    for dtype, atol in [("float32", 1e-7), ("float16", 1e-3)]:
+        raw = encode_embedding(VALUES, dtype=dtype, model="models/text-embedding-004")
+        assert raw[:4] == MAGIC and is_binary_embedding(raw)
+        assert read_header(raw) == (len(VALUES), dtype, "models/text-embedding-004")
+        decoded = decode_embedding(raw)
+        assert decoded.dtype == np.dtype(dtype)
+        assert np.allclose(decoded, VALUES, rtol=atol, atol=atol)
+        # ヘッダ(12バイト) + モデル名 + 値
+        assert len(raw) == 12 + len("models/text-embedding-004") + len(VALUES) * np.dtype(dtype).itemsize
+        # SQLite から memoryview で返ってきても読める
+        assert np.array_equal(decode_embedding(memoryview(raw)), decoded)
+
+    # モデル名は省略できる (日本語も可)
+    assert read_header(encode_embedding([1.0], model="")).model == ""
+    assert read_header(encode_embedding([1.0], model="埋め込み")).model == "埋め込み"
+    with pytest.raises(ValueError):
+        encode_embedding(VALUES, dtype="float64")
+
+
+def test_legacy_json_embedding_still_decodes():
+    legacy = json.dumps(VALUES)
+    for raw in (legacy, legacy.encode("utf-8")):
+        assert read_header(raw) is None
+        decoded = decode_embedding(raw)
+        assert decoded.dtype == np.float64
+        assert decoded.tolist() == VALUES
+    assert decode_embedding(None) is None
+    assert decode_embedding("") is None
+    assert decode_embedding(b"") is None
+
+
+def test_catalog_reads_legacy_and_binary_rows(tmp_path):
+    with patch.object(settings, "DB_PATH", str(tmp_path / "sake.db")):
+        with get_conn() as conn:
+            apply_schema(conn)
+            stored = {
+                1: json.dumps(VALUES),  # 旧形式 (TEXT)
+                2: json.dumps(VALUES).encode("utf-8"),  # 旧形式 (BLOB)
+                3: encode_embedding(VALUES, dtype="float32"),
+            }
+            for sake_id, raw in stored.items():
+                conn.execute("INSERT INTO sake_master (sake_id, name) VALUES (?, ?)", (sake_id, f"銘柄{sake_id}"))
+                conn.execute("INSERT INTO sake_vectors (sake_id, taste_vector, embedding, version) VALUES (?, '[0,0,0,0]', ?, 'v1-dict')",
+                             (sake_id, raw))
+
+        before = {d["sake_id"]: d["embedding"] for d in db.get_all_sakes_with_vectors()}
+        assert all(np.allclose(before[sake_id], VALUES, atol=1e-7) for sake_id in stored)
+
+        # 旧形式の行だけバイナリに変換され、読み出す値は変わらない
+        migrate_embeddings(dtype="float32", model="", vacuum=False)
+        with get_conn() as conn:
+            rows = dict(conn.execute("SELECT sake_id, embedding FROM sake_vectors").fetchall())
+        assert all(is_binary_embedding(raw) for raw in rows.values())
+        assert rows[3] == stored[3]
+        after = {d["sake_id"]: d["embedding"] for d in db.get_all_sakes_with_vectors()}
+        assert all(np.array_equal(after[sake_id], before[3]) for sake_id in stored)
@@ -0,0 +1,187 @@
+import sqlite3
+from pathlib import Path
+from unittest.mock import patch
+
+from app import database as db
+from app.config import settings
+from app.db.core import apply_schema, get_conn
+from app.reco.catalog import Catalog
+from app.reco.popularity import compute_priors
+from scripts.loader_sakenowa import load_sakenowa_data, run_migrations
+from scripts.sakenowa_client import SakenowaClient
+
+
+class _StubClient(SakenowaClient):
+    """
+    APIを呼ばずに固定データを返す SakenowaClient
+    """
+
+    def __init__(self, brand_names, brand_tags=None, rankings=None, unchanged=()):
+        super().__init__(cache_dir="")
+        # 304 Not Modified だったことにするエンドポイント
+        self.unchanged = set(unchanged)
+        self.brand_names = brand_names
+        self.rankings = rankings or [{"yearMonth": 202401, "overall": [{"rank": 1, "brandId": 101, "score": 4.5}]}]
+        self.brand_tags = brand_tags or [
+            {"brandId": 100, "tagIds": [3, 1]}, {"brandId": 101, "tagIds": [2, 2]}, {"brandId": 102, "tagIds": []},
+        ]
+
+    def get_areas(self):
+        return [{"id": 1, "name": "新潟県"}, {"id": 2, "name": "山口県"}]
+
+    def get_breweries(self):
+        return [{"id": 10, "name": "朝日酒造", "areaId": 1}, {"id": 20, "name": "旭酒造", "areaId": 2}]
+
+    def get_brands(self):
+        return [{"id": 100 + i, "name": name, "breweryId": 10 if i % 2 == 0 else 20}
+                for i, name in enumerate(self.brand_names)]
+
+    def get_flavor_charts(self):
+        return [{"brandId": 100, "f1": 0.1, "f2": 0.2, "f3": 0.3, "f4": 0.4, "f5": 0.5, "f6": 0.6}]
+
+    def get_tags(self):
+        return [{"id": 1, "tag": "フルーティ"}, {"id": 2, "tag": "辛口"}, {"id": 3, "tag": "華やか"}]
+
+    def get_brand_tags(self):
+        return self.brand_tags
+
+    def get_rankings(self):
+        return self.rankings
+
+
+def test_load_sakenowa_data_is_idempotent(tmp_path, monkeypatch):
+    monkeypatch.chdir(Path(__file__).resolve().parent)
+    with patch.object(settings, "DB_PATH", str(tmp_path / "sake.db")):
+        with get_conn() as conn:
+            apply_schema(conn)
+        run_migrations()
+
+        load_sakenowa_data(_StubClient(["久保田", "獺祭", "八海山"]))
+        fingerprint = db.get_vector_fingerprint()
+        # 2回目: 既存銘柄は更新され、sake_id は変わらない
+        load_sakenowa_data(_StubClient(["久保田 千寿", "獺祭", "八海山", "越乃寒梅"]))
+
+        conn = sqlite3.connect(settings.DB_PATH)
+        master = conn.execute(
+            "SELECT sake_id, external_sakenowa_id, name, brewery, prefecture FROM sake_master ORDER BY sake_id"
+        ).fetchall()
+        assert master == [
+            (1, 100, "久保田 千寿", "朝日酒造", "新潟県"),
+            (2, 101, "獺祭", "旭酒造", "山口県"),
+            (3, 102, "八海山", "朝日酒造", "新潟県"),
+            (4, 103, "越乃寒梅", "旭酒造", "山口県"),
+        ]
+        # タグは銘柄ごとに1行 (tagId順)、タグの無い銘柄は作らない
+        texts = conn.execute("SELECT sake_id, text FROM sake_texts WHERE source = 'sakenowa_tags' ORDER BY sake_id").fetchall()
+        assert texts == [(1, "さけのわタグ: フルーティ, 華やか"), (2, "さけのわタグ: 辛口")]
+        assert conn.execute("SELECT yearMonth, rank, brandId FROM sakenowa_rankings").fetchall() == [(202401, 1, 101)]
+        assert db.get_ranking_history() == [(2, 202401, 1)]
+        assert conn.execute("SELECT status FROM ingest_runs ORDER BY run_id").fetchall() == [("success",), ("success",)]
+        conn.close()
+        # 内容が変わった取り込みのときだけカタログを読み直す (チャート/ランキングの中身は走査しない)
+        changed = db.get_vector_fingerprint()
+        assert changed != fingerprint and changed[1] == 2
+        load_sakenowa_data(_StubClient(["久保田 千寿", "獺祭", "八海山", "越乃寒梅"]))
+        assert db.get_vector_fingerprint() == changed
+        # 近傍の鮮度は sake_vectors だけで決まる
+        assert changed[0] == fingerprint[0]
+        assert Catalog.from_rows([], changed).neighbor_version == Catalog.from_rows([], fingerprint).neighbor_version
+
+
+def _changes(conn, run_id):
+    return conn.execute("SELECT sake_id, kind FROM ingest_changes WHERE run_id = ? ORDER BY sake_id, kind", (run_id,)).fetchall()
+
+
+def test_load_sakenowa_data_records_only_changed_sakes(tmp_path, monkeypatch):
+    monkeypatch.chdir(Path(__file__).resolve().parent)
+    with patch.object(settings, "DB_PATH", str(tmp_path / "sake.db")):
+        with get_conn() as conn:
+            apply_schema(conn)
+        run_migrations()
+
+        names = ["久保田", "獺祭", "八海山"]
+        first = load_sakenowa_data(_StubClient(names))
+        conn = sqlite3.connect(settings.DB_PATH)
+        assert _changes(conn, first) == [(1, "insert"), (1, "tags"), (2, "insert"), (2, "tags"), (3, "insert")]
+        texts_before = conn.execute("SELECT text_id, sake_id, text FROM sake_texts").fetchall()
+
+        # 同じデータ: 何も書き込まない
+        second = load_sakenowa_data(_StubClient(names))
+        assert _changes(conn, second) == []
+        assert conn.execute("SELECT text_id, sake_id, text FROM sake_texts").fetchall() == texts_before
+
+        # 八海山の銘柄名と、獺祭(タグが無くなる)/八海山(タグが付く)のタグだけ変わった
+        run_migrations()
+        third = load_sakenowa_data(_StubClient(
+            ["久保田", "獺祭", "八海山 清酒"],
+            brand_tags=[{"brandId": 100, "tagIds": [1, 3]}, {"brandId": 102, "tagIds": [2]}],
+        ))
+        assert _changes(conn, third) == [(2, "tags"), (3, "tags"), (3, "update")]
+        texts = conn.execute("SELECT sake_id, text FROM sake_texts ORDER BY sake_id").fetchall()
+        assert texts == [(1, "さけのわタグ: フルーティ, 華やか"), (3, "さけのわタグ: 辛口")]
+        conn.close()
+
+        # ベクトル計算側は変更セットの銘柄だけを読む
+        assert db.get_changed_sake_ids(third) == (third, [2, 3])
+        assert db.get_changed_sake_ids() == (third, [2, 3])
+        assert db.get_changed_sake_ids(first)[1] == [1, 2, 3]
+        sources = db.get_vector_sources([2, 3])
+        assert [(s["sake_id"], s["texts"]) for s in sources] == [(2, []), (3, ["さけのわタグ: 辛口"])]
+
+
+def _ranking(year_month, brand_ids):
+    return [{"yearMonth": year_month, "overall": [{"rank": i + 1, "brandId": b, "score": 5.0 - i} for i, b in enumerate(brand_ids)]}]
+
+
+def test_rankings_keep_past_months(tmp_path, monkeypatch):
+    monkeypatch.chdir(Path(__file__).resolve().parent)
+    with patch.object(settings, "DB_PATH", str(tmp_path / "sake.db")):
+        with get_conn() as conn:
+            apply_schema(conn)
+        run_migrations()
+
+        names = ["久保田", "獺祭", "八海山"]
+        # APIは最新月だけを返す
+        load_sakenowa_data(_StubClient(names, rankings=_ranking(202401, [101, 100])))
+        load_sakenowa_data(_StubClient(names, rankings=_ranking(202402, [100, 101, 102])))
+        assert db.get_ranking_history() == [(2, 202401, 1), (1, 202401, 2), (1, 202402, 1), (2, 202402, 2), (3, 202402, 3)]
+
+        # 同じ月を取り込み直した場合はその月だけ置き換える
+        load_sakenowa_data(_StubClient(names, rankings=_ranking(202402, [100, 101])))
+        history = db.get_ranking_history()
+        assert history == [(2, 202401, 1), (1, 202401, 2), (1, 202402, 1), (2, 202402, 2)]
+
+        # 2024/02 の重み 1、2024/01 の重み 0.5 で減衰させた平均
+        priors = compute_priors(history, half_life_months=1, months=12)
+        assert abs(priors[1] - (1.0 * 1.0 + 0.5 * 0.5) / 1.5) < 1e-12
+        assert abs(priors[2] - (1.0 * 0.5 + 0.5 * 1.0) / 1.5) < 1e-12
+
+
+def test_not_modified_endpoints_are_not_upserted(tmp_path, monkeypatch):
+    monkeypatch.chdir(Path(__file__).resolve().parent)
+    with patch.object(settings, "DB_PATH", str(tmp_path / "sake.db")):
+        with get_conn() as conn:
+            apply_schema(conn)
+        run_migrations()
+
+        names = ["久保田", "獺祭", "八海山"]
+        load_sakenowa_data(_StubClient(names))
+        # 304 のエンドポイントは(返ってきた内容によらず)書き込まない
+        skipped = load_sakenowa_data(_StubClient(
+            names, brand_tags=[{"brandId": 102, "tagIds": [2]}], rankings=_ranking(202401, [102]),
+            unchanged=["brand-flavor-tags", "rankings"],
+        ))
+        conn = sqlite3.connect(settings.DB_PATH)
+        assert _changes(conn, skipped) == []
+        assert conn.execute("SELECT yearMonth, rank, brandId FROM sakenowa_rankings").fetchall() == [(202401, 1, 101)]
+
+        # 前回の取り込みが失敗していれば 304 でも書き込む
+        conn.execute("INSERT INTO ingest_runs (source, status, started_at) VALUES ('sakenowa', 'failed', datetime('now'))")
+        conn.commit()
+        retried = load_sakenowa_data(_StubClient(
+            names, brand_tags=[{"brandId": 102, "tagIds": [2]}], rankings=_ranking(202401, [102]),
+            unchanged=["brand-flavor-tags", "rankings"],
+        ))
+        assert _changes(conn, retried) == [(1, "tags"), (2, "tags"), (3, "tags")]
+        assert conn.execute("SELECT yearMonth, rank, brandId FROM sakenowa_rankings").fetchall() == [(202401, 1, 102)]
+        conn.close()
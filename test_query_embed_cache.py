@@ -0,0 +1,98 @@
+import asyncio
+import threading
+from unittest.mock import AsyncMock, patch
+
+from app.config import settings
+from app.reco.embed_cache import QueryEmbeddingCache
+from app.reco.embedding import AsyncEmbeddingClient
+
+MODEL = "models/test-embedding"
+
+
+def test_disk_tier_returns_same_vector_after_restart(tmp_path):
+    path = str(tmp_path / "cache.db")
+    # float32 では表せない値
+    original = [0.1, 1 / 3, -2.000000001]
+    cache = QueryEmbeddingCache(db_path=path)
+    stored = cache.put("辛口 すっきり", MODEL, "retrieval_query", original)
+    assert cache.get("辛口 すっきり", MODEL, "retrieval_query") == stored
+
+    restarted = QueryEmbeddingCache(db_path=path)
+    # 正規化したテキストが同じならヒットし、メモリ層と同じ値を返す
+    assert restarted.get("辛口　 すっきり", MODEL, "retrieval_query") == stored
+    assert restarted.stats()["disk_hits"] == 1
+    assert all(abs(a - b) < 1e-6 for a, b in zip(stored, original))
+
+
+def test_disk_tier_drops_expired_rows_and_caps_row_count(tmp_path):
+    cache = QueryEmbeddingCache(max_size=2, ttl_sec=100, db_path=str(tmp_path / "cache.db"), max_disk_rows=3)
+    cache.PRUNE_EVERY = 1
+    with patch("app.reco.embed_cache.time.time", return_value=1000.0):
+        cache.put("old", MODEL, "retrieval_query", [1.0])
+    for i in range(5):
+        with patch("app.reco.embed_cache.time.time", return_value=1050.0 + i):
+            cache.put(f"q{i}", MODEL, "retrieval_query", [float(i)])
+    assert cache.disk_rows() == 3
+
+    # 期限切れの行は次の掃除で消える
+    with patch("app.reco.embed_cache.time.time", return_value=1154.5):
+        cache.put("new", MODEL, "retrieval_query", [9.0])
+    assert cache.disk_rows() == 1
+    # 件数上限で3件 (old, q0, q1)、期限切れで3件 (q2, q3, q4)
+    assert cache.stats()["disk_pruned"] == 6
+
+
+def test_memory_hit_does_not_wait_for_disk(tmp_path):
+    cache = QueryEmbeddingCache(db_path=str(tmp_path / "cache.db"))
+    cache.put("辛口", MODEL, "retrieval_query", [1.0, 2.0])
+    result = []
+    # ディスク層が使用中でもメモリ層のヒットは返る
+    with cache._disk_lock:
+        worker = threading.Thread(target=lambda: result.append(cache.get("辛口", MODEL, "retrieval_query")))
+        worker.start()
+        worker.join(timeout=2)
+        assert not worker.is_alive()
+    assert result == [[1.0, 2.0]]
+
+
+class _ThreadRecordingCache(QueryEmbeddingCache):
+    """
+    get/put を呼んだスレッドを記録する
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.threads = []
+
+    def get(self, *args):
+        self.threads.append(threading.get_ident())
+        return super().get(*args)
+
+    def put(self, *args):
+        self.threads.append(threading.get_ident())
+        return super().put(*args)
+
+
+def test_async_client_keeps_disk_cache_off_the_event_loop(tmp_path):
+    async def run(cache):
+        loop_thread = threading.get_ident()
+        client = AsyncEmbeddingClient(timeout_sec=2)
+        with patch("app.reco.embedding.query_cache", cache), \
+             patch.object(settings, "GEMINI_API_KEY", "test"), \
+             patch("app.reco.embedding.genai.embed_content_async",
+                   AsyncMock(side_effect=[{"embedding": [0.5, 0.25]}, {"embedding": [[1.0], [2.0]]}])):
+            first = await client.get_query_embedding("辛口")
+            again = await client.get_query_embedding("辛口")
+            batch = await client.get_query_embeddings(["甘口", "辛口", "濃厚"])
+        return loop_thread, first, again, batch
+
+    disk = _ThreadRecordingCache(db_path=str(tmp_path / "cache.db"))
+    loop_thread, first, again, batch = asyncio.run(run(disk))
+    assert first == again == [0.5, 0.25]
+    assert batch == [[1.0], [0.5, 0.25], [2.0]]
+    assert disk.threads and loop_thread not in disk.threads
+
+    # メモリ層だけならイベントループ上でそのまま引く
+    memory = _ThreadRecordingCache()
+    loop_thread, *_ = asyncio.run(run(memory))
+    assert set(memory.threads) == {loop_thread}
@@ -0,0 +1,92 @@
+from unittest.mock import patch
+
+from fastapi.testclient import TestClient
+
+from app.config import settings
+from app.main import app
+from app.reco.catalog import Catalog
+from app.reco.response_cache import recommend_cache
+
+
+def _catalog(fingerprint) -> Catalog:
+    prefs = ["新潟県", "山口県", "兵庫県"]
+    rows = [{
+        "sake_id": i + 1,
+        "name": f"Sake {i}",
+        "brewery": f"Brewery {i % 7}",
+        "prefecture": prefs[i % len(prefs)],
+        "vector": [(i % 5 - 2) / 2, (i % 3 - 1) / 1, (i % 4) / 4, 0.0],
+        "embedding": None,
+    } for i in range(60)]
+    return Catalog.from_rows(rows, fingerprint=fingerprint)
+
+
+def test_recommend_response_cache():
+    client = TestClient(app)
+    recommend_cache.clear()
+    body = {"text": "辛口ですっきり", "top_k": 3, "filters": {"prefecture": ["新潟県", "兵庫県"]}}
+    with patch("app.reco.catalog.get_catalog", return_value=_catalog(("v1",))) as get_catalog, \
+         patch.object(settings, "USE_EMBEDDING", 0):
+        first = client.post("/recommend", json=body)
+        assert first.status_code == 200
+        assert first.headers["X-Cache"] == "MISS"
+        assert first.headers["Cache-Control"] == f"public, max-age={settings.RECOMMEND_CACHE_MAX_AGE_SEC}"
+        assert len(first.json()["recommendations"]) == 3
+
+        # 順序・重複だけが違うフィルタも同じリクエストとして扱う
+        same = dict(body, filters={"prefecture": ["兵庫県", "新潟県", "兵庫県"], "exclude_brewery": []})
+        second = client.post("/recommend", json=same)
+        assert second.headers["X-Cache"] == "HIT"
+        assert second.content == first.content
+        assert second.headers["ETag"] == first.headers["ETag"]
+
+        # CDN/クライアントからの再検証
+        not_modified = client.post("/recommend", json=body, headers={"If-None-Match": first.headers["ETag"]})
+        assert not_modified.status_code == 304
+        assert not_modified.content == b""
+
+        # debug はキャッシュしない
+        debug = client.post("/recommend", json=dict(body, debug=True))
+        assert debug.headers["X-Cache"] == "MISS"
+        assert debug.headers["Cache-Control"] == "no-store"
+
+        stats = client.get("/metrics").json()["recommend_cache"]
+        assert (stats["size"], stats["hits"], stats["misses"]) == (1, 2, 1)
+        assert stats["bytes"] == len(first.content)
+
+        # カタログ(sake_vectors)が更新されたら計算し直す
+        get_catalog.return_value = _catalog(("v2",))
+        third = client.post("/recommend", json=body)
+        assert third.headers["X-Cache"] == "MISS"
+        assert third.json() == first.json()
+        assert recommend_cache.stats()["invalidations"] == 1
+    recommend_cache.clear()
+
+
+def test_recommend_cache_ranks_with_the_keyed_catalog():
+    client = TestClient(app)
+    recommend_cache.clear()
+    body = {"text": "辛口ですっきり", "top_k": 3}
+    keyed = _catalog(("v1",))
+    reloaded = _catalog(("v2",))
+    reloaded.taste[:] = -reloaded.taste
+    with patch("app.reco.catalog.get_catalog", side_effect=[keyed, reloaded]) as get_catalog, \
+         patch.object(settings, "USE_EMBEDDING", 0):
+        res = client.post("/recommend", json=body)
+    # キーを作ったカタログ(v1)の結果が v1 のキーで保存される
+    assert get_catalog.call_count == 1
+    with patch("app.reco.catalog.get_catalog", return_value=keyed), \
+         patch.object(settings, "USE_EMBEDDING", 0):
+        hit = client.post("/recommend", json=body)
+        recommend_cache.clear()
+        fresh = client.post("/recommend", json=body)
+    assert hit.headers["X-Cache"] == "HIT"
+    assert res.json() == fresh.json()
+    recommend_cache.clear()
+
+
+def test_recommend_rejects_invalid_diversity():
+    client = TestClient(app)
+    for diversity in [{"mmr_lambda": 2}, {"mmr_lambda": -1}, {"max_per_brewery": 0}, {"max_per_prefecture": -3}]:
+        res = client.post("/recommend", json={"text": "辛口", "diversity": diversity})
+        assert res.status_code == 422
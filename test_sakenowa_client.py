@@ -0,0 +1,70 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from scripts.sakenowa_client import SakenowaClient
+
+# さけのわデータAPIのスタブ (パス -> レスポンス)
+PAYLOADS = {
+    "areas": {"areas": [{"id": 1, "name": "新潟県"}]},
+    "breweries": {"breweries": [{"id": 10, "name": "朝日酒造", "areaId": 1}]},
+    "brands": {"brands": [{"id": 100, "name": "久保田", "breweryId": 10}]},
+    "flavor-charts": {"flavorCharts": [{"brandId": 100, "f1": 0.1, "f2": 0.2, "f3": 0.3, "f4": 0.4, "f5": 0.5, "f6": 0.6}]},
+    "flavor-tags": {"tags": [{"id": 1, "tag": "フルーティ"}]},
+    "brand-flavor-tags": {"flavorTags": [{"brandId": 100, "tagIds": [1]}]},
+    "rankings": {"yearMonth": 202401, "overall": [{"rank": 1, "brandId": 100, "score": 4.5}]},
+}
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    # 各パスのETag (テストから書き換えて「更新」を表す)
+    etags = {path: f'"{path}-v1"' for path in PAYLOADS}
+    requests = []
+
+    def do_GET(self):
+        path = self.path.rsplit("/", 1)[-1]
+        etag = self.etags[path]
+        if self.headers.get("If-None-Match") == etag:
+            self.requests.append((path, 304))
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.requests.append((path, 200))
+        body = json.dumps(PAYLOADS[path]).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_fetch_all_uses_conditional_requests(tmp_path):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}/api"
+    try:
+        # 1回目: 全件ダウンロードしてキャッシュに保存する
+        with SakenowaClient(base_url=base_url, cache_dir=str(tmp_path)) as client:
+            first = client.fetch_all()
+            assert client.unchanged == client.unchanged_keys == set()
+        assert first["brands"] == PAYLOADS["brands"]["brands"]
+        assert first["rankings"] == [PAYLOADS["rankings"]]
+        assert sorted(status for _, status in _StubHandler.requests) == [200] * len(PAYLOADS)
+
+        # 2回目: brands だけ更新された
+        _StubHandler.requests.clear()
+        _StubHandler.etags["brands"] = '"brands-v2"'
+        with SakenowaClient(base_url=base_url, cache_dir=str(tmp_path)) as client:
+            second = client.fetch_all()
+            assert client.unchanged == set(PAYLOADS) - {"brands"}
+            assert client.unchanged_keys == {"areas", "breweries", "flavor_charts", "tags", "brand_tags", "rankings"}
+        assert second == first
+        assert dict(_StubHandler.requests)["brands"] == 200
+        assert sum(status == 304 for _, status in _StubHandler.requests) == len(PAYLOADS) - 1
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,426 @@
+import json
+import random
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+from pydantic import ValidationError
+
+from app.config import settings
+from app.models import RecommendationRequest, RecommendationFilters, RecommendationDiversity
+from app.reco import diversity, engine, neighbors, popularity
+from app.reco.catalog import Catalog
+from app.reco.scoring import top_k
+from app.reco.search import semantic_search
+
+
+def _dummy_catalog(n: int = 300, dim: int = 64, with_flavor: bool = False, with_popularity: bool = False) -> Catalog:
+    rnd = random.Random(0)
+    prefs = ["新潟県", "山口県", "兵庫県", "青森県"]
+    rows = []
+    for i in range(n):
+        # 同点が多い実データに合わせて、一部は既定ベクトルにする
+        vector = [0.0, 0.0, 0.0, 0.0] if i % 3 == 0 else [rnd.choice([-1.0, -0.5, 0.0, 0.5, 1.0]) for _ in range(4)]
+        rows.append({
+            "sake_id": i + 1,
+            "name": f"Sake {i}",
+            "brewery": f"Brewery {i % 17}",
+            "prefecture": prefs[i % len(prefs)],
+            "vector": vector,
+            "embedding": [rnd.gauss(0, 1) for _ in range(dim)] if i % 5 else None,
+            "flavor": [rnd.random() for _ in range(6)] if with_flavor and i % 4 else None,
+            "popularity": rnd.random() if with_popularity and i % 2 else 0.0,
+        })
+    return Catalog.from_rows(rows, fingerprint=("test",))
+
+
+def _run(req: RecommendationRequest, vectorized: int, use_embedding: int, q_embedding=None):
+    with patch.object(settings, "USE_VECTORIZED_SCORING", vectorized), \
+         patch.object(settings, "USE_EMBEDDING", use_embedding), \
+         patch("app.reco.engine.get_embedding_client") as MockClient:
+        if q_embedding is None:
+            MockClient.return_value.get_query_embedding.side_effect = RuntimeError("no api")
+        else:
+            MockClient.return_value.get_query_embedding.return_value = q_embedding
+        return engine.recommend(req)
+
+
+def test_vectorized_matches_loop():
+    cat = _dummy_catalog()
+    q_embedding = [random.Random(1).gauss(0, 1) for _ in range(64)]
+    requests = [
+        RecommendationRequest(text="フルーティで甘口", top_k=10),
+        RecommendationRequest(text="辛口ですっきり", top_k=50),
+        RecommendationRequest(text="ダミー", top_k=5),
+        RecommendationRequest(
+            text="濃厚",
+            top_k=7,
+            filters=RecommendationFilters(prefecture=["新潟県", "兵庫県"], exclude_brewery=["Brewery 1"]),
+        ),
+    ]
+    with patch("app.reco.catalog.get_catalog", return_value=cat):
+        for req in requests:
+            for use_embedding, q_emb in [(0, None), (1, None), (1, q_embedding)]:
+                loop = _run(req, 0, use_embedding, q_emb)
+                vec = _run(req, 1, use_embedding, q_emb)
+                assert loop.mode == vec.mode
+                assert [r.sake_id for r in loop.recommendations] == [r.sake_id for r in vec.recommendations]
+                for a, b in zip(loop.recommendations, vec.recommendations):
+                    assert abs(a.score - b.score) < 1e-9
+                    assert abs(a.distance - b.distance) < 1e-9
+                    assert a.reason == b.reason
+
+
+def test_flavor_blend_matches_across_paths():
+    cat = _dummy_catalog(with_flavor=True)
+    assert cat.has_flavor.sum() == 225
+    assert np.allclose(np.linalg.norm(cat.flavor_unit[cat.has_flavor], axis=1), 1.0)
+    assert not cat.flavor_unit[~cat.has_flavor].any()
+
+    q_embedding = [random.Random(1).gauss(0, 1) for _ in range(64)]
+    requests = [
+        RecommendationRequest(text="フルーティで甘口", top_k=10),
+        RecommendationRequest(text="辛口ですっきり", top_k=20,
+                              filters=RecommendationFilters(prefecture=["新潟県", "兵庫県"])),
+        RecommendationRequest(text="ダミー", top_k=5),
+    ]
+    with patch("app.reco.catalog.get_catalog", return_value=cat), \
+         patch.object(settings, "USE_FLAVOR_SCORING", 1):
+        for req in requests:
+            for use_embedding, q_emb in [(0, None), (1, q_embedding)]:
+                loop = _run(req, 0, use_embedding, q_emb)
+                vec = _run(req, 1, use_embedding, q_emb)
+                with patch.object(settings, "USE_VECTORIZED_SCORING", 1):
+                    (batch, error), = engine.rank_batch([req], [q_emb])
+                assert error is None
+                # 辞書にヒットしないクエリは合成しない
+                assert (loop.query.flavor_vector is None) == (req.text == "ダミー")
+                for other in (vec, batch):
+                    assert other.query.flavor_vector == loop.query.flavor_vector
+                    assert [r.sake_id for r in loop.recommendations] == [r.sake_id for r in other.recommendations]
+                    for a, b in zip(loop.recommendations, other.recommendations):
+                        assert abs(a.score - b.score) < 1e-9
+                        assert abs(a.distance - b.distance) < 1e-9
+
+
+def test_popularity_priors_decay_by_month():
+    history = [
+        # 最新月(2024/01)の1位と、1年以上前(圏外)の1位
+        (1, 202401, 1), (2, 202401, 2), (3, 202401, 4),
+        (2, 202312, 1), (1, 202312, 2),
+        (4, 202212, 1),
+    ]
+    priors = popularity.compute_priors(history, half_life_months=1, months=12)
+    assert 4 not in priors
+    # 2024/01 の重み 1、2023/12 の重み 0.5 (最下位を0.25~1位を1に写す)
+    assert abs(priors[1] - (1.0 + 0.5 * 0.5) / 1.5) < 1e-12
+    assert abs(priors[2] - (0.75 + 0.5 * 1.0) / 1.5) < 1e-12
+    assert abs(priors[3] - 0.25 / 1.5) < 1e-12
+    assert priors == popularity.compute_priors(reversed(history), half_life_months=1, months=12)
+    assert popularity.compute_priors([], 3, 12) == {}
+
+
+def test_popularity_boost_breaks_ties():
+    cat = _dummy_catalog(with_popularity=True)
+    req = RecommendationRequest(text="ダミー", top_k=20)
+    with patch("app.reco.catalog.get_catalog", return_value=cat), \
+         patch.object(settings, "USE_POPULARITY_PRIOR", 1):
+        loop = _run(req, 0, 0)
+        vec = _run(req, 1, 0)
+        with patch.object(settings, "USE_VECTORIZED_SCORING", 1):
+            (batch, error), = engine.rank_batch([req], [None])
+    assert error is None
+    # 既定ベクトル(同点)の銘柄は人気度の高い順
+    rows = [cat.row_of[r.sake_id] for r in loop.recommendations]
+    assert all(cat.taste[i].tolist() == [0.0, 0.0, 0.0, 0.0] for i in rows)
+    assert [cat.popularity[i] for i in rows] == sorted((cat.popularity[i] for i in rows), reverse=True)
+    assert cat.popularity[rows[0]] == max(cat.popularity[i] for i in range(0, len(cat), 3))
+    for other in (vec, batch):
+        assert [r.sake_id for r in loop.recommendations] == [r.sake_id for r in other.recommendations]
+        for a, b in zip(loop.recommendations, other.recommendations):
+            assert abs(a.score - b.score) < 1e-9
+
+
+def test_staged_ranking_matches_single_pass():
+    cat = _dummy_catalog(with_flavor=True, with_popularity=True)
+    q_embedding = [random.Random(1).gauss(0, 1) for _ in range(64)]
+    requests = [
+        RecommendationRequest(text="フルーティで甘口", top_k=10, debug=True),
+        RecommendationRequest(text="辛口ですっきり", top_k=20,
+                              filters=RecommendationFilters(prefecture=["新潟県", "兵庫県"])),
+        RecommendationRequest(text="ダミー", top_k=5),
+    ]
+    with patch("app.reco.catalog.get_catalog", return_value=cat), \
+         patch.object(settings, "USE_FLAVOR_SCORING", 1), \
+         patch.object(settings, "USE_POPULARITY_PRIOR", 1):
+        for req in requests:
+            for use_embedding, q_emb in [(0, None), (1, q_embedding)]:
+                single = _run(req, 1, use_embedding, q_emb)
+                # 候補生成で全行を残せば1段の場合と同じ
+                with patch.object(settings, "USE_STAGED_RANKING", 1), \
+                     patch.object(settings, "RETRIEVE_CANDIDATES", len(cat)):
+                    staged = _run(req, 1, use_embedding, q_emb)
+                assert [r.sake_id for r in staged.recommendations] == [r.sake_id for r in single.recommendations]
+                for a, b in zip(staged.recommendations, single.recommendations):
+                    assert abs(a.score - b.score) < 1e-9
+                    assert abs(a.distance - b.distance) < 1e-9
+                assert single.debug_info is None
+                assert (staged.debug_info is not None) == bool(req.debug)
+
+        # 同じ指標(味ベクトルのL2距離)なら、候補を絞っても結果は変わらない
+        req = RecommendationRequest(text="辛口ですっきり", top_k=10, debug=True)
+        with patch.object(settings, "USE_FLAVOR_SCORING", 0), \
+             patch.object(settings, "USE_POPULARITY_PRIOR", 0):
+            single = _run(req, 1, 0)
+            with patch.object(settings, "USE_STAGED_RANKING", 1), \
+                 patch.object(settings, "RETRIEVE_CANDIDATES", 40):
+                staged = _run(req, 1, 0)
+    assert [r.sake_id for r in staged.recommendations] == [r.sake_id for r in single.recommendations]
+    retrieve, rerank = staged.debug_info["stages"]
+    assert (retrieve["stage"], retrieve["method"], retrieve["input"], retrieve["output"]) == ("retrieve", "taste_l2", 300, 40)
+    assert (rerank["stage"], rerank["input"], rerank["output"]) == ("rerank", 40, 10)
+    assert retrieve["elapsed_ms"] >= 0 and rerank["elapsed_ms"] >= 0
+
+
+def _ranked_all_paths(req: RecommendationRequest, use_embedding: int, q_emb):
+    responses = [_run(req, 0, use_embedding, q_emb), _run(req, 1, use_embedding, q_emb)]
+    with patch.object(settings, "USE_STAGED_RANKING", 1):
+        responses.append(_run(req, 1, use_embedding, q_emb))
+    with patch.object(settings, "USE_VECTORIZED_SCORING", 1):
+        (batch, error), = engine.rank_batch([req], [q_emb])
+    assert error is None
+    responses.append(batch)
+    return responses
+
+
+def test_diversity_reranks_candidate_pool():
+    cat = _dummy_catalog()
+    q_embedding = [random.Random(1).gauss(0, 1) for _ in range(64)]
+    with patch("app.reco.catalog.get_catalog", return_value=cat):
+        for use_embedding, q_emb in [(0, None), (1, q_embedding)]:
+            # mmr_lambda=1 で上限なしなら通常の上位top_k件と同じ
+            req = RecommendationRequest(text="辛口ですっきり", top_k=10)
+            plain = _run(req, 1, use_embedding, q_emb)
+            same = RecommendationRequest(text="辛口ですっきり", top_k=10, diversity=RecommendationDiversity(mmr_lambda=1.0))
+            for response in _ranked_all_paths(same, use_embedding, q_emb):
+                assert [r.sake_id for r in response.recommendations] == [r.sake_id for r in plain.recommendations]
+
+            # 蔵元/都道府県ごとの上限を守り、全ての経路で同じ結果になる
+            capped = RecommendationRequest(text="ダミー", top_k=8, diversity=RecommendationDiversity(
+                mmr_lambda=0.5, max_per_brewery=1, max_per_prefecture=2))
+            responses = _ranked_all_paths(capped, use_embedding, q_emb)
+            ids = [r.sake_id for r in responses[0].recommendations]
+            assert len(ids) == 8
+            assert len({r.brewery for r in responses[0].recommendations}) == 8
+            prefs = [r.prefecture for r in responses[0].recommendations]
+            assert max(prefs.count(p) for p in prefs) <= 2
+            for response in responses[1:]:
+                assert [r.sake_id for r in response.recommendations] == ids
+                for a, b in zip(responses[0].recommendations, response.recommendations):
+                    assert abs(a.score - b.score) < 1e-9
+
+    # ほぼ同じ味ベクトルの銘柄ばかりにならない
+    rows = [{"sake_id": i + 1, "name": f"Sake {i}", "brewery": f"Brewery {i}", "prefecture": "新潟県",
+             "vector": vector, "embedding": None}
+            for i, vector in enumerate([[1.0, 1.0, 0.0, 0.0], [1.0, 1.0, 0.0, 0.0], [1.0, 0.9, 0.0, 0.0], [-1.0, -1.0, 0.0, 0.0]])]
+    small = Catalog.from_rows(rows, fingerprint=("test",))
+    pool = np.arange(4)
+    relevance = np.asarray([0.9, 0.89, 0.88, 0.7])
+    assert diversity.mmr(small, pool, relevance, 3, 1.0).tolist() == [0, 1, 2]
+    # 完全に同じ銘柄(1)より少し違う銘柄(2)を選ぶ
+    assert diversity.mmr(small, pool, relevance, 3, 0.5).tolist() == [0, 3, 2]
+    assert diversity.mmr(small, pool, relevance, 3, 0.5, max_per_prefecture=2).tolist() == [0, 3]
+
+
+def test_diversity_options_are_validated():
+    assert RecommendationDiversity(mmr_lambda=0.0, max_per_brewery=1, max_per_prefecture=1).mmr_lambda == 0.0
+    assert RecommendationDiversity(mmr_lambda=1.0).max_per_brewery is None
+    for bad in [{"mmr_lambda": -0.1}, {"mmr_lambda": 1.5}, {"max_per_brewery": 0},
+                {"max_per_brewery": -1}, {"max_per_prefecture": 0}]:
+        with pytest.raises(ValidationError):
+            RecommendationDiversity(**bad)
+        with pytest.raises(ValidationError):
+            RecommendationRequest.model_validate({"text": "辛口", "diversity": bad})
+
+
+def test_filter_rows_matches_loop():
+    cat = _dummy_catalog()
+    cases = [
+        (None, None),
+        ([], []),
+        (["新潟県"], None),
+        (["新潟県", "兵庫県", "新潟県", "沖縄県"], ["Brewery 1", "Brewery 16"]),
+        (None, ["Brewery"]),
+        (["沖縄県"], None),
+    ]
+    for prefectures, exclude in cases:
+        expected = []
+        for i in range(len(cat)):
+            if prefectures and cat.prefectures[i] not in prefectures:
+                continue
+            brewery = cat.breweries[i]
+            if exclude and any(brewery and excl in brewery for excl in exclude):
+                continue
+            expected.append(i)
+        assert cat.filter_rows(prefectures, exclude).tolist() == expected
+
+
+def test_batch_matches_single():
+    cat = _dummy_catalog()
+    rnd = random.Random(2)
+    requests = [
+        RecommendationRequest(text="フルーティで甘口", top_k=10),
+        RecommendationRequest(text="辛口ですっきり", top_k=50, debug=True),
+        RecommendationRequest(text="濃厚", top_k=7,
+                              filters=RecommendationFilters(prefecture=["新潟県"], exclude_brewery=["Brewery 1"])),
+        RecommendationRequest(text="ダミー", top_k=3, filters=RecommendationFilters(prefecture=["沖縄県"])),
+    ]
+    q_embeddings = [[rnd.gauss(0, 1) for _ in range(64)] for _ in requests]
+    q_embeddings[1] = None
+    with patch("app.reco.catalog.get_catalog", return_value=cat), \
+         patch.object(settings, "USE_VECTORIZED_SCORING", 1):
+        batch = engine.rank_batch(requests, q_embeddings)
+        for req, q_emb, (response, error) in zip(requests, q_embeddings, batch):
+            assert error is None
+            single = engine.rank(req, q_emb)
+            assert response.mode == single.mode
+            assert [r.sake_id for r in response.recommendations] == [r.sake_id for r in single.recommendations]
+            for a, b in zip(response.recommendations, single.recommendations):
+                assert abs(a.score - b.score) < 1e-9
+                assert abs(a.distance - b.distance) < 1e-9
+                assert a.reason == b.reason
+
+
+def test_l2_many_matches_l2():
+    rnd = np.random.default_rng(0)
+    cat = _dummy_catalog()
+    queries = np.vstack([rnd.normal(size=(5, 4)), cat.taste[:3]])
+    scores, dists = cat.scorer.l2_many(queries)
+    for qi, q in enumerate(queries):
+        expected_scores, expected_dists = cat.scorer.l2(q)
+        assert np.allclose(dists[qi], expected_dists, atol=1e-7)
+        assert np.allclose(scores[qi], expected_scores, atol=1e-7)
+    # 自分自身との距離は負の平方根にならず0になる
+    assert np.all(dists[5:][np.arange(3), np.arange(3)] < 1e-7)
+
+
+def test_batch_rejects_embedding_dimension_mismatch():
+    cat = _dummy_catalog(dim=64)
+    requests = [RecommendationRequest(text="辛口", top_k=3), RecommendationRequest(text="甘口", top_k=3)]
+    q_embeddings = [[0.1] * 32, [0.1] * 64]
+    with patch("app.reco.catalog.get_catalog", return_value=cat), \
+         patch.object(settings, "USE_VECTORIZED_SCORING", 1):
+        (bad, bad_error), (good, good_error) = engine.rank_batch(requests, q_embeddings)
+        single = engine.rank(requests[1], q_embeddings[1])
+    assert bad is None and "dimension 32" in bad_error
+    # 他のリクエストのEmbeddingは切り詰められない
+    assert good_error is None
+    assert good.mode == "embedding"
+    assert [r.sake_id for r in good.recommendations] == [r.sake_id for r in single.recommendations]
+
+
+def test_single_rank_and_search_do_not_truncate_mismatched_embedding():
+    cat = _dummy_catalog(dim=64)
+    req = RecommendationRequest(text="辛口", top_k=5)
+    with pytest.raises(ValueError, match="dimension 32"):
+        cat.scorer.cosine([0.1] * 32)
+    for vectorized in (0, 1):
+        with patch("app.reco.catalog.get_catalog", return_value=cat), \
+             patch.object(settings, "USE_VECTORIZED_SCORING", vectorized):
+            res = engine.rank(req, [0.1] * 32)
+            expected = engine.rank(req, None)
+        # 切り詰めずに dict モード(味ベクトルのL2)で返す
+        assert res.mode == "dict"
+        assert [(r.sake_id, r.score) for r in res.recommendations] == \
+            [(r.sake_id, r.score) for r in expected.recommendations]
+    # セマンティック検索は空 (キーワード検索にフォールバック)
+    assert semantic_search(cat, [0.1] * 32, limit=5) == []
+    assert len(semantic_search(cat, [0.1] * 64, limit=5)) == 5
+
+
+def test_top_k_keeps_stable_order_for_ties():
+    scores = np.array([0.5, 0.9, 0.5, 0.9, 0.1, 0.5])
+    assert top_k(scores, 3).tolist() == [1, 3, 0]
+    assert top_k(scores, 4).tolist() == [1, 3, 0, 2]
+    assert top_k(scores, 10).tolist() == [1, 3, 0, 2, 5, 4]
+    assert top_k(scores[:0], 3).tolist() == []
+
+    # 全件同点でも並べ替えるのはk件だけ
+    flat = np.full(10000, 0.5)
+    flat[[7, 42]] = 0.9
+    with patch("app.reco.scoring.np.lexsort", wraps=np.lexsort) as lexsort:
+        assert top_k(flat, 5).tolist() == [7, 42, 0, 1, 2]
+    assert len(lexsort.call_args.args[0][0]) == 5
+
+
+def test_blocked_neighbors_match_brute_force():
+    cat = _dummy_catalog(n=120, dim=16)
+    all_ids = np.arange(len(cat))
+    for method in neighbors.NEIGHBOR_METHODS:
+        rows = neighbors.select_rows(cat)
+        result = dict(neighbors.iter_neighbors(cat, rows, n_neighbors=5, method=method, block_size=7))
+        assert len(result) == len(cat)
+        for i, sake_id in enumerate(cat.sake_ids):
+            # 1銘柄ずつ /recommend と同じ規則でスコアリングする
+            use_embedding = method == "auto" and bool(cat.has_embedding[i])
+            q_embedding = cat.embeddings[i] if use_embedding else None
+            scores, _ = cat.scorer.score(cat.taste[i], q_embedding, use_embedding, all_ids)
+            scores[i] = -np.inf
+            expected = [cat.sake_ids[j] for j in top_k(scores, 5)]
+            assert [nid for nid, _, _ in result[sake_id]] == expected
+
+
+def test_neighbors_exclude_self_when_n_exceeds_catalog():
+    cat = _dummy_catalog(n=5, dim=8)
+    rows = neighbors.select_rows(cat)
+    for method in neighbors.NEIGHBOR_METHODS:
+        for sake_id, result in neighbors.iter_neighbors(cat, rows, n_neighbors=10, method=method):
+            ids = [nid for nid, _, _ in result]
+            assert sorted(ids) == sorted(set(cat.sake_ids) - {sake_id})
+            assert all(np.isfinite(score) for _, score, _ in result)
+            # NDJSON は厳密なJSONとして読める (-Infinity などを含まない)
+            line = neighbors.to_ndjson(sake_id, result, method, cat.neighbor_version)
+            json.loads(line, parse_constant=lambda c: pytest.fail(f"non-finite value {c}"))
+
+
+def test_neighbor_shards_cover_catalog_once():
+    cat = _dummy_catalog(n=50)
+    shards = [neighbors.select_rows(cat, shard=s, num_shards=3) for s in range(3)]
+    assert sorted(np.concatenate(shards).tolist()) == list(range(len(cat)))
+    # 再開: after より後の銘柄だけ
+    assert [cat.sake_ids[i] for i in neighbors.select_rows(cat, after=45)] == [46, 47, 48, 49, 50]
+
+
+def test_similar_precomputed_matches_live():
+    cat = _dummy_catalog(n=200, dim=16)
+    rows = neighbors.select_rows(cat)
+    stored = {sake_id: result for sake_id, result in neighbors.iter_neighbors(cat, rows, n_neighbors=20)}
+    cases = [
+        (5, None),
+        (5, RecommendationFilters(prefecture=["新潟県"])),
+        (3, RecommendationFilters(prefecture=["山口県", "青森県"], exclude_brewery=["Brewery 1"])),
+        # 保存済み20件を絞り込むとtop_k件に満たない → その場で計算
+        (15, RecommendationFilters(prefecture=["兵庫県"])),
+    ]
+    with patch("app.reco.catalog.get_catalog", return_value=cat):
+        for sake_id in [1, 2, 7, 50]:
+            for top_k, filters in cases:
+                with patch("app.database.get_sake_neighbors", return_value=stored[sake_id]):
+                    pre = engine.similar(sake_id, top_k=top_k, filters=filters)
+                with patch("app.database.get_sake_neighbors", return_value=[]):
+                    live = engine.similar(sake_id, top_k=top_k, filters=filters)
+                assert live.source == "live"
+                assert [r.sake_id for r in pre.recommendations] == [r.sake_id for r in live.recommendations]
+                assert sake_id not in [r.sake_id for r in live.recommendations]
+        assert engine.similar(99999) is None
+
+
+if __name__ == "__main__":
+    test_vectorized_matches_loop()
+    test_filter_rows_matches_loop()
+    test_batch_matches_single()
+    test_top_k_keeps_stable_order_for_ties()
+    test_blocked_neighbors_match_brute_force()
+    test_neighbor_shards_cover_catalog_once()
+    test_similar_precomputed_matches_live()
+    print("OK")
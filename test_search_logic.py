@@ -0,0 +1,86 @@
+from unittest.mock import patch
+
+import numpy as np
+
+from app import database as db
+from app.config import settings
+from app.db.core import apply_schema, get_conn, get_read_conn
+from app.reco.catalog import Catalog
+from app.reco.search import reciprocal_rank_fusion, semantic_search
+from scripts.init_db import apply_search_fts
+
+
+def test_rrf_prefers_items_in_both_lists():
+    fused = reciprocal_rank_fusion([[1, 2, 3], [3, 4, 1]], k=60)
+    # 1 と 3 は両方のリストに出現する
+    assert fused[:2] == [1, 3]
+    # 同点 (2 と 4 はどちらも片方の2位) は sake_id 順
+    assert fused[2:] == [2, 4]
+
+
+def test_semantic_search_ranks_by_cosine_and_skips_missing_embeddings():
+    rows = [
+        {"sake_id": 10, "name": "A", "brewery": "", "prefecture": "", "vector": [0, 0, 0, 0], "embedding": [1.0, 0.0]},
+        {"sake_id": 11, "name": "B", "brewery": "", "prefecture": "", "vector": [0, 0, 0, 0], "embedding": None},
+        {"sake_id": 12, "name": "C", "brewery": "", "prefecture": "", "vector": [0, 0, 0, 0], "embedding": [0.6, 0.8]},
+        {"sake_id": 13, "name": "D", "brewery": "", "prefecture": "", "vector": [0, 0, 0, 0], "embedding": [-1.0, 0.0]},
+    ]
+    cat = Catalog.from_rows(rows, fingerprint=("test",))
+    result = semantic_search(cat, [0.0, 1.0], limit=3)
+    assert [cat.sake_ids[i] for i, _ in result] == [12, 10, 13]
+    assert np.isclose(result[0][1], 0.8)
+
+
+SEARCH_SAKES = [
+    # (銘柄名, 蔵元, 都道府県, 別名, テキスト)
+    ("久保田 千寿", "朝日酒造", "新潟県", ["くぼた", "KUBOTA"], ["淡麗辛口の定番"]),
+    ("獺祭 純米大吟醸", "旭酒造", "山口県", ["だっさい", "Dassai"], ["精米歩合50%の華やかな香り"]),
+    ("八海山", "八海醸造", "新潟県", [], ["久保田と並ぶ新潟の定番", "score_a"]),
+    ("十四代", "高木酒造", "山形県", ["じゅうよんだい"], []),
+]
+
+
+def _ids(rows):
+    return sorted(row["sake_id"] for row in rows)
+
+
+def test_fts_and_like_search_return_same_sakes(tmp_path):
+    with patch.object(settings, "DB_PATH", str(tmp_path / "sake.db")):
+        with get_conn() as conn:
+            apply_schema(conn)
+            assert apply_search_fts(conn)
+            # 索引作成後の追加はトリガーで反映される
+            for sake_id, (name, brewery, prefecture, aliases, texts) in enumerate(SEARCH_SAKES, start=1):
+                conn.execute("INSERT INTO sake_master (sake_id, name, brewery, prefecture) VALUES (?, ?, ?, ?)",
+                             (sake_id, name, brewery, prefecture))
+                for alias in aliases:
+                    conn.execute("INSERT INTO sake_aliases (sake_id, alias) VALUES (?, ?)", (sake_id, alias))
+                for text in texts:
+                    conn.execute("INSERT INTO sake_texts (sake_id, source, text) VALUES (?, 'official', ?)", (sake_id, text))
+
+        queries = {
+            # 1文字/2文字 (trigramでは引けないのでLIKEで検索する)
+            1: ["酒", "田", "%", "_", "k"],
+            2: ["新潟", "久保", "だっ", "定番", "酒造", "50"],
+            # 3文字以上 (別名・大文字小文字・ワイルドカード文字を含む)
+            3: ["久保田", "だっさい", "dassai", "KUBO", "朝日酒造", "純米大吟醸", "50%", "e_a", "山形県", "存在しない"],
+        }
+        with get_read_conn() as conn:
+            for length, words in queries.items():
+                for query in words:
+                    for in_texts in (False, True):
+                        like = _ids(db._search_like(conn, query, 100, in_texts))
+                        result = _ids([item.model_dump() for item in db.search_sakes(query, 100, in_texts)])
+                        assert result == like, (query, in_texts)
+                        if length >= 3:
+                            assert _ids(db._search_fts(conn, query, 100, in_texts)) == like, (query, in_texts)
+
+        # 別名でも引ける
+        assert _ids([item.model_dump() for item in db.search_sakes("だっさい", 10)]) == [2]
+        assert _ids([item.model_dump() for item in db.search_sakes("じゅう", 10)]) == [4]
+        # ワイルドカードは文字として扱う
+        assert _ids([item.model_dump() for item in db.search_sakes("_", 10, in_texts=True)]) == [3]
+        # 3文字以上は bm25 の関連度順 (銘柄名のヒットが説明文のヒットより先)、LIKE は都道府県/蔵元順
+        assert [item.sake_id for item in db.search_sakes("久保田", 10, in_texts=True)] == [1, 3]
+        with get_read_conn() as conn:
+            assert [row["sake_id"] for row in db._search_like(conn, "久保田", 10, True)] == [3, 1]
@@ -0,0 +1,93 @@
+import json
+from pathlib import Path
+from unittest.mock import patch
+
+from fastapi.testclient import TestClient
+
+from app.config import settings
+from app.db.core import apply_schema, get_conn
+from app.main import app
+from app.reco.catalog import load_catalog
+from scripts.export_neighbors import export_neighbors
+
+SAKES = [
+    ("久保田", "朝日酒造", "新潟県", [-1.0, -0.5, 0.0, 0.0]),
+    ("獺祭", "旭酒造", "山口県", [0.5, 0.0, 1.0, 1.0]),
+    ("八海山", "八海醸造", "新潟県", [-1.0, -1.0, 0.0, 0.0]),
+    ("十四代", "高木酒造", "山形県", [0.5, 0.5, 1.0, 0.5]),
+    ("越乃寒梅", "石本酒造", "新潟県", [-0.5, -1.0, 0.0, -0.5]),
+]
+
+
+def _seed(conn):
+    apply_schema(conn)
+    for sake_id, (name, brewery, prefecture, vector) in enumerate(SAKES, start=1):
+        conn.execute("INSERT INTO sake_master (sake_id, name, brewery, prefecture) VALUES (?, ?, ?, ?)",
+                     (sake_id, name, brewery, prefecture))
+        conn.execute("INSERT INTO sake_vectors (sake_id, taste_vector, version) VALUES (?, ?, 'v1-dict')",
+                     (sake_id, json.dumps(vector)))
+
+
+def test_similar_endpoint_serves_exported_neighbors(tmp_path):
+    output = tmp_path / "neighbors.ndjson"
+    with patch.object(settings, "DB_PATH", str(tmp_path / "sake.db")):
+        with get_conn() as conn:
+            _seed(conn)
+        # 既定の --n 10 は銘柄数(5)より多い
+        assert export_neighbors(n_neighbors=10, output=str(output)) == len(SAKES)
+        for line in output.read_text(encoding="utf-8").splitlines():
+            rec = json.loads(line, parse_constant=lambda c: (_ for _ in ()).throw(ValueError(c)))
+            assert rec["sake_id"] not in [nb["sake_id"] for nb in rec["neighbors"]]
+            assert len(rec["neighbors"]) == len(SAKES) - 1
+
+        cat = load_catalog()
+        # 旧版のエクスポートが保存した自分自身の行 (score=-inf) は読み飛ばす
+        with get_conn() as conn:
+            conn.execute("""
+                INSERT INTO sake_neighbors (sake_id, rank, neighbor_id, score, distance, method, catalog_version)
+                VALUES (1, 99, 1, ?, ?, 'auto', ?)
+            """, (float("-inf"), float("inf"), cat.neighbor_version))
+
+        with patch("app.reco.catalog.get_catalog", return_value=cat):
+            client = TestClient(app)
+            res = client.get("/sakes/1/similar", params={"top_k": 5})
+            assert res.status_code == 200
+            body = res.json()
+            assert body["source"] == "precomputed"
+            ids = [item["sake_id"] for item in body["recommendations"]]
+            assert sorted(ids) == [2, 3, 4, 5]
+            # 味ベクトルが最も近いのは八海山
+            assert ids[0] == 3
+
+            filtered = client.get("/sakes/1/similar", params={"top_k": 2, "prefecture": "新潟県"}).json()
+            assert [item["sake_id"] for item in filtered["recommendations"]] == [3, 5]
+            assert client.get("/sakes/999/similar").status_code == 404
+
+
+def test_neighbors_are_kept_per_method(tmp_path):
+    with patch.object(settings, "DB_PATH", str(tmp_path / "sake.db")):
+        with get_conn() as conn:
+            _seed(conn)
+            # 主キーが (sake_id, rank) だった旧版のテーブル
+            conn.execute("DROP TABLE sake_neighbors")
+            conn.execute("""
+                CREATE TABLE sake_neighbors (
+                  sake_id INTEGER NOT NULL, rank INTEGER NOT NULL, neighbor_id INTEGER NOT NULL,
+                  score REAL NOT NULL, distance REAL NOT NULL, method TEXT NOT NULL,
+                  catalog_version TEXT NOT NULL, computed_at TEXT NOT NULL DEFAULT (datetime('now')),
+                  PRIMARY KEY (sake_id, rank)
+                ) WITHOUT ROWID
+            """)
+            conn.execute("INSERT INTO sake_neighbors (sake_id, rank, neighbor_id, score, distance, method, catalog_version) "
+                         "VALUES (1, 1, 3, 0.9, 0.1, 'auto', 'old')")
+            apply_schema(conn)
+        with get_conn() as conn:
+            pk = [row[1] for row in sorted(conn.execute("PRAGMA table_info(sake_neighbors)"), key=lambda r: r[5]) if row[5]]
+            assert pk == ["sake_id", "method", "rank"]
+            assert [tuple(row) for row in conn.execute("SELECT sake_id, neighbor_id, method FROM sake_neighbors")] == [(1, 3, "auto")]
+
+        export_neighbors(n_neighbors=2, method="auto", output=str(tmp_path / "auto.ndjson"))
+        export_neighbors(n_neighbors=2, method="taste", output=str(tmp_path / "taste.ndjson"))
+        with get_conn() as conn:
+            counts = [tuple(row) for row in conn.execute("SELECT method, COUNT(*) FROM sake_neighbors GROUP BY method ORDER BY method")]
+        assert counts == [("auto", 2 * len(SAKES)), ("taste", 2 * len(SAKES))]
@@ -1,4 +1,5 @@
 from app.reco import estimate_taste_vector
+from app.reco.taste_v1 import LEXICONS, _matcher
 
 test_cases = [
     "甘口でフルーティなモダンな酒",
@@ -9,8 +10,31 @@ test_cases = [
 ]
 
 for text in test_cases:
-    vector, scores = estimate_taste_vector(text)
+    vector, scores, hits = estimate_taste_vector(text)
     print(f"Text: {text}")
     print(f"Vector: {vector}")
     print(f"Scores: {scores}")
+    print(f"Hits: {hits}")
     print("-" * 20)
+
+
+def _scan(text):
+    # 従来の実装 (辞書の単語ごとに部分一致)
+    scores, hits = {}, {}
+    for category, lexicon in LEXICONS:
+        matched = {k: v for k, v in lexicon.items() if k in text}
+        scores[category] = max(matched.values()) if matched else 0.0
+        hits[category] = list(matched.keys())
+    return scores, hits
+
+
+def test_matcher_matches_substring_scan():
+    words = [w for _, lexicon in LEXICONS for w in lexicon]
+    texts = test_cases + [
+        "".join(words),
+        "超辛口の甘酸っぱいジューシーな熟成酒、とろみのある甘口",
+        "".join(reversed(words)) + "。水のように軽い",
+        "該当なし",
+    ]
+    for text in texts:
+        assert _matcher.match(text) == _scan(text), text
@@ -0,0 +1,55 @@
+from unittest.mock import patch
+
+from fastapi.testclient import TestClient
+
+from app import database as db
+from app.config import settings
+from app.db.core import apply_schema, ensure_vector_columns, get_conn
+from app.main import app
+from scripts.compute_vectors import compute_vectors
+
+SAKES = [
+    ("久保田", "朝日酒造", "新潟県", "辛口ですっきり"),
+    ("獺祭", "旭酒造", "山口県", "フルーティで華やか"),
+    ("八海山", "八海醸造", "新潟県", "淡麗辛口"),
+]
+
+
+def _source_hashes():
+    with get_conn() as conn:
+        return dict(conn.execute("SELECT sake_id, source_hash FROM sake_vectors").fetchall())
+
+
+def test_editing_one_text_recomputes_only_that_sake(tmp_path):
+    with patch.object(settings, "DB_PATH", str(tmp_path / "sake.db")):
+        with get_conn() as conn:
+            apply_schema(conn)
+            ensure_vector_columns(conn)
+            for sake_id, (name, brewery, prefecture, text) in enumerate(SAKES, start=1):
+                conn.execute("INSERT INTO sake_master (sake_id, name, brewery, prefecture) VALUES (?, ?, ?, ?)",
+                             (sake_id, name, brewery, prefecture))
+                conn.execute("INSERT INTO sake_texts (sake_id, source, text) VALUES (?, 'official', ?)", (sake_id, text))
+        assert compute_vectors() == len(SAKES)
+        before = _source_hashes()
+
+        client = TestClient(app)
+        status = client.get("/vectors/status").json()
+        assert (status["total_sakes"], status["total_vectors"], status["pending_count"]) == (3, 3, 0)
+
+        # 何も変わっていなければ全銘柄のハッシュを計算し直さない
+        with patch("app.database.get_vector_sources", side_effect=AssertionError("recounted")):
+            assert client.get("/vectors/status").json()["pending_count"] == 0
+
+        with get_conn() as conn:
+            conn.execute("UPDATE sake_texts SET text = '濃醇で甘口' WHERE sake_id = 2")
+        with patch("app.database.get_vector_sources", wraps=db.get_vector_sources) as sources:
+            assert client.get("/vectors/status").json()["pending_count"] == 1
+            assert client.get("/vectors/status").json()["pending_count"] == 1
+        assert sources.call_count == 1
+
+        assert compute_vectors(incremental=True, dry_run=True) == 1
+        assert compute_vectors(incremental=True) == 1
+        after = _source_hashes()
+        assert [sake_id for sake_id in before if before[sake_id] != after[sake_id]] == [2]
+        # 同じ秒のうちに再計算しても(computed_at が変わらなくても)数え直す
+        assert client.get("/vectors/status").json()["pending_count"] == 0